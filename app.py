@@ -12,9 +12,17 @@ try:
 except Exception:
     pass  # Running locally without secrets.toml; .env file is used instead
 
-from src.rag import retrieve_context, answer_stream, _is_refused
+from src.api_client import RemoteAnswer, server_url
 from src.config import UI_DEFAULT_K
 
+# With a server URL configured the pipeline runs in src.server and this app is
+# only a client of it; otherwise it runs in-process.
+SERVER_URL = server_url()
+if SERVER_URL is None:
+    from src.rag import retrieve_context, answer_stream, _is_refused
+    from src.tracing import Trace
+    from src.usage import summarise as summarise_usage
+
 st.set_page_config(page_title="ML WikiTutor", page_icon="📚", layout="wide")
 
 st.markdown("""
@@ -69,15 +77,23 @@ if submitted:
     if not question.strip():
         st.warning("Enter a question first.")
     else:
+        if SERVER_URL is None:
+            trace = Trace("question", chunker=chunker, k=k, multiquery=use_multiquery)
         try:
             # ── Step 1: retrieval with live status updates ─────────────────
             with st.status("Retrieving from knowledge base...", expanded=True) as status:
                 if use_multiquery:
                     st.write("🔀 Generating query variants with LLM...")
                 st.write("🔍 Searching vector index...")
-                hits, context, sources, confidence = retrieve_context(
-                    question, k=k, chunker=chunker, use_multiquery=use_multiquery
-                )
+                if SERVER_URL is None:
+                    hits, context, sources, confidence = retrieve_context(
+                        question, k=k, chunker=chunker, use_multiquery=use_multiquery,
+                        trace=trace,
+                    )
+                else:
+                    remote = RemoteAnswer(SERVER_URL, question, k=k, chunker=chunker,
+                                          use_multiquery=use_multiquery)
+                    hits, sources, confidence = remote.hits, remote.sources, remote.confidence
                 n_chunks = len(sources)
                 n_articles = len({s["title"] for s in sources})
                 st.write(
@@ -94,14 +110,17 @@ if submitted:
             generating_msg = st.empty()
             generating_msg.caption("✍️ Generating answer...")
             st.subheader("Answer")
-            answer = st.write_stream(answer_stream(context, question))
+            if SERVER_URL is None:
+                answer = st.write_stream(answer_stream(context, question, trace=trace))
+            else:
+                answer = st.write_stream(remote.tokens())
             generating_msg.empty()
 
         except Exception as exc:
             st.error(f"Something went wrong: {exc}")
             st.stop()
 
-        refused = _is_refused(answer)
+        refused = _is_refused(answer) if SERVER_URL is None else remote.refused
 
         if not refused:
             st.markdown(
@@ -124,5 +143,14 @@ if submitted:
 
         with st.expander("🔎 Debug"):
             st.json(confidence)
+            if SERVER_URL is None:
+                total_ms, waterfall, spend = trace.total_ms(), trace.waterfall(), summarise_usage(trace.usage)
+            else:
+                total_ms = remote.trace.get("total_ms", 0.0)
+                waterfall, spend = remote.trace.get("waterfall", ""), remote.trace.get("usage", {})
+            st.caption(f"Latency by stage ({total_ms:.0f} ms total)")
+            st.code(waterfall, language=None)
+            st.caption("Token usage")
+            st.json(spend)
             for i, h in enumerate(hits, start=1):
                 st.write(i, h.fields.get("title"), getattr(h, "score", None))
@@ -15,3 +15,7 @@ uv run python -m src.ingest_wiki_api
 # 2) Upsert into the Qdrant Cloud token collection (wiki_ml_token)
 echo "=== Indexing into Qdrant (token chunker) ==="
 uv run python -m src.index_qdrant --chunker token
+
+# 3) Build the local BM25 index used by hybrid retrieval (data_processed/bm25_token/)
+echo "=== Building BM25 index (token chunker) ==="
+uv run python -m src.bm25 --chunker token
@@ -17,3 +17,7 @@ echo "=== Indexing into Qdrant (parent-child chunker) ==="
 uv run python -m src.index_qdrant \
   --chunks-file data_processed/chunks_parent_child.jsonl \
   --chunker parent_child
+
+# 3) Build the local BM25 index used by hybrid retrieval (data_processed/bm25_parent_child/)
+echo "=== Building BM25 index (parent_child chunker) ==="
+uv run python -m src.bm25 --chunker parent_child
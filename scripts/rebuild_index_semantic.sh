@@ -17,3 +17,7 @@ echo "=== Indexing into Qdrant (semantic chunker) ==="
 uv run python -m src.index_qdrant \
   --chunks-file data_processed/chunks_semantic.jsonl \
   --chunker semantic
+
+# 3) Build the local BM25 index used by hybrid retrieval (data_processed/bm25_semantic/)
+echo "=== Building BM25 index (semantic chunker) ==="
+uv run python -m src.bm25 --chunker semantic
@@ -0,0 +1,153 @@
+"""
+Semantic answer cache.
+
+Near-identical questions ("what is overfitting", "explain overfitting") land
+on near-identical query embeddings. Instead of running retrieval plus a full
+LLM generation for each, we keep the embeddings of previously answered
+questions and hand back the stored answer, sources and confidence when a new
+question is similar enough.
+
+Entries are partitioned by a namespace string built from everything else that
+shapes the answer (chunker, k, multi-query flag, prompt version, collection
+version), so a cached answer is only ever reused under identical settings.
+Within a namespace, lookup is a single matrix-vector product over the stored
+unit-normalised embeddings.
+"""
+
+from __future__ import annotations
+
+import itertools
+import json
+import re
+import threading
+from dataclasses import asdict, dataclass, field, replace
+from pathlib import Path
+
+import numpy as np
+
+from src.vector_store import Hit
+
+
+@dataclass
+class CachedAnswer:
+    """Everything generate_answer() / retrieve_context() returns for a question."""
+    question: str
+    answer: str
+    sources: list[dict]
+    confidence: dict
+    context: str
+    hits: list[Hit] = field(default_factory=list)
+
+
+class _Namespace:
+    """Stored embeddings + entries for one (chunker, k, …) combination."""
+
+    def __init__(self, dim: int) -> None:
+        self.vectors = np.empty((0, dim), dtype=np.float32)
+        self.entries: list[CachedAnswer] = []
+        self.last_used: list[int] = []
+
+
+def _normalise(vector) -> np.ndarray:
+    v = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(v)
+    return v / norm if norm else v
+
+
+class AnswerCache:
+    """
+    Thread-safe, bounded semantic cache of answered questions.
+
+    ``threshold`` is the minimum cosine *similarity* between the new question
+    and a stored one for the stored answer to be returned.  When a namespace
+    grows beyond ``max_entries`` the least recently used entry is evicted.
+    If ``path`` is given, entries are appended there as JSONL and reloaded on
+    construction so the cache survives restarts.
+    """
+
+    def __init__(self, threshold: float, max_entries: int, path: str | Path | None = None) -> None:
+        self._threshold = threshold
+        self._max_entries = max_entries
+        self._path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._tick = itertools.count()
+        self._spaces: dict[str, _Namespace] = {}
+
+        if self._path is not None and self._path.exists():
+            self._load()
+
+    def lookup(self, vector, namespace: str) -> CachedAnswer | None:
+        """Return the closest cached answer in *namespace*, or None below threshold."""
+        q = _normalise(vector)
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is None or not space.entries:
+                return None
+            sims = space.vectors @ q
+            i = int(np.argmax(sims))
+            if sims[i] < self._threshold:
+                return None
+            space.last_used[i] = next(self._tick)
+            return space.entries[i]
+
+    def store(self, vector, namespace: str, entry: CachedAnswer) -> None:
+        """Add *entry* under *namespace*, evicting the LRU entry if full."""
+        # Hit embeddings are only needed at selection time; don't keep them
+        entry = replace(entry, hits=[replace(h, vector=None) for h in entry.hits])
+        self._insert(_normalise(vector), namespace, entry)
+        if self._path is not None:
+            self._append(vector, namespace, entry)
+
+    def _insert(self, v: np.ndarray, namespace: str, entry: CachedAnswer) -> None:
+        with self._lock:
+            space = self._spaces.get(namespace)
+            if space is None:
+                space = self._spaces[namespace] = _Namespace(dim=v.shape[0])
+
+            if len(space.entries) >= self._max_entries:
+                lru = int(np.argmin(space.last_used))
+                space.vectors = np.delete(space.vectors, lru, axis=0)
+                del space.entries[lru]
+                del space.last_used[lru]
+
+            space.vectors = np.vstack([space.vectors, v[None, :]])
+            space.entries.append(entry)
+            space.last_used.append(next(self._tick))
+
+    # ── Persistence ───────────────────────────────────────────────────────────
+
+    def _append(self, vector, namespace: str, entry: CachedAnswer) -> None:
+        record = {
+            "namespace": namespace,
+            "vector": [float(x) for x in vector],
+            **asdict(entry),
+        }
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with self._path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    def _load(self) -> None:
+        with self._path.open("r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                rec = json.loads(line)
+                entry = CachedAnswer(
+                    question=rec["question"],
+                    answer=rec["answer"],
+                    sources=rec["sources"],
+                    confidence=rec["confidence"],
+                    context=rec["context"],
+                    hits=[Hit(**h) for h in rec.get("hits", [])],
+                )
+                self._insert(_normalise(rec["vector"]), rec["namespace"], entry)
+
+
+_WORD_RE = re.compile(r"\s*\S+|\s+$")
+
+
+def replay_stream(answer: str):
+    """Yield a cached answer word-by-word so it can stand in for an LLM token stream."""
+    yield from _WORD_RE.findall(answer)
@@ -0,0 +1,102 @@
+"""
+HTTP client for src.server's /answer endpoint.
+
+app.py uses it when UI_SERVER_URL (or env WIKITUTOR_SERVER_URL) is set.  The
+UI then holds no OpenAI or Qdrant clients, and the pipeline can be scaled
+separately behind a load balancer.  The module imports only config, so the UI
+process does not need the pipeline's credentials.
+
+Usage
+-----
+    remote = RemoteAnswer(server_url(), question, k=15, chunker="token")
+    remote.hits, remote.sources, remote.confidence   # available immediately
+    answer = st.write_stream(remote.tokens())
+    remote.refused, remote.trace                    # set once the stream ends
+"""
+
+from __future__ import annotations
+
+import json
+import os
+
+import requests
+
+from src.config import SERVER_STREAM_TIMEOUT_S, UI_SERVER_URL
+from src.vector_store import Hit
+
+CONNECT_TIMEOUT_S = 5.0
+
+
+def server_url() -> str | None:
+    url = os.environ.get("WIKITUTOR_SERVER_URL", UI_SERVER_URL) or None
+    return url.rstrip("/") if url else None
+
+
+def _events(response: requests.Response):
+    """Yield (event, data) pairs from a server-sent-events response."""
+    event, data = None, []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(":")
+            if field == "event":
+                event = value.strip()
+            elif field == "data":
+                data.append(value.lstrip())
+        elif event is not None:
+            yield event, json.loads("\n".join(data))
+            event, data = None, []
+
+
+class RemoteAnswer:
+    """
+    One /answer request.  The constructor blocks until retrieval is done, so
+    hits, sources and confidence are set right away.  tokens() then streams
+    the answer text.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        question: str,
+        k: int,
+        chunker: str = "token",
+        use_multiquery: bool = False,
+    ) -> None:
+        self._response = requests.post(
+            f"{base_url}/answer",
+            json={"question": question, "k": int(k), "chunker": chunker, "multiquery": use_multiquery},
+            stream=True,
+            timeout=(CONNECT_TIMEOUT_S, SERVER_STREAM_TIMEOUT_S),
+        )
+        if self._response.status_code != 200:
+            try:
+                error = self._response.json().get("error")
+            except ValueError:
+                error = self._response.text[:200]
+            self._response.close()
+            raise RuntimeError(f"Server returned {self._response.status_code}: {error}")
+
+        self._stream = _events(self._response)
+        event, data = next(self._stream, ("error", {"error": "empty response"}))
+        if event != "retrieved":
+            self._response.close()
+            raise RuntimeError(data.get("error", f"unexpected event {event!r}"))
+        self.hits = [Hit(**h) for h in data["hits"]]
+        self.sources: list[dict] = data["sources"]
+        self.confidence: dict = data["confidence"]
+        self.refused = False
+        self.trace: dict = {}   # server-side trace summary, from the done event
+
+    def tokens(self):
+        """Yield answer text chunks; raises RuntimeError if the server reports an error."""
+        try:
+            for event, data in self._stream:
+                if event == "token":
+                    yield data["text"]
+                elif event == "done":
+                    self.refused = data["refused"]
+                    self.trace = data["trace"]
+                elif event == "error":
+                    raise RuntimeError(data["error"])
+        finally:
+            self._response.close()
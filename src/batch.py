@@ -0,0 +1,217 @@
+"""
+Batch-API execution for offline jobs (eval_generation, eval_run).
+
+Offline evals have no latency requirement, so instead of one synchronous chat
+completion per question they can write every request to a JSONL batch file,
+submit it through the provider's batch interface, poll until it finishes and
+ingest the results — at batch pricing and without per-request rate limits.
+
+Backends
+--------
+OpenAIBatchBackend  Uploads the file, creates a /v1/chat/completions batch
+                    (24h completion window), polls every BATCH_POLL_SECONDS
+                    and downloads the output and error files.
+LocalBatchBackend   Stand-in with the same file formats that executes each
+                    request in-process through cassette.chat_model() — live,
+                    recorded or replayed (see cassette.py).  Use it to test
+                    batch jobs end to end without waiting for the provider.
+
+Each job keeps its input.jsonl, output.jsonl and batch id under BATCH_DIR so
+a finished batch can be inspected afterwards.
+"""
+
+from __future__ import annotations
+
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from pathlib import Path
+
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+
+from src import cassette
+from src.config import BATCH_DIR, BATCH_POLL_SECONDS
+
+ENDPOINT = "/v1/chat/completions"
+
+_ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+_MESSAGE_TYPES = {"system": SystemMessage, "user": HumanMessage, "assistant": AIMessage}
+
+
+@dataclass
+class BatchRequest:
+    """One chat completion in a batch; *custom_id* ties the result back to its question."""
+    custom_id: str
+    model: str
+    messages: list[dict]
+    temperature: float = 0.0
+
+    def to_line(self) -> dict:
+        return {
+            "custom_id": self.custom_id,
+            "method": "POST",
+            "url": ENDPOINT,
+            "body": {"model": self.model, "temperature": self.temperature, "messages": self.messages},
+        }
+
+
+@dataclass
+class BatchResult:
+    custom_id: str
+    content: str | None = None
+    usage: dict | None = None
+    error: str | None = None
+
+
+def to_openai_messages(messages: list[BaseMessage]) -> list[dict]:
+    """LangChain messages (e.g. from ChatPromptTemplate.format_messages) → API message dicts."""
+    return [{"role": _ROLES[m.type], "content": m.content} for m in messages]
+
+
+# ── Backends ──────────────────────────────────────────────────────────────────
+
+class OpenAIBatchBackend:
+    """Runs a batch file through the OpenAI Batch API."""
+
+    name = "openai"
+    _TERMINAL = ("completed", "failed", "expired", "cancelled")
+
+    def __init__(self, poll_seconds: float = BATCH_POLL_SECONDS) -> None:
+        from openai import OpenAI
+        self._client = OpenAI()
+        self._poll_seconds = poll_seconds
+
+    def run(self, input_path: Path, output_path: Path) -> None:
+        with input_path.open("rb") as f:
+            uploaded = self._client.files.create(file=f, purpose="batch")
+        batch = self._client.batches.create(
+            input_file_id=uploaded.id, endpoint=ENDPOINT, completion_window="24h"
+        )
+        (output_path.parent / "batch_id").write_text(batch.id, encoding="utf-8")
+        print(f"  [batch] submitted {batch.id}")
+
+        while batch.status not in self._TERMINAL:
+            time.sleep(self._poll_seconds)
+            batch = self._client.batches.retrieve(batch.id)
+            counts = batch.request_counts
+            done = f"{counts.completed + counts.failed}/{counts.total}" if counts else "?"
+            print(f"  [batch] {batch.id}: {batch.status} ({done})")
+
+        if batch.status != "completed":
+            raise RuntimeError(f"Batch {batch.id} ended with status {batch.status!r}")
+
+        with output_path.open("w", encoding="utf-8") as out:
+            for file_id in (batch.output_file_id, batch.error_file_id):
+                if file_id:
+                    text = self._client.files.content(file_id).text
+                    out.write(text if text.endswith("\n") or not text else text + "\n")
+
+
+class LocalBatchBackend:
+    """In-process stand-in for the Batch API, reading and writing the same file formats."""
+
+    name = "local"
+
+    def __init__(self, workers: int = 8) -> None:
+        self._workers = workers
+
+    def _execute(self, i: int, line: dict) -> dict:
+        body = line["body"]
+        try:
+            llm = cassette.chat_model(model=body["model"], temperature=body.get("temperature", 0.0))
+            msg = llm.invoke([_MESSAGE_TYPES[m["role"]](content=m["content"]) for m in body["messages"]])
+            meta = msg.usage_metadata or {}
+            return {
+                "id": f"batch_req_{i}",
+                "custom_id": line["custom_id"],
+                "response": {
+                    "status_code": 200,
+                    "body": {
+                        "model": body["model"],
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": msg.content}}],
+                        "usage": {
+                            "prompt_tokens": meta.get("input_tokens", 0),
+                            "completion_tokens": meta.get("output_tokens", 0),
+                        },
+                    },
+                },
+                "error": None,
+            }
+        except Exception as e:
+            return {
+                "id": f"batch_req_{i}",
+                "custom_id": line["custom_id"],
+                "response": None,
+                "error": {"message": f"{type(e).__name__}: {e}"},
+            }
+
+    def run(self, input_path: Path, output_path: Path) -> None:
+        with input_path.open("r", encoding="utf-8") as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+        with ThreadPoolExecutor(max_workers=self._workers, thread_name_prefix="batch-local") as pool:
+            outputs = list(pool.map(self._execute, range(len(lines)), lines))
+        with output_path.open("w", encoding="utf-8") as out:
+            for rec in outputs:
+                out.write(json.dumps(rec, ensure_ascii=False) + "\n")
+
+
+BACKENDS = {"openai": OpenAIBatchBackend, "local": LocalBatchBackend}
+
+
+def get_backend(name: str):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown batch backend {name!r}; choose from {list(BACKENDS)}")
+    return BACKENDS[name]()
+
+
+# ── Jobs ──────────────────────────────────────────────────────────────────────
+
+def _parse_output_line(rec: dict) -> BatchResult:
+    custom_id = rec["custom_id"]
+    if rec.get("error"):
+        return BatchResult(custom_id, error=rec["error"].get("message") or str(rec["error"]))
+    response = rec.get("response") or {}
+    if response.get("status_code") != 200:
+        return BatchResult(custom_id, error=f"HTTP {response.get('status_code')}: {response.get('body')}")
+    body = response["body"]
+    return BatchResult(
+        custom_id,
+        content=body["choices"][0]["message"]["content"],
+        usage=body.get("usage"),
+    )
+
+
+def run_batch(requests: list[BatchRequest], job: str, backend) -> dict[str, BatchResult]:
+    """
+    Execute *requests* as one batch job and return results by custom_id.
+    Requests missing from the output come back as errors.
+    """
+    if not requests:
+        return {}
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S_%f")
+    workdir = Path(BATCH_DIR) / f"{job}_{stamp}"
+    workdir.mkdir(parents=True, exist_ok=True)
+    input_path = workdir / "input.jsonl"
+    output_path = workdir / "output.jsonl"
+
+    with input_path.open("w", encoding="utf-8") as f:
+        for r in requests:
+            f.write(json.dumps(r.to_line(), ensure_ascii=False) + "\n")
+    print(f"  [batch] {job}: {len(requests)} requests → {backend.name} backend ({workdir})")
+
+    backend.run(input_path, output_path)
+
+    results: dict[str, BatchResult] = {}
+    with output_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                res = _parse_output_line(json.loads(line))
+                results[res.custom_id] = res
+    for r in requests:
+        results.setdefault(r.custom_id, BatchResult(r.custom_id, error="missing from batch output"))
+
+    n_err = sum(1 for r in results.values() if r.error)
+    print(f"  [batch] {job}: {len(results) - n_err} succeeded, {n_err} failed")
+    return results
@@ -0,0 +1,264 @@
+"""
+Latency and throughput benchmark suite.
+
+The quality evals (eval_retrieval, eval_generation) say nothing about speed.
+This drives the pipeline's entry points over the eval questions and reports:
+
+  Latency p50 / p95 / p99   per call, in milliseconds
+  QPS                       completed calls per second of wall time
+  TTFT p50 / p95 / p99      time to first answer token (stream_answer only)
+  Tokens/sec p50            completion tokens ÷ time after the first token
+
+Targets
+-------
+  search            retrieve.search                    (embedding + Qdrant)
+  multiquery        retrieve_multiquery.search_multiquery
+  retrieve_context  rag.retrieve_context               (retrieval + context building)
+  stream_answer     rag.stream_answer, stream fully consumed
+
+Each (target, chunker) cell runs `--warmup` untimed calls, clears the
+in-process query-embedding memo, rerank score cache and compression cache,
+then `--iterations` timed calls spread over
+`--concurrency` worker threads (closed loop).  The semantic answer cache and
+the request log are disabled for the run.
+
+Results are written as JSON named after the current commit, so two runs can be
+diffed; pass `--baseline` to print p50 / p95 changes against an earlier file.
+Run against local stand-ins with WIKITUTOR_MODEL_IO=replay (see cassette.py)
+to measure our own overhead without network noise or spend.
+
+Usage
+-----
+    uv run python -m src.bench                                     # all targets × all chunkers
+    uv run python -m src.bench --targets search retrieve_context --concurrency 8
+    WIKITUTOR_MODEL_IO=replay uv run python -m src.bench --baseline eval/bench/bench_abc1234.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+from src import cassette, compress, rag, request_log, rerank, retrieve
+from src.eval_retrieval import load_questions
+from src.retrieve_multiquery import search_multiquery
+from src.tracing import Trace
+
+TARGETS = ("search", "multiquery", "retrieve_context", "stream_answer")
+CHUNKERS = ("token", "semantic", "parent_child")
+PERCENTILES = (50, 95, 99)
+OUT_DIR = Path("eval/bench")
+
+
+def _git_sha() -> str | None:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        )
+        return out.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _percentiles(values: list[float]) -> dict:
+    if not values:
+        return {f"p{p}": None for p in PERCENTILES}
+    return {
+        f"p{p}": round(float(v), 3)
+        for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+    }
+
+
+def _call(target: str, question: str, chunker: str, k: int) -> dict:
+    """Run one call; return its latency and, for streams, TTFT and tokens/sec."""
+    t0 = time.perf_counter()
+    if target == "search":
+        retrieve.search(question, k=k, chunker=chunker)
+    elif target == "multiquery":
+        search_multiquery(question, k=k, chunker=chunker)
+    elif target == "retrieve_context":
+        rag.retrieve_context(question, k=k, chunker=chunker)
+    else:
+        trace = Trace("bench")
+        token_stream, *_ = rag.stream_answer(question, k=k, chunker=chunker, trace=trace)
+        first = None
+        n_chunks = 0
+        for _ in token_stream:
+            if first is None:
+                first = time.perf_counter()
+            n_chunks += 1
+        end = time.perf_counter()
+        completion = sum(u.completion_tokens for u in trace.usage) or n_chunks
+        gen_s = end - (first or end)
+        return {
+            "latency_ms": (end - t0) * 1000,
+            "ttft_ms": ((first or end) - t0) * 1000,
+            "tokens_per_s": completion / gen_s if gen_s > 0 else None,
+        }
+    return {"latency_ms": (time.perf_counter() - t0) * 1000}
+
+
+def run_cell(
+    target: str,
+    chunker: str,
+    questions: list[str],
+    *,
+    k: int,
+    concurrency: int,
+    warmup: int,
+    iterations: int,
+) -> dict:
+    """Benchmark one (target, chunker) combination."""
+    for i in range(warmup):
+        _call(target, questions[i % len(questions)], chunker, k)
+    # Warmup primes connections and model loads, not per-question caches
+    retrieve.clear_query_memo()
+    rerank.clear_cache()
+    compress.clear_cache()
+
+    samples: list[dict] = []
+    errors: list[str] = []
+    lock = threading.Lock()
+
+    def task(i: int) -> None:
+        try:
+            s = _call(target, questions[i % len(questions)], chunker, k)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+            return
+        with lock:
+            samples.append(s)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="bench") as pool:
+        list(pool.map(task, range(iterations)))
+    wall_s = time.perf_counter() - t0
+
+    result = {
+        "target": target,
+        "chunker": chunker,
+        "n": len(samples),
+        "errors": len(errors),
+        "error_samples": errors[:3],
+        "wall_s": round(wall_s, 3),
+        "qps": round(len(samples) / wall_s, 3) if wall_s else 0.0,
+        "latency_ms": _percentiles([s["latency_ms"] for s in samples]),
+    }
+    if target == "stream_answer":
+        result["ttft_ms"] = _percentiles([s["ttft_ms"] for s in samples])
+        rates = [s["tokens_per_s"] for s in samples if s.get("tokens_per_s")]
+        result["tokens_per_s_p50"] = round(float(np.median(rates)), 1) if rates else None
+    return result
+
+
+def print_results(results: list[dict], baseline: dict | None = None) -> None:
+    base = {(r["target"], r["chunker"]): r for r in (baseline or {}).get("results", [])}
+
+    def delta(new, old) -> str:
+        if new is None or not old:
+            return ""
+        return f" ({(new - old) / old * 100:+.0f}%)"
+
+    header = (
+        f"{'Target':<18} {'Chunker':<13} {'n':>4} {'QPS':>7} "
+        f"{'p50 ms':>16} {'p95 ms':>16} {'p99 ms':>9} {'TTFT p50':>9} {'tok/s':>7}"
+    )
+    print("\n" + header)
+    print("─" * len(header))
+    for r in results:
+        lat = r["latency_ms"]
+        old = base.get((r["target"], r["chunker"]), {}).get("latency_ms", {})
+        p50 = f"{lat['p50']:.1f}{delta(lat['p50'], old.get('p50'))}" if lat["p50"] is not None else "—"
+        p95 = f"{lat['p95']:.1f}{delta(lat['p95'], old.get('p95'))}" if lat["p95"] is not None else "—"
+        p99 = f"{lat['p99']:.1f}" if lat["p99"] is not None else "—"
+        ttft = r.get("ttft_ms", {}).get("p50")
+        tps = r.get("tokens_per_s_p50")
+        print(
+            f"{r['target']:<18} {r['chunker']:<13} {r['n']:>4} {r['qps']:>7.2f} "
+            f"{p50:>16} {p95:>16} {p99:>9} "
+            f"{(f'{ttft:.1f}' if ttft is not None else '—'):>9} "
+            f"{(f'{tps:.1f}' if tps is not None else '—'):>7}"
+        )
+        for err in r["error_samples"]:
+            print(f"    error: {err}")
+
+
+def main(
+    targets: list[str],
+    chunkers: list[str],
+    *,
+    k: int,
+    concurrency: int,
+    warmup: int,
+    iterations: int,
+    out: Path | None,
+    baseline: Path | None,
+) -> None:
+    questions = [q["question"] for q in load_questions()]
+    request_log.configure(None)
+    rag.disable_answer_cache()
+
+    sha = _git_sha()
+    print(
+        f"Benchmarking {targets} × {chunkers} — k={k}, concurrency={concurrency}, "
+        f"warmup={warmup}, iterations={iterations}, model I/O={cassette.mode() or 'live'}"
+    )
+
+    results = []
+    for target in targets:
+        for chunker in chunkers:
+            print(f"  {target} / {chunker} …")
+            results.append(run_cell(
+                target, chunker, questions,
+                k=k, concurrency=concurrency, warmup=warmup, iterations=iterations,
+            ))
+
+    report = {
+        "git_sha": sha,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "model_io": cassette.mode() or "live",
+        "k": k,
+        "concurrency": concurrency,
+        "warmup": warmup,
+        "iterations": iterations,
+        "results": results,
+    }
+
+    base = json.loads(baseline.read_text(encoding="utf-8")) if baseline else None
+    print_results(results, base)
+
+    out = out or OUT_DIR / f"bench_{sha or 'nogit'}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+    print(f"\nResults saved to: {out}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latency / throughput benchmark of the RAG pipeline.")
+    parser.add_argument("--targets", nargs="+", choices=TARGETS, default=list(TARGETS))
+    parser.add_argument("--chunkers", nargs="+", choices=CHUNKERS, default=list(CHUNKERS))
+    parser.add_argument("--k", type=int, default=rag.DEFAULT_K, help="Top-k per search.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Worker threads (default: 4).")
+    parser.add_argument("--warmup", type=int, default=3, help="Untimed calls per cell (default: 3).")
+    parser.add_argument("--iterations", type=int, default=20, help="Timed calls per cell (default: 20).")
+    parser.add_argument("--out", type=Path, default=None,
+                        help="Results JSON (default: eval/bench/bench_<git sha>.json).")
+    parser.add_argument("--baseline", type=Path, default=None,
+                        help="Earlier results JSON to compare p50 / p95 against.")
+    args = parser.parse_args()
+    main(
+        args.targets, args.chunkers,
+        k=args.k, concurrency=args.concurrency, warmup=args.warmup,
+        iterations=args.iterations, out=args.out, baseline=args.baseline,
+    )
@@ -0,0 +1,223 @@
+"""
+Local BM25 lexical index over chunks.jsonl.
+
+Dense embeddings blur rare, exact terms ("Adam optimizer", "XGBoost", author
+names) into their neighbourhood, so questions hinging on them can miss.  A
+lexical index catches exactly those cases for a few milliseconds of local CPU
+instead of an extra LLM call.
+
+On-disk layout (one directory per chunker, e.g. data_processed/bm25_token/):
+
+    meta.json         N, avgdl, k1, b, source chunks file
+    vocab.json        term → term index
+    offsets.npy       int64[n_terms + 1]  postings slice per term
+    postings_doc.npy  uint32[n_postings]  document index
+    postings_tf.npy   uint16[n_postings]  term frequency
+    doc_lens.npy      uint32[N]           document length in tokens
+    doc_offsets.npy   int64[N]            byte offset of each record in the chunks file
+
+The .npy arrays are memory-mapped on load, and hit payloads are read lazily
+from the chunks file by byte offset, so only the postings for the query's
+terms and the top-k records are ever touched.
+
+Usage
+-----
+    uv run python -m src.bm25 --chunker token      # build data_processed/bm25_token/
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import math
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+
+from src import tracing
+from src.vector_store import Hit, chunk_payload, point_id
+
+CHUNKS_PATHS = {
+    "token":        Path("data_processed/chunks.jsonl"),
+    "semantic":     Path("data_processed/chunks_semantic.jsonl"),
+    "parent_child": Path("data_processed/chunks_parent_child.jsonl"),
+}
+INDEX_DIR = Path("data_processed")
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+(?:[+#]+|(?:[-'][a-z0-9]+)*)")
+
+_STOPWORDS = frozenset("""
+a an and are as at be by can do does for from how i in is it its of on or
+that the this to was what when where which who why with you your
+""".split())
+
+
+def tokenize(text: str) -> list[str]:
+    """Lowercase word tokens with stopwords removed (keeps "c++", "t-sne")."""
+    return [t for t in _TOKEN_RE.findall((text or "").lower()) if t not in _STOPWORDS]
+
+
+def index_dir(chunker: str) -> Path:
+    return INDEX_DIR / f"bm25_{chunker}"
+
+
+# ── Build ─────────────────────────────────────────────────────────────────────
+
+def build_index(chunks_path: Path, out_dir: Path, *, k1: float = 1.2, b: float = 0.75) -> None:
+    """Tokenise every chunk in *chunks_path* and write the postings to *out_dir*."""
+    vocab: dict[str, int] = {}
+    postings: list[list[tuple[int, int]]] = []
+    doc_lens: list[int] = []
+    doc_offsets: list[int] = []
+
+    with chunks_path.open("rb") as f:
+        while True:
+            offset = f.tell()
+            line = f.readline()
+            if not line:
+                break
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            doc = len(doc_lens)
+            tokens = tokenize(record.get("text", ""))
+            doc_lens.append(len(tokens))
+            doc_offsets.append(offset)
+            for term, tf in Counter(tokens).items():
+                idx = vocab.setdefault(term, len(vocab))
+                if idx == len(postings):
+                    postings.append([])
+                postings[idx].append((doc, min(tf, 65535)))
+
+    offsets = np.zeros(len(postings) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(p) for p in postings])
+    flat = [pair for p in postings for pair in p]
+    postings_doc = np.fromiter((d for d, _ in flat), dtype=np.uint32, count=len(flat))
+    postings_tf = np.fromiter((tf for _, tf in flat), dtype=np.uint16, count=len(flat))
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir / "offsets.npy", offsets)
+    np.save(out_dir / "postings_doc.npy", postings_doc)
+    np.save(out_dir / "postings_tf.npy", postings_tf)
+    np.save(out_dir / "doc_lens.npy", np.asarray(doc_lens, dtype=np.uint32))
+    np.save(out_dir / "doc_offsets.npy", np.asarray(doc_offsets, dtype=np.int64))
+    (out_dir / "vocab.json").write_text(json.dumps(vocab, ensure_ascii=False), encoding="utf-8")
+
+    n_docs = len(doc_lens)
+    meta = {
+        "n_docs": n_docs,
+        "avgdl": (sum(doc_lens) / n_docs) if n_docs else 0.0,
+        "k1": k1,
+        "b": b,
+        "chunks_path": str(chunks_path),
+    }
+    (out_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+    print(f"BM25 index: {n_docs} docs, {len(vocab)} terms, {len(flat)} postings → {out_dir}")
+
+
+# ── Search ────────────────────────────────────────────────────────────────────
+
+class BM25Index:
+    """Memory-mapped BM25 index produced by build_index()."""
+
+    def __init__(self, path: Path) -> None:
+        meta = json.loads((path / "meta.json").read_text(encoding="utf-8"))
+        self._n_docs: int = meta["n_docs"]
+        self._avgdl: float = meta["avgdl"] or 1.0
+        self._k1: float = meta["k1"]
+        self._b: float = meta["b"]
+        self._chunks_path = Path(meta["chunks_path"])
+
+        self._vocab: dict[str, int] = json.loads((path / "vocab.json").read_text(encoding="utf-8"))
+        self._offsets = np.load(path / "offsets.npy", mmap_mode="r")
+        self._postings_doc = np.load(path / "postings_doc.npy", mmap_mode="r")
+        self._postings_tf = np.load(path / "postings_tf.npy", mmap_mode="r")
+        self._doc_lens = np.load(path / "doc_lens.npy", mmap_mode="r")
+        self._doc_offsets = np.load(path / "doc_offsets.npy", mmap_mode="r")
+        # Per-document length normalisation term, computed once
+        self._norm = (
+            self._k1 * (1.0 - self._b + self._b * np.asarray(self._doc_lens, dtype=np.float32) / self._avgdl)
+        ).astype(np.float32)
+
+    def top_k(self, query: str, k: int) -> list[tuple[int, float]]:
+        """Return [(doc index, bm25 score)] for the top-k documents, best first."""
+        scores = np.zeros(self._n_docs, dtype=np.float32)
+        for term in set(tokenize(query)):
+            idx = self._vocab.get(term)
+            if idx is None:
+                continue
+            lo, hi = int(self._offsets[idx]), int(self._offsets[idx + 1])
+            docs = self._postings_doc[lo:hi]
+            tf = self._postings_tf[lo:hi].astype(np.float32)
+            df = hi - lo
+            idf = math.log(1.0 + (self._n_docs - df + 0.5) / (df + 0.5))
+            scores[docs] += idf * tf * (self._k1 + 1.0) / (tf + self._norm[docs])
+
+        n_pos = int(np.count_nonzero(scores))
+        if n_pos == 0:
+            return []
+        k = min(k, n_pos)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(d), float(scores[d])) for d in top]
+
+    def _record(self, doc: int) -> dict:
+        with self._chunks_path.open("rb") as f:
+            f.seek(int(self._doc_offsets[doc]))
+            return json.loads(f.readline())
+
+    def search(self, query: str, k: int) -> list[Hit]:
+        """
+        Return the top-k chunks as Hit objects with the same id and fields as
+        the corresponding Qdrant points.
+
+        ``score`` is the negated BM25 score so that lower = better, matching
+        the rest of the pipeline; the raw value is in ``fields["bm25"]``.
+        """
+        hits = []
+        for doc, score in self.top_k(query, k):
+            record = self._record(doc)
+            fields = chunk_payload(record)
+            fields["bm25"] = score
+            hits.append(Hit(id=point_id(record["id"]), score=-score, fields=fields))
+        return hits
+
+
+_indexes: dict[str, BM25Index] = {}
+_load_lock = threading.Lock()
+
+
+def get_index(chunker: str) -> BM25Index:
+    """Load (once) and return the BM25 index for *chunker*."""
+    with _load_lock:
+        if chunker not in _indexes:
+            path = index_dir(chunker)
+            if not (path / "meta.json").exists():
+                raise FileNotFoundError(
+                    f"Missing BM25 index at {path}. "
+                    f"Run: uv run python -m src.bm25 --chunker {chunker}"
+                )
+            _indexes[chunker] = BM25Index(path)
+        return _indexes[chunker]
+
+
+def search(query: str, k: int = 8, chunker: str = "token") -> list[Hit]:
+    """Return top-k BM25 hits for *query* from the *chunker* index."""
+    with tracing.span("bm25.search", chunker=chunker, k=k):
+        return get_index(chunker).search(query, k)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build a local BM25 index from chunks JSONL.")
+    parser.add_argument("--chunker", default="token", choices=list(CHUNKS_PATHS))
+    parser.add_argument(
+        "--chunks-file",
+        type=Path,
+        default=None,
+        help="Override the chunks JSONL to index (default depends on --chunker).",
+    )
+    args = parser.parse_args()
+    build_index(args.chunks_file or CHUNKS_PATHS[args.chunker], index_dir(args.chunker))
@@ -0,0 +1,95 @@
+"""
+Confidence calibration parameters.
+
+rag._confidence_from_sources() turns retrieval distances into a confidence
+label and value using the parameters below.  They default to the hand-tuned
+CONF_* constants in config.py; `python -m src.eval_calibration --fit` refits
+them against judged answers and writes a versioned artefact
+
+    eval/calibration/confidence_v<N>.json
+
+and the highest version present is loaded once at startup.  Re-fit whenever
+the index is rebuilt or the embedding model changes — distances shift and
+the thresholds go stale.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from dataclasses import asdict, dataclass, fields
+from pathlib import Path
+
+from src.config import (
+    CONF_CALIBRATION_DIR,
+    CONF_HIGH_THRESHOLD,
+    CONF_MEDIUM_THRESHOLD,
+    CONF_HIGH_VALUE,
+    CONF_MEDIUM_VALUE,
+    CONF_LOW_VALUE,
+    CONF_SPREAD_THRESHOLD_1,
+    CONF_SPREAD_THRESHOLD_2,
+    CONF_SPREAD_PENALTY,
+    CONF_GOOD_HIT_THRESHOLD,
+    CONF_MULTI_SOURCE_BOOST,
+)
+
+_ARTEFACT_RE = re.compile(r"^confidence_v(\d+)\.json$")
+
+
+@dataclass(frozen=True)
+class CalibrationParams:
+    high_threshold: float = CONF_HIGH_THRESHOLD
+    medium_threshold: float = CONF_MEDIUM_THRESHOLD
+    high_value: float = CONF_HIGH_VALUE
+    medium_value: float = CONF_MEDIUM_VALUE
+    low_value: float = CONF_LOW_VALUE
+    spread_threshold_1: float = CONF_SPREAD_THRESHOLD_1
+    spread_threshold_2: float = CONF_SPREAD_THRESHOLD_2
+    spread_penalty: float = CONF_SPREAD_PENALTY
+    good_hit_threshold: float = CONF_GOOD_HIT_THRESHOLD
+    multi_source_boost: float = CONF_MULTI_SOURCE_BOOST
+    version: int | None = None   # artefact version; None = config defaults
+
+    def to_params(self) -> dict:
+        return {k: v for k, v in asdict(self).items() if k != "version"}
+
+
+def _versions(directory: Path) -> dict[int, Path]:
+    if not directory.is_dir():
+        return {}
+    out = {}
+    for p in directory.iterdir():
+        m = _ARTEFACT_RE.match(p.name)
+        if m:
+            out[int(m.group(1))] = p
+    return out
+
+
+def load(directory: str | Path | None = CONF_CALIBRATION_DIR) -> CalibrationParams:
+    """Latest fitted parameters in *directory*, or the config defaults."""
+    if directory is None:
+        return CalibrationParams()
+    versions = _versions(Path(directory))
+    if not versions:
+        return CalibrationParams()
+    version = max(versions)
+    artefact = json.loads(versions[version].read_text(encoding="utf-8"))
+    known = {f.name for f in fields(CalibrationParams)}
+    params = {k: v for k, v in artefact["params"].items() if k in known}
+    return CalibrationParams(**params, version=version)
+
+
+def save(
+    params: CalibrationParams,
+    meta: dict,
+    directory: str | Path = CONF_CALIBRATION_DIR or "eval/calibration",
+) -> Path:
+    """Write *params* as the next artefact version; return its path."""
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    version = max(_versions(directory), default=0) + 1
+    path = directory / f"confidence_v{version}.json"
+    artefact = {"version": version, **meta, "params": params.to_params()}
+    path.write_text(json.dumps(artefact, indent=2), encoding="utf-8")
+    return path
@@ -0,0 +1,423 @@
+"""
+Record / replay layer for OpenAI and Qdrant calls.
+
+Benchmarks and evals otherwise need live OpenAI and Qdrant Cloud, which makes
+them slow, costly and non-deterministic.  The factories here stand in for the
+client constructors used by retrieve.py, rag.py, retrieve_multiquery.py,
+vector_store.py and eval_generation.py:
+
+    chat_model(**kwargs)           → ChatOpenAI(**kwargs)
+    embeddings(**kwargs)           → OpenAIEmbeddings(**kwargs)
+    qdrant_client(**kwargs)        → QdrantClient(**kwargs)
+    async_qdrant_client(**kwargs)  → AsyncQdrantClient(**kwargs)
+
+Modes (config.MODEL_IO_MODE, overridden by the WIKITUTOR_MODEL_IO env var):
+
+  None      live — the factories return the real clients, no overhead.
+  "record"  calls go to the real services; each response is appended, with
+            its latency (and per-chunk timings for streams), to a JSONL
+            cassette under CASSETTE_DIR.
+  "replay"  responses are served from the cassettes without network access
+            or API keys.  A request that was never recorded raises
+            CassetteMiss.  Each call sleeps for its recorded latency scaled
+            by REPLAY_LATENCY_SCALE (0 = instant, 1 = as recorded), which
+            lets you profile our own code paths with or without realistic
+            service latency.
+
+Requests are keyed by a hash of everything that determines the response:
+model parameters plus messages for chat, model plus text for embeddings (per
+text, so batches may be composed differently on replay), and the full call
+arguments for Qdrant.  Sync and async calls share the same keys and
+cassettes; async replay waits with asyncio.sleep, so replaying many
+concurrent requests does not tie up threads.
+
+Usage
+-----
+    WIKITUTOR_MODEL_IO=record uv run python -m src.eval_retrieval   # capture once
+    WIKITUTOR_MODEL_IO=replay uv run python -m src.eval_retrieval   # offline from then on
+"""
+
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, AsyncIterator, Iterator
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.config import CASSETTE_DIR, MODEL_IO_MODE, REPLAY_LATENCY_SCALE
+
+MODES = (None, "record", "replay")
+
+
+class CassetteMiss(KeyError):
+    """A replayed request has no recording."""
+
+
+def mode() -> str | None:
+    m = os.environ.get("WIKITUTOR_MODEL_IO", MODEL_IO_MODE) or None
+    if m not in MODES:
+        raise ValueError(f"Unknown model I/O mode {m!r}; choose from {MODES}")
+    return m
+
+
+def replaying() -> bool:
+    return mode() == "replay"
+
+
+def _key(obj: Any) -> str:
+    blob = json.dumps(obj, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+def _sleep_recorded(latency_ms: float) -> None:
+    if REPLAY_LATENCY_SCALE > 0 and latency_ms:
+        time.sleep(latency_ms * REPLAY_LATENCY_SCALE / 1000.0)
+
+
+async def _asleep_recorded(latency_ms: float) -> None:
+    if REPLAY_LATENCY_SCALE > 0 and latency_ms:
+        await asyncio.sleep(latency_ms * REPLAY_LATENCY_SCALE / 1000.0)
+
+
+class Cassette:
+    """Append-only JSONL store of recorded responses, loaded once on first use."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._records: dict[str, dict] | None = None
+        self._lock = threading.Lock()
+
+    def _load(self) -> dict[str, dict]:
+        if self._records is None:
+            records = {}
+            if self.path.exists():
+                with self.path.open("r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            rec = json.loads(line)
+                            records[rec["key"]] = rec   # later recordings win
+            self._records = records
+        return self._records
+
+    def get(self, key: str, what: str) -> dict:
+        with self._lock:
+            rec = self._load().get(key)
+        if rec is None:
+            raise CassetteMiss(
+                f"No recording for {what} in {self.path}. "
+                f"Re-run once with WIKITUTOR_MODEL_IO=record."
+            )
+        return rec
+
+    def put(self, key: str, record: dict) -> None:
+        record = {"key": key, **record}
+        with self._lock:
+            self._load()[key] = record
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+_cassettes: dict[str, Cassette] = {}
+_cassettes_lock = threading.Lock()
+
+
+def _cassette(name: str) -> Cassette:
+    with _cassettes_lock:
+        if name not in _cassettes:
+            _cassettes[name] = Cassette(Path(CASSETTE_DIR) / f"{name}.jsonl")
+        return _cassettes[name]
+
+
+# ── Chat models ───────────────────────────────────────────────────────────────
+
+class _StreamRecorder:
+    """Collects a live stream's chunks and timings, then writes the recording."""
+
+    def __init__(self, key: str) -> None:
+        self.key = key
+        self.t0 = time.perf_counter()
+        self.chunks, self.parts, self.usage = [], [], None
+
+    def add(self, chunk) -> ChatGenerationChunk:
+        if chunk.usage_metadata:
+            self.usage = chunk.usage_metadata
+        if chunk.content:
+            self.chunks.append([(time.perf_counter() - self.t0) * 1000, chunk.content])
+            self.parts.append(chunk.content)
+        return ChatGenerationChunk(
+            message=AIMessageChunk(content=chunk.content, usage_metadata=chunk.usage_metadata)
+        )
+
+    def save(self) -> None:
+        _cassette("chat").put(self.key, {
+            "content": "".join(self.parts),
+            "usage": self.usage,
+            "latency_ms": (time.perf_counter() - self.t0) * 1000,
+            "chunks": self.chunks,
+        })
+
+
+class CassetteChatModel(BaseChatModel):
+    """Records or replays a ChatOpenAI model; composes with prompts like the real one."""
+
+    model_name: str
+    params: dict
+    replay: bool = False
+    inner: Any = None
+
+    @property
+    def _llm_type(self) -> str:
+        return "cassette-chat"
+
+    def _request_key(self, messages: list[BaseMessage]) -> str:
+        return _key({
+            "model": self.model_name,
+            "params": self.params,
+            "messages": [[m.type, m.content] for m in messages],
+        })
+
+    def _recording(self, messages: list[BaseMessage]) -> dict:
+        return _cassette("chat").get(self._request_key(messages), f"chat call to {self.model_name}")
+
+    def _put(self, messages: list[BaseMessage], msg, t0: float) -> None:
+        _cassette("chat").put(self._request_key(messages), {
+            "content": msg.content,
+            "usage": msg.usage_metadata,
+            "latency_ms": (time.perf_counter() - t0) * 1000,
+        })
+
+    @staticmethod
+    def _replay_chunks(rec: dict) -> list[tuple[float, ChatGenerationChunk]]:
+        """(delay before chunk in ms, chunk) pairs for a recorded response."""
+        # Recordings made by invoke() have no chunk timings: replay as one chunk
+        chunks = rec.get("chunks") or [[rec["latency_ms"], rec["content"]]]
+        out, elapsed = [], 0.0
+        for offset_ms, text in chunks:
+            out.append((offset_ms - elapsed, ChatGenerationChunk(message=AIMessageChunk(content=text))))
+            elapsed = offset_ms
+        if rec.get("usage"):
+            out.append((0.0, ChatGenerationChunk(message=AIMessageChunk(content="", usage_metadata=rec["usage"]))))
+        return out
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.replay:
+            rec = self._recording(messages)
+            _sleep_recorded(rec["latency_ms"])
+            msg = AIMessage(content=rec["content"], usage_metadata=rec.get("usage"))
+        else:
+            t0 = time.perf_counter()
+            msg = self.inner.invoke(messages, stop=stop, **kwargs)
+            self._put(messages, msg, t0)
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.replay:
+            rec = self._recording(messages)
+            await _asleep_recorded(rec["latency_ms"])
+            msg = AIMessage(content=rec["content"], usage_metadata=rec.get("usage"))
+        else:
+            t0 = time.perf_counter()
+            msg = await self.inner.ainvoke(messages, stop=stop, **kwargs)
+            self._put(messages, msg, t0)
+        return ChatResult(generations=[ChatGeneration(message=msg)])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        if self.replay:
+            for delay_ms, chunk in self._replay_chunks(self._recording(messages)):
+                _sleep_recorded(delay_ms)
+                yield chunk
+            return
+        recorder = _StreamRecorder(self._request_key(messages))
+        for chunk in self.inner.stream(messages, stop=stop, **kwargs):
+            yield recorder.add(chunk)
+        recorder.save()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        if self.replay:
+            for delay_ms, chunk in self._replay_chunks(self._recording(messages)):
+                await _asleep_recorded(delay_ms)
+                yield chunk
+            return
+        recorder = _StreamRecorder(self._request_key(messages))
+        async for chunk in self.inner.astream(messages, stop=stop, **kwargs):
+            yield recorder.add(chunk)
+        recorder.save()
+
+
+def chat_model(**kwargs):
+    """ChatOpenAI(**kwargs), or its record / replay stand-in."""
+    m = mode()
+    if m is None:
+        from langchain_openai import ChatOpenAI
+        return ChatOpenAI(**kwargs)
+    params = {k: v for k, v in kwargs.items() if k not in ("model", "stream_usage")}
+    inner = None
+    if m == "record":
+        from langchain_openai import ChatOpenAI
+        inner = ChatOpenAI(**kwargs)
+    return CassetteChatModel(
+        model_name=kwargs["model"], params=params, replay=(m == "replay"), inner=inner
+    )
+
+
+# ── Embeddings ────────────────────────────────────────────────────────────────
+
+class CassetteEmbeddings(Embeddings):
+    """Records or replays OpenAIEmbeddings, keyed per (model, text)."""
+
+    def __init__(self, model: str, inner: Embeddings | None) -> None:
+        self.model = model
+        self._inner = inner
+
+    def _text_key(self, text: str) -> str:
+        return _key({"model": self.model, "text": text})
+
+    def _recordings(self, texts: list[str]) -> tuple[list[list[float]], float]:
+        recs = [_cassette("embeddings").get(self._text_key(t), f"embedding of {t[:60]!r}") for t in texts]
+        return [r["vector"] for r in recs], max((r["latency_ms"] for r in recs), default=0.0)
+
+    def _put(self, texts: list[str], vectors: list[list[float]], t0: float) -> None:
+        latency_ms = (time.perf_counter() - t0) * 1000
+        for t, v in zip(texts, vectors):
+            _cassette("embeddings").put(self._text_key(t), {"vector": list(v), "latency_ms": latency_ms})
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self._inner is None:
+            vectors, latency_ms = self._recordings(texts)
+            _sleep_recorded(latency_ms)
+            return vectors
+        t0 = time.perf_counter()
+        vectors = self._inner.embed_documents(texts)
+        self._put(texts, vectors, t0)
+        return vectors
+
+    async def aembed_documents(self, texts: list[str]) -> list[list[float]]:
+        if self._inner is None:
+            vectors, latency_ms = self._recordings(texts)
+            await _asleep_recorded(latency_ms)
+            return vectors
+        t0 = time.perf_counter()
+        vectors = await self._inner.aembed_documents(texts)
+        self._put(texts, vectors, t0)
+        return vectors
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> list[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+def embeddings(**kwargs):
+    """OpenAIEmbeddings(**kwargs), or its record / replay stand-in."""
+    m = mode()
+    if m == "replay":
+        return CassetteEmbeddings(kwargs["model"], inner=None)
+    from langchain_openai import OpenAIEmbeddings
+    inner = OpenAIEmbeddings(**kwargs)
+    return inner if m is None else CassetteEmbeddings(kwargs["model"], inner=inner)
+
+
+# ── Qdrant ────────────────────────────────────────────────────────────────────
+
+def _jsonable(value: Any) -> Any:
+    if hasattr(value, "model_dump"):
+        return value.model_dump(mode="json")
+    if isinstance(value, (list, tuple)):
+        return [_jsonable(v) for v in value]
+    return value
+
+
+class CassetteQdrantClient:
+    """
+    Records or replays the read calls the pipeline makes (query_points,
+    get_collection).  Other methods pass through to the real client when
+    recording and are unavailable when replaying.
+    """
+
+    def __init__(self, inner: Any | None) -> None:
+        self._inner = inner
+
+    @staticmethod
+    def _call_key(method: str, kwargs: dict) -> str:
+        return _key({"method": method, **{k: _jsonable(v) for k, v in kwargs.items()}})
+
+    @staticmethod
+    def _recording(key: str, method: str, kwargs: dict) -> dict:
+        return _cassette("qdrant").get(key, f"Qdrant {method}({kwargs.get('collection_name')})")
+
+    @staticmethod
+    def _put(key: str, response, t0: float) -> None:
+        _cassette("qdrant").put(key, {
+            "response": response.model_dump(mode="json"),
+            "latency_ms": (time.perf_counter() - t0) * 1000,
+        })
+
+    def _call(self, method: str, response_type, kwargs: dict):
+        key = self._call_key(method, kwargs)
+        if self._inner is None:
+            rec = self._recording(key, method, kwargs)
+            _sleep_recorded(rec["latency_ms"])
+            return response_type.model_validate(rec["response"])
+        t0 = time.perf_counter()
+        response = getattr(self._inner, method)(**kwargs)
+        self._put(key, response, t0)
+        return response
+
+    def query_points(self, **kwargs):
+        from qdrant_client.http.models import QueryResponse
+        return self._call("query_points", QueryResponse, kwargs)
+
+    def get_collection(self, **kwargs):
+        from qdrant_client.http.models import CollectionInfo
+        return self._call("get_collection", CollectionInfo, kwargs)
+
+    def __getattr__(self, name: str):
+        if self._inner is None:
+            raise AttributeError(f"QdrantClient.{name} is not available in replay mode")
+        return getattr(self._inner, name)
+
+
+def qdrant_client(**kwargs):
+    """QdrantClient(**kwargs), or its record / replay stand-in."""
+    m = mode()
+    if m == "replay":
+        return CassetteQdrantClient(inner=None)
+    from qdrant_client import QdrantClient
+    inner = QdrantClient(**kwargs)
+    return inner if m is None else CassetteQdrantClient(inner=inner)
+
+
+class CassetteAsyncQdrantClient(CassetteQdrantClient):
+    """Async twin of CassetteQdrantClient wrapping an AsyncQdrantClient."""
+
+    async def _call(self, method: str, response_type, kwargs: dict):
+        key = self._call_key(method, kwargs)
+        if self._inner is None:
+            rec = self._recording(key, method, kwargs)
+            await _asleep_recorded(rec["latency_ms"])
+            return response_type.model_validate(rec["response"])
+        t0 = time.perf_counter()
+        response = await getattr(self._inner, method)(**kwargs)
+        self._put(key, response, t0)
+        return response
+
+
+def async_qdrant_client(**kwargs):
+    """AsyncQdrantClient(**kwargs), or its record / replay stand-in."""
+    m = mode()
+    if m == "replay":
+        return CassetteAsyncQdrantClient(inner=None)
+    from qdrant_client import AsyncQdrantClient
+    inner = AsyncQdrantClient(**kwargs)
+    return inner if m is None else CassetteAsyncQdrantClient(inner=inner)
@@ -6,6 +6,7 @@ hardcoding values in individual source files.
 
 # ── Models ────────────────────────────────────────────────────────────────────
 LLM_MODEL = "gpt-4.1-mini"
+LLM_TEMPERATURE = 0.2
 EMBEDDING_MODEL = "text-embedding-3-small"
 
 # ── Retrieval ─────────────────────────────────────────────────────────────────
@@ -13,8 +14,54 @@ DEFAULT_K = 15          # top-k chunks to retrieve from the vector index
 MAX_PER_TITLE = 1       # diversity cap: at most N chunks per Wikipedia article
 MAX_TOTAL_HITS = 8      # total diverse hits passed to the context builder
 MAX_CONTEXT_TOKENS = 3000  # token budget for context sent to the LLM
+CONTEXT_PACKING = "greedy"    # "greedy" (rank order, skip overflow) or "knapsack" (max relevance in budget)
+CONTEXT_TRIM_TO_FIT = False   # trim the best left-out chunk to its most relevant sentences
+
+# ── Context compression (see compress.py) ─────────────────────────────────────
+COMPRESSION_ENABLED = False      # keep only the query-relevant sentences of each chunk
+COMPRESSION_KEEP_RATIO = 0.5     # fraction of each chunk's sentences to keep
+COMPRESSION_MIN_SENTENCES = 3    # never compress a chunk below this many sentences
+COMPRESSION_CACHE_SIZE = 50_000  # cached sentence embeddings
+
+# ── Diversity selection ───────────────────────────────────────────────────────
+DIVERSITY_STRATEGY = "title_cap"  # "title_cap" or "mmr" (MMR also applies MAX_PER_TITLE)
+MMR_LAMBDA = 0.7                  # relevance vs novelty trade-off; 1.0 = pure relevance
+
+# ── Rank fusion (multi-query / multi-collection) ──────────────────────────────
+FUSION_METHOD = "rrf"   # one of: rrf, combsum, combmnz, max (see fusion.py)
+RRF_K = 60              # rank offset in reciprocal-rank fusion: 1 / (RRF_K + rank)
+MULTICOLLECTION_CHUNKERS = ["token", "semantic", "parent_child"]
+
+# ── Hybrid (dense + BM25) retrieval ───────────────────────────────────────────
+HYBRID_SEARCH = False   # default for retrieve.search(); requires a local BM25 index (bm25.py)
+HYBRID_LEXICAL_K = 20   # BM25 candidates fused with the dense hits
+
+# ── Reranking (see rerank.py) ─────────────────────────────────────────────────
+RERANK_ENABLED = False     # rescore retrieved hits before diversity selection
+RERANK_MODEL_PATH = None   # dir with model.onnx + tokenizer.json; None → lexical scorer
+RERANK_BATCH_SIZE = 16     # candidates scored per forward pass
+RERANK_BUDGET_MS = 150     # stop scoring new batches once this much time is spent
+RERANK_CACHE_SIZE = 4096   # cached (query, chunk) scores, least recently used evicted first
+
+# ── Answer cache ──────────────────────────────────────────────────────────────
+# Reuse answers for semantically near-identical questions (see answer_cache.py).
+# Off by default: a near-duplicate can still ask something different.
+ANSWER_CACHE_ENABLED = False
+ANSWER_CACHE_SIMILARITY = 0.97   # min cosine similarity between question embeddings
+ANSWER_CACHE_MAX_ENTRIES = 512   # per (chunker, k, multiquery, prompt, calibration, index build) namespace
+ANSWER_CACHE_PATH = None         # optional JSONL path to persist entries across restarts
+
+# ── Request coalescing (see singleflight.py) ──────────────────────────────────
+# Identical questions in flight at the same time share one query embedding,
+# one retrieval and one LLM stream.
+SINGLE_FLIGHT_ENABLED = True
+
+# ── Confidence (Qdrant cosine distance; lower = more similar) ─────────────────
+# Hand-tuned defaults.  `python -m src.eval_calibration --fit` refits them
+# against judged answers; the latest fitted artefact in CONF_CALIBRATION_DIR
+# takes precedence at startup (see calibration.py).
+CONF_CALIBRATION_DIR = "eval/calibration"   # None = always use the values below
 
-# ── Confidence (Zvec cosine distance; lower = more similar) ───────────────────
 # mean-of-top-3 distance thresholds that determine label
 CONF_HIGH_THRESHOLD = 0.38
 CONF_MEDIUM_THRESHOLD = 0.45
@@ -33,12 +80,60 @@ CONF_SPREAD_PENALTY = 0.10       # value subtracted per triggered threshold
 CONF_GOOD_HIT_THRESHOLD = 0.40   # score below this counts as a "good hit"
 CONF_MULTI_SOURCE_BOOST = 0.05
 
-# ── Refusal detection (keep in sync with system prompt in rag.py) ─────────────
+# ── Tracing (see tracing.py) ──────────────────────────────────────────────────
+TRACE_JSONL_PATH = None   # append every finished request trace here, e.g. "logs/traces.jsonl"
+TRACE_OTEL = False        # also replay traces into OpenTelemetry (requires opentelemetry-api)
+
+# ── Cost accounting (see usage.py) ────────────────────────────────────────────
+# USD per 1M tokens: (prompt, cached prompt, completion)
+TOKEN_PRICES_PER_1M = {
+    "gpt-4.1-mini": (0.40, 0.10, 1.60),
+    "text-embedding-3-small": (0.02, 0.02, 0.0),
+}
+REQUEST_LOG_PATH = "logs/requests.jsonl"   # one JSON line per answered question; None to disable
+
+# ── Offline record / replay (see cassette.py) ─────────────────────────────────
+MODEL_IO_MODE = None              # None (live), "record" or "replay"; env WIKITUTOR_MODEL_IO overrides
+CASSETTE_DIR = "eval/cassettes"   # recorded OpenAI / Qdrant responses
+REPLAY_LATENCY_SCALE = 0.0        # replayed calls sleep recorded latency × this (0 = instant)
+
+# ── Batch API (see batch.py) ──────────────────────────────────────────────────
+BATCH_BACKEND = "openai"      # "openai" (Batch API) or "local" (in-process stand-in)
+BATCH_POLL_SECONDS = 30       # status poll interval while a batch is running
+BATCH_DIR = "eval/batches"    # per-job input / output files
+
+# ── Refusal detection (keep in sync with _SYSTEM_PROMPT in rag.py) ────────────
 REFUSAL_PHRASES = [
     "i don't have that information in my sources",
     "i can only answer questions about machine learning",
 ]
 
+# Canned refusals returned by the early-refusal gate (match the system prompt)
+REFUSAL_OFF_TOPIC = "I can only answer questions about machine learning, data science, and AI."
+REFUSAL_NO_COVERAGE = "I don't have that information in my sources."
+
+# ── Early-refusal gate (see topic_gate.py) ────────────────────────────────────
+# Short-circuits obvious off-topic / no-coverage questions before the LLM call.
+TOPIC_GATE_ENABLED = True
+TOPIC_GATE_PATH = "data_processed/topic_prototypes.npz"  # built by `python -m src.topic_gate`; missing → topic check off
+TOPIC_GATE_PROTOTYPES = 64           # k-means centroids of sampled index vectors
+TOPIC_GATE_SAMPLE = 5000             # index vectors sampled per collection when building
+TOPIC_GATE_MIN_SIMILARITY = 0.30     # best prototype cosine similarity below this → off-topic
+NO_COVERAGE_MAX_DISTANCE = None      # best hit cosine distance above this → no coverage; None = check off
+                                     # (set it from `python -m src.topic_gate --report-only`)
+
+# ── HTTP server (see server.py) ───────────────────────────────────────────────
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 8000
+SERVER_MAX_CONCURRENCY = 32        # /search, /retrieve, /answer requests in flight per process
+SERVER_QUEUE_TIMEOUT_S = 2.0       # wait this long for a free slot, then 503 + Retry-After
+SERVER_REQUEST_TIMEOUT_S = 30.0    # /search, /retrieve and the retrieval part of /answer (504)
+SERVER_STREAM_TIMEOUT_S = 120.0    # whole /answer stream, counted from the start of the request
+SERVER_READY_TIMEOUT_S = 2.0       # Qdrant probe in /readyz
+SERVER_MAX_BODY_BYTES = 64 * 1024
+SERVER_MAX_K = 50
+
 # ── UI ────────────────────────────────────────────────────────────────────────
 UI_DEFAULT_K = 15      # default value shown in the Top-K number input
 PREVIEW_CHARS = 400    # characters of chunk text shown in source preview
+UI_SERVER_URL = None   # e.g. "http://localhost:8000": app.py calls src.server over HTTP; env WIKITUTOR_SERVER_URL overrides
@@ -0,0 +1,93 @@
+"""
+Token-budget context packing.
+
+rag._build_context has a fixed token budget (MAX_CONTEXT_TOKENS).  Walking
+hits in rank order and skipping whatever doesn't fit can let one large early
+parent chunk crowd out several smaller, relevant ones.  Packing instead
+chooses the subset of candidate blocks with the highest total relevance that
+fits the budget — a 0/1 knapsack, solved exactly by dynamic programming over
+token counts bucketed to TOKEN_GRANULARITY tokens.  Bucketing rounds weights
+up, so any packing it returns genuinely fits.
+
+Blocks that still don't fit can be trimmed to their most query-relevant
+sentences to use the leftover budget.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+from typing import Callable
+
+import numpy as np
+
+from src.rerank import LexicalReranker
+
+TOKEN_GRANULARITY = 8   # DP bucket size in tokens (3000-token budget → 375 buckets)
+
+_SENT_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> list[str]:
+    """Split text into sentences, also breaking on paragraph boundaries."""
+    out: list[str] = []
+    for para in (text or "").replace("\r\n", "\n").split("\n\n"):
+        para = para.strip()
+        if para:
+            out.extend(s.strip() for s in _SENT_RE.split(para) if s.strip())
+    return out
+
+
+def knapsack(values: list[float], weights: list[int], capacity: int) -> list[int]:
+    """
+    Indices of the subset maximising total value with total weight ≤ capacity.
+
+    Weights are in tokens; they are bucketed (rounded up) to TOKEN_GRANULARITY
+    before the DP.  Returned indices are in ascending order.
+    """
+    cap = capacity // TOKEN_GRANULARITY
+    buckets = [math.ceil(w / TOKEN_GRANULARITY) for w in weights]
+
+    dp = np.zeros(cap + 1, dtype=np.float64)
+    keep = np.zeros((len(values), cap + 1), dtype=bool)
+    for i, (v, w) in enumerate(zip(values, buckets)):
+        if w > cap:
+            continue
+        candidate = dp[: cap + 1 - w] + v
+        better = candidate > dp[w:]
+        keep[i, w:] = better
+        dp[w:] = np.where(better, candidate, dp[w:])
+
+    chosen = []
+    c = cap
+    for i in range(len(values) - 1, -1, -1):
+        if keep[i, c]:
+            chosen.append(i)
+            c -= buckets[i]
+    return sorted(chosen)
+
+
+def trim_to_budget(
+    question: str,
+    text: str,
+    budget: int,
+    token_len: Callable[[str], int],
+) -> str:
+    """
+    Keep the sentences of *text* most relevant to *question* (lexical overlap)
+    that fit within *budget* tokens, in their original order.  Returns "" if
+    not even one sentence fits.
+    """
+    sentences = split_sentences(text)
+    if not sentences or budget <= 0:
+        return ""
+
+    scores = LexicalReranker().score(question, sentences)
+    kept: set[int] = set()
+    used = 0
+    for i in sorted(range(len(sentences)), key=lambda i: -scores[i]):
+        cost = token_len(sentences[i]) + 1  # +1 for the joining space
+        if used + cost <= budget:
+            kept.add(i)
+            used += cost
+    return " ".join(sentences[i] for i in sorted(kept))
@@ -1,30 +1,72 @@
 """
-Confidence calibration analysis.
+Confidence calibration analysis and fitting.
 
 Reads eval/generation_results.jsonl and checks whether the confidence
 label (High / Medium / Low) correlates with faithfulness scores.
 
+With --fit, refits the confidence parameters (see calibration.py) so the
+confidence value predicts judged answer quality,
+
+    quality = ((faithfulness + answer_relevance) / 2 - 1) / 4   ∈ [0, 1]
+
+by minimising the mean squared error (Brier score) between the two:
+
+  - label thresholds, spread thresholds and the good-hit threshold are
+    grid-searched over quantiles of the observed distances;
+  - spread penalty and multi-source boost are grid-searched over small
+    fixed grids;
+  - per-label values are solved in closed form for every grid point (the
+    mean residual per label) and made monotone High ≥ Medium ≥ Low by
+    isotonic regression.
+
+Every grid point is scored in one vectorised NumPy pass per label-threshold
+pair.  Each label must cover at least --min-bucket questions so the fit
+cannot collapse everything into one label.  The result is written as the
+next versioned artefact under eval/calibration/, which rag.py loads at
+startup.
+
+Retrieval scores come from each record's confidence["source_scores"];
+records written before those were stored have their retrieval re-run.
+
 Usage:
   uv run python -m src.eval_calibration
   uv run python -m src.eval_calibration --results eval/generation_results.jsonl
+  uv run python -m src.eval_calibration --fit
+  uv run python -m src.eval_calibration --fit --min-bucket 5 --dry-run
 """
 from __future__ import annotations
 
 import argparse
 import json
 from collections import defaultdict
+from datetime import datetime, timezone
 from pathlib import Path
 
+import numpy as np
+
+from src import calibration
+from src.calibration import CalibrationParams
+
 RESULTS_PATH = Path("eval/generation_results.jsonl")
 
+LABELS = ("High", "Medium", "Low")
+N_QUANTILES = 13                                    # threshold candidates per distance feature
+PENALTY_GRID = np.array([0.0, 0.025, 0.05, 0.075, 0.10, 0.15])
+BOOST_GRID = np.array([0.0, 0.025, 0.05, 0.075, 0.10])
 
-def calibrate(results_path: Path) -> None:
+
+def load_records(results_path: Path) -> list[dict]:
     records = []
     with results_path.open("r", encoding="utf-8") as f:
         for line in f:
             line = line.strip()
             if line:
                 records.append(json.loads(line))
+    return records
+
+
+def calibrate(results_path: Path) -> None:
+    records = load_records(results_path)
 
     # Filter to records that have both confidence and faithfulness
     valid = [
@@ -100,6 +142,199 @@ def calibrate(results_path: Path) -> None:
                 print(f"    {l}: {group_avgs[l]:.2f}")
 
 
+# ── Fitting ───────────────────────────────────────────────────────────────────
+
+def _source_scores(records: list[dict]) -> list[list[tuple[str, float]]]:
+    """(title, distance) pairs per record, re-running retrieval where missing."""
+    missing = [r for r in records if "source_scores" not in r["confidence"]]
+    if missing:
+        from src import rag
+        rag.disable_answer_cache()
+        print(f"Re-running retrieval for {len(missing)} records without stored source scores …")
+        for r in missing:
+            _hits, _ctx, _sources, conf = rag.retrieve_context(
+                r["question"], k=r.get("k", rag.DEFAULT_K), chunker=r.get("chunker", "token")
+            )
+            r["confidence"]["source_scores"] = conf.get("source_scores", [])
+    return [[(t, float(sc)) for t, sc in r["confidence"]["source_scores"]] for r in records]
+
+
+def _anchor_spread(score_lists: list[list[tuple[str, float]]]) -> tuple[np.ndarray, np.ndarray]:
+    anchor, spread = [], []
+    for pairs in score_lists:
+        d = np.sort([sc for _, sc in pairs])
+        anchor.append(d[:3].mean())
+        spread.append(d[-1] - d[0])
+    return np.array(anchor), np.array(spread)
+
+
+def _boost_flags(score_lists: list[list[tuple[str, float]]], thresholds: np.ndarray) -> np.ndarray:
+    """(len(thresholds), N) — ≥3 hits below the threshold from ≥2 distinct titles."""
+    flags = np.zeros((len(thresholds), len(score_lists)))
+    for j, pairs in enumerate(score_lists):
+        titles = np.array([t for t, _ in pairs], dtype=object)
+        d = np.array([sc for _, sc in pairs])
+        for i, g in enumerate(thresholds):
+            good = d < g
+            flags[i, j] = good.sum() >= 3 and len(set(titles[good])) >= 2
+    return flags
+
+
+def predict(p: CalibrationParams, score_lists: list[list[tuple[str, float]]]) -> tuple[np.ndarray, np.ndarray]:
+    """Vectorised rag._confidence_from_sources(): (label index, value) per record."""
+    anchor, spread = _anchor_spread(score_lists)
+    label = np.where(anchor <= p.high_threshold, 0, np.where(anchor <= p.medium_threshold, 1, 2))
+    value = np.array([p.high_value, p.medium_value, p.low_value])[label]
+    value -= p.spread_penalty * ((spread > p.spread_threshold_1).astype(float) + (spread > p.spread_threshold_2))
+    value += p.multi_source_boost * _boost_flags(score_lists, np.array([p.good_hit_threshold]))[0]
+    return label, np.clip(value, 0.0, 1.0)
+
+
+def _candidates(values: np.ndarray, current: float) -> np.ndarray:
+    qs = np.quantile(values, np.linspace(0.0, 1.0, N_QUANTILES))
+    return np.unique(np.round(np.append(qs, current), 4))
+
+
+def _isotonic3(means: np.ndarray, w: np.ndarray) -> np.ndarray:
+    """
+    Non-increasing weighted isotonic fit of three bucket means (last axis).
+    Tries every contiguous pooling and keeps the feasible one with the lowest
+    squared error, i.e. the highest Σ w·v².
+    """
+    m0, m1, m2 = means[..., 0], means[..., 1], means[..., 2]
+    p01 = (w[0] * m0 + w[1] * m1) / (w[0] + w[1])
+    p12 = (w[1] * m1 + w[2] * m2) / (w[1] + w[2])
+    pall = (w[0] * m0 + w[1] * m1 + w[2] * m2) / w.sum()
+    options = np.stack([
+        np.stack([m0, m1, m2], axis=-1),
+        np.stack([p01, p01, m2], axis=-1),
+        np.stack([m0, p12, p12], axis=-1),
+        np.stack([pall, pall, pall], axis=-1),
+    ], axis=-2)                                                         # (…, 4, 3)
+    feasible = (options[..., 0] >= options[..., 1]) & (options[..., 1] >= options[..., 2])
+    score = np.where(feasible, (options ** 2 * w).sum(axis=-1), -np.inf)
+    best = np.argmax(score, axis=-1)[..., None, None]
+    return np.take_along_axis(options, best, axis=-2)[..., 0, :]
+
+
+def fit(
+    score_lists: list[list[tuple[str, float]]],
+    quality: np.ndarray,
+    min_bucket: int,
+    current: CalibrationParams,
+) -> tuple[CalibrationParams, float]:
+    """Grid-search + closed-form fit; returns the best parameters and their MSE."""
+    anchor, spread = _anchor_spread(score_lists)
+    all_scores = np.concatenate([[sc for _, sc in pairs] for pairs in score_lists])
+
+    label_grid = _candidates(anchor, current.high_threshold)
+    label_grid = np.unique(np.append(label_grid, current.medium_threshold))
+    spread_grid = _candidates(spread, current.spread_threshold_1)
+    spread_grid = np.unique(np.append(spread_grid, current.spread_threshold_2))
+    good_grid = _candidates(all_scores, current.good_hit_threshold)
+
+    # Adjustment to the label value for every (s1, s2, penalty, good, boost) point: (S, S, P, G, B, N)
+    trig = (spread[None, :] > spread_grid[:, None]).astype(float)
+    n_spread = trig[:, None, :] + trig[None, :, :]
+    flags = _boost_flags(score_lists, good_grid)
+    adj = (
+        -PENALTY_GRID[None, None, :, None, None, None] * n_spread[:, :, None, None, None, :]
+        + BOOST_GRID[None, None, None, None, :, None] * flags[None, None, None, :, None, :]
+    )
+    spread_ok = (spread_grid[:, None] <= spread_grid[None, :])[:, :, None, None, None]
+    residual = quality - adj
+
+    best_loss, best = np.inf, None
+    for hi in label_grid:
+        for med in label_grid[label_grid > hi]:
+            label = np.where(anchor <= hi, 0, np.where(anchor <= med, 1, 2))
+            counts = np.bincount(label, minlength=3).astype(float)
+            if counts.min() < min_bucket:
+                continue
+            onehot = np.eye(3)[label].T                                 # (3, N)
+            values = np.clip(_isotonic3(residual @ onehot.T / counts, counts), 0.0, 1.0)
+            pred = np.clip(values[..., label] + adj, 0.0, 1.0)
+            loss = np.where(spread_ok, ((pred - quality) ** 2).mean(axis=-1), np.inf)
+            idx = np.unravel_index(np.argmin(loss), loss.shape)
+            if loss[idx] < best_loss:
+                s1, s2, pi, gi, bi = idx
+                best_loss = float(loss[idx])
+                best = CalibrationParams(
+                    high_threshold=float(hi),
+                    medium_threshold=float(med),
+                    high_value=round(float(values[idx][0]), 4),
+                    medium_value=round(float(values[idx][1]), 4),
+                    low_value=round(float(values[idx][2]), 4),
+                    spread_threshold_1=float(spread_grid[s1]),
+                    spread_threshold_2=float(spread_grid[s2]),
+                    spread_penalty=float(PENALTY_GRID[pi]),
+                    good_hit_threshold=float(good_grid[gi]),
+                    multi_source_boost=float(BOOST_GRID[bi]),
+                )
+    if best is None:
+        raise ValueError(
+            f"No threshold pair puts ≥{min_bucket} questions in every label; lower --min-bucket."
+        )
+    return best, best_loss
+
+
+def _collection_versions(chunkers: set[str]) -> dict | None:
+    try:
+        from src.retrieve import collection_version
+        return {c: collection_version(c) for c in sorted(chunkers)}
+    except Exception:
+        return None
+
+
+def fit_and_save(results_path: Path, min_bucket: int | None = None, dry_run: bool = False) -> None:
+    records = [
+        r for r in load_records(results_path)
+        if r.get("confidence") and r.get("faithfulness") is not None and r.get("answer_relevance") is not None
+    ]
+    score_lists = _source_scores(records)
+    keep = [i for i, pairs in enumerate(score_lists) if pairs]
+    records = [records[i] for i in keep]
+    score_lists = [score_lists[i] for i in keep]
+    if len(records) < 10:
+        print(f"Only {len(records)} usable records — need at least 10 to fit.")
+        return
+
+    quality = np.array([((r["faithfulness"] + r["answer_relevance"]) / 2 - 1) / 4 for r in records])
+    min_bucket = min_bucket or max(3, len(records) // 10)
+    current = calibration.load()
+
+    fitted, fitted_loss = fit(score_lists, quality, min_bucket, current)
+    _, base_value = predict(current, score_lists)
+    base_loss = float(((base_value - quality) ** 2).mean())
+    label, _ = predict(fitted, score_lists)
+
+    source = f"v{current.version}" if current.version else "config defaults"
+    print(f"\nConfidence fit  ({len(records)} records, min {min_bucket} per label)")
+    print("=" * 70)
+    print(f"{'Parameter':<22} {'Current':>12} {'Fitted':>12}")
+    print("-" * 70)
+    for name, new in fitted.to_params().items():
+        print(f"{name:<22} {getattr(current, name):>12.4f} {new:>12.4f}")
+    print("-" * 70)
+    print(f"{'MSE vs quality':<22} {base_loss:>12.4f} {fitted_loss:>12.4f}   (current = {source})")
+    for i, name in enumerate(LABELS):
+        rows = quality[label == i]
+        print(f"  {name:<8} {len(rows):>3} questions  mean quality {rows.mean():.2f}")
+    print("=" * 70)
+
+    if dry_run:
+        return
+    path = calibration.save(fitted, {
+        "fitted_at": datetime.now(timezone.utc).isoformat(),
+        "results": str(results_path),
+        "n_records": len(records),
+        "min_bucket": min_bucket,
+        "collection_versions": _collection_versions({r.get("chunker", "token") for r in records}),
+        "mse": {"previous": round(base_loss, 6), "fitted": round(fitted_loss, 6)},
+    })
+    print(f"\nCalibration saved to: {path}  (loaded by rag.py at next startup)")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Confidence calibration analysis")
     parser.add_argument(
@@ -107,8 +342,27 @@ def main():
         default=str(RESULTS_PATH),
         help=f"Path to generation results JSONL (default: {RESULTS_PATH})",
     )
+    parser.add_argument(
+        "--fit",
+        action="store_true",
+        help="Refit the confidence parameters and write a new calibration artefact",
+    )
+    parser.add_argument(
+        "--min-bucket",
+        type=int,
+        default=None,
+        help="Minimum questions per confidence label when fitting (default: max(3, 10%%))",
+    )
+    parser.add_argument(
+        "--dry-run",
+        action="store_true",
+        help="With --fit, print the fitted parameters without writing an artefact",
+    )
     args = parser.parse_args()
-    calibrate(Path(args.results))
+    if args.fit:
+        fit_and_save(Path(args.results), min_bucket=args.min_bucket, dry_run=args.dry_run)
+    else:
+        calibrate(Path(args.results))
 
 
 if __name__ == "__main__":
@@ -5,29 +5,47 @@ Metrics:
   faithfulness    (1–5): are all claims in the answer grounded in the context?
   answer_relevance (1–5): does the answer actually address the question?
 
+Questions are generated and judged concurrently (--workers).  Each record
+is appended to the output as soon as it is scored, so an interrupted run can
+be continued with --resume, which skips question IDs already scored with the
+same chunker, k and judge model and keeps results for other settings in the
+file (without --resume the file is overwritten).  Judgements are cached in
+eval/judge_cache.jsonl keyed by (question, context hash, answer hash, judge
+model), so re-judging an identical answer never calls the judge again.
+
 Usage:
   uv run python -m src.eval_generation
   uv run python -m src.eval_generation --chunker parent_child
+  uv run python -m src.eval_generation --workers 16 --resume
+  uv run python -m src.eval_generation --batch                        # OpenAI Batch API
+  uv run python -m src.eval_generation --batch --batch-backend local  # in-process stand-in
 """
 from __future__ import annotations
 
 import argparse
+import hashlib
 import json
 import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime, timezone
 from pathlib import Path
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+from src import cassette, rag
+from src.batch import BatchRequest, get_backend, run_batch, to_openai_messages
+from src.config import BATCH_BACKEND, LLM_MODEL, LLM_TEMPERATURE
 from src.rag import generate_answer
+from src.retrieve import embed_queries
 
 QUESTIONS_PATH = Path("eval/questions.jsonl")
 OUT_PATH = Path("eval/generation_results.jsonl")
+JUDGE_CACHE_PATH = Path("eval/judge_cache.jsonl")
 
 _parser = StrOutputParser()
 
@@ -57,7 +75,7 @@ Return exactly this JSON (no markdown fences, no extra keys):
 )
 
 def _make_judge_chain(model: str = "gpt-4.1"):
-    llm = ChatOpenAI(model=model, temperature=0)
+    llm = cassette.chat_model(model=model, temperature=0)
     return _JUDGE_PROMPT | llm | _parser
 
 
@@ -82,17 +100,123 @@ def _parse_scores(raw: str) -> dict:
         }
 
 
-def _build_context_text(sources: list[dict]) -> str:
-    """Reconstruct a readable context string from the sources metadata."""
-    parts = []
-    for s in sources:
-        preview = s.get("preview", "")
-        title = s.get("title", "Unknown")
-        parts.append(f"[{s['n']}] {title}: {preview}")
-    return "\n\n".join(parts) if parts else "(no context retrieved)"
+# ── Judge cache ───────────────────────────────────────────────────────────────
+
+def _sha(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _judge_key(question: str, context: str, answer: str, judge_model: str) -> str:
+    return _sha("\x1f".join([question, _sha(context), _sha(answer), judge_model]))
+
+
+class JudgeCache:
+    """Append-only JSONL cache of parsed judge scores."""
+
+    def __init__(self, path: Path) -> None:
+        self._path = path
+        self._lock = threading.Lock()
+        self._scores: dict[str, dict] = {}
+        if path.exists():
+            with path.open("r", encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        rec = json.loads(line)
+                        self._scores[rec["key"]] = rec["scores"]
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            return self._scores.get(key)
+
+    def put(self, key: str, scores: dict) -> None:
+        with self._lock:
+            self._scores[key] = scores
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            with self._path.open("a", encoding="utf-8") as f:
+                f.write(json.dumps({"key": key, "scores": scores}, ensure_ascii=False) + "\n")
+
+
+# ── Evaluation ────────────────────────────────────────────────────────────────
+
+def _evaluate_one(q: dict, chunker: str, k: int, judge_chain, judge_model: str, cache: JudgeCache) -> dict:
+    """Generate and judge one question; returns its output record."""
+    question = q["question"]
+
+    # 1. Generate answer (context is the full string passed to the LLM)
+    answer, sources, _hits, confidence, context_text = generate_answer(
+        question, k=k, chunker=chunker
+    )
+
+    # 2. Judge (only failed parses are re-judged on a later run)
+    key = _judge_key(question, context_text, answer, judge_model)
+    scores = cache.get(key)
+    if scores is None:
+        raw = judge_chain.invoke({
+            "question": question,
+            "context": context_text,
+            "answer": answer,
+        })
+        scores = _parse_scores(raw)
+        if scores["faithfulness"] is not None:
+            cache.put(key, scores)
+
+    return _make_record(q, chunker, k, judge_model, answer, sources, confidence, context_text, scores)
+
+
+def _make_record(
+    q: dict,
+    chunker: str,
+    k: int,
+    judge_model: str,
+    answer: str,
+    sources: list[dict],
+    confidence: dict,
+    context_text: str,
+    scores: dict,
+) -> dict:
+    return {
+        "id": q["id"],
+        "question": q["question"],
+        "chunker": chunker,
+        "k": k,
+        "judge_model": judge_model,
+        "answer": answer,
+        "context_preview": context_text[:400],
+        "sources": [s.get("title") for s in sources],
+        "confidence": confidence,
+        "faithfulness": scores["faithfulness"],
+        "answer_relevance": scores["answer_relevance"],
+        "faithfulness_reason": scores["faithfulness_reason"],
+        "answer_relevance_reason": scores["answer_relevance_reason"],
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+
+def _same_settings(rec: dict, chunker: str, k: int, judge_model: str) -> bool:
+    return (
+        rec.get("chunker") == chunker
+        and rec.get("k", k) == k
+        and rec.get("judge_model", judge_model) == judge_model
+    )
+
+
+def _read_records() -> list[dict]:
+    if not OUT_PATH.exists():
+        return []
+    with OUT_PATH.open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
 
 
-def evaluate(chunker: str = "token", k: int = 15, judge_model: str = "gpt-4.1") -> None:
+def _load_scored(chunker: str, k: int, judge_model: str) -> dict[str, dict]:
+    """Records in OUT_PATH already scored under the same settings, by question ID."""
+    return {
+        rec["id"]: rec
+        for rec in _read_records()
+        if rec.get("faithfulness") is not None and _same_settings(rec, chunker, k, judge_model)
+    }
+
+
+def _load_ml_questions() -> list[dict]:
     questions = []
     with QUESTIONS_PATH.open("r", encoding="utf-8") as f:
         for line in f:
@@ -101,57 +225,33 @@ def evaluate(chunker: str = "token", k: int = 15, judge_model: str = "gpt-4.1")
                 questions.append(json.loads(line))
 
     # Skip refusal questions — no answer quality to judge
-    ml_questions = [q for q in questions if not q.get("expect_refusal")]
-
-    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
-    results = []
-
-    judge_chain = _make_judge_chain(judge_model)
-    print(f"\nEvaluating {len(ml_questions)} questions  [chunker={chunker}, k={k}, judge={judge_model}]\n")
-    print(f"{'ID':<6} {'Faithful':>8} {'Relevant':>8}  Question")
-    print("-" * 70)
-
-    with OUT_PATH.open("w", encoding="utf-8") as out:
-        for q in ml_questions:
-            qid = q["id"]
-            question = q["question"]
-
-            # 1. Generate answer (context is the full string passed to the LLM)
-            answer, sources, _hits, confidence, context_text = generate_answer(
-                question, k=k, chunker=chunker
-            )
-
-            # 3. Judge
-            raw = judge_chain.invoke({
-                "question": question,
-                "context": context_text,
-                "answer": answer,
-            })
-            scores = _parse_scores(raw)
-
-            record = {
-                "id": qid,
-                "question": question,
-                "chunker": chunker,
-                "answer": answer,
-                "context_preview": context_text[:400],
-                "sources": [s.get("title") for s in sources],
-                "confidence": confidence,
-                "faithfulness": scores["faithfulness"],
-                "answer_relevance": scores["answer_relevance"],
-                "faithfulness_reason": scores["faithfulness_reason"],
-                "answer_relevance_reason": scores["answer_relevance_reason"],
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
-            results.append(record)
+    return [q for q in questions if not q.get("expect_refusal")]
+
+
+def _write_ordered(
+    results: dict[str, dict], ml_questions: list[dict],
+    chunker: str, k: int, judge_model: str, resume: bool,
+) -> list[dict]:
+    """
+    Rewrite OUT_PATH with this run's records in question order, dropping
+    superseded lines for the same settings.  With *resume*, records for other
+    settings are carried over unchanged, ahead of them.
+    """
+    ordered = [results[q["id"]] for q in ml_questions if q["id"] in results]
+    others = [
+        rec for rec in (_read_records() if resume else [])
+        if not _same_settings(rec, chunker, k, judge_model)
+    ]
+    tmp = OUT_PATH.with_suffix(".jsonl.tmp")
+    with tmp.open("w", encoding="utf-8") as out:
+        for record in [*others, *ordered]:
             out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    tmp.replace(OUT_PATH)
+    return ordered
 
-            f_str = str(scores["faithfulness"]) if scores["faithfulness"] else "ERR"
-            r_str = str(scores["answer_relevance"]) if scores["answer_relevance"] else "ERR"
-            print(f"{qid:<6} {f_str:>8} {r_str:>8}  {question[:55]}")
 
-    # Aggregate summary
-    valid = [r for r in results if r["faithfulness"] is not None]
+def _print_summary(ordered: list[dict], n_questions: int) -> None:
+    valid = [r for r in ordered if r["faithfulness"] is not None]
     if valid:
         avg_f = sum(r["faithfulness"] for r in valid) / len(valid)
         avg_r = sum(r["answer_relevance"] for r in valid) / len(valid)
@@ -163,12 +263,175 @@ def evaluate(chunker: str = "token", k: int = 15, judge_model: str = "gpt-4.1")
         bar_r = "█" * round(avg_r * 4) + "░" * (20 - round(avg_r * 4))
         print(f"  Faithfulness     {avg_f:.2f}/5.00  {bar_f}")
         print(f"  Answer Relevance {avg_r:.2f}/5.00  {bar_r}")
-        print(f"  Questions scored: {len(valid)}/{len(ml_questions)}")
+        print(f"  Questions scored: {len(valid)}/{n_questions}")
         print("=" * 70)
 
     print(f"\nResults saved to: {OUT_PATH}")
 
 
+def _print_row(record: dict) -> None:
+    f_str = str(record["faithfulness"]) if record["faithfulness"] else "ERR"
+    r_str = str(record["answer_relevance"]) if record["answer_relevance"] else "ERR"
+    print(f"{record['id']:<6} {f_str:>8} {r_str:>8}  {record['question'][:55]}")
+
+
+def evaluate(
+    chunker: str = "token",
+    k: int = 15,
+    judge_model: str = "gpt-4.1",
+    workers: int = 8,
+    resume: bool = False,
+) -> None:
+    ml_questions = _load_ml_questions()
+
+    # Every question must be answered by the pipeline itself, not served from
+    # the semantic answer cache because a similar question was asked earlier
+    rag.disable_answer_cache()
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    done = _load_scored(chunker, k, judge_model) if resume else {}
+    todo = [q for q in ml_questions if q["id"] not in done]
+
+    # Embed every question in one batched call; generate_answer() reuses the
+    # memoised vectors instead of embedding each question separately
+    if todo:
+        embed_queries([q["question"] for q in todo])
+
+    judge_chain = _make_judge_chain(judge_model)
+    cache = JudgeCache(JUDGE_CACHE_PATH)
+    print(
+        f"\nEvaluating {len(todo)} questions  [chunker={chunker}, k={k}, judge={judge_model}, "
+        f"workers={workers}]" + (f"  — {len(done)} already scored, skipped" if done else "") + "\n"
+    )
+    print(f"{'ID':<6} {'Faithful':>8} {'Relevant':>8}  Question")
+    print("-" * 70)
+
+    results: dict[str, dict] = dict(done)
+    with OUT_PATH.open("a" if resume else "w", encoding="utf-8") as out, \
+            ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="eval-gen") as pool:
+        futures = {
+            pool.submit(_evaluate_one, q, chunker, k, judge_chain, judge_model, cache): q
+            for q in todo
+        }
+        for future in as_completed(futures):
+            q = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                print(f"{q['id']:<6} {'FAILED':>17}  {type(e).__name__}: {e}")
+                continue
+            results[record["id"]] = record
+            # Written as soon as scored so a crash loses at most in-flight questions
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+
+            _print_row(record)
+
+    ordered = _write_ordered(results, ml_questions, chunker, k, judge_model, resume)
+    _print_summary(ordered, len(ml_questions))
+
+
+def evaluate_batch(
+    chunker: str = "token",
+    k: int = 15,
+    judge_model: str = "gpt-4.1",
+    backend: str = BATCH_BACKEND,
+    workers: int = 8,
+    resume: bool = False,
+) -> None:
+    """
+    Same evaluation through the batch interface (see src.batch): retrieval
+    runs locally, then all answers are generated in one batch job and all
+    judgements (minus judge-cache hits) in a second one.
+    """
+    ml_questions = _load_ml_questions()
+    rag.disable_answer_cache()
+
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    done = _load_scored(chunker, k, judge_model) if resume else {}
+    todo = [q for q in ml_questions if q["id"] not in done]
+    batch_backend = get_backend(backend)
+    cache = JudgeCache(JUDGE_CACHE_PATH)
+
+    print(
+        f"\nBatch-evaluating {len(todo)} questions  [chunker={chunker}, k={k}, "
+        f"judge={judge_model}, backend={backend}]"
+        + (f"  — {len(done)} already scored, skipped" if done else "") + "\n"
+    )
+
+    # 1. Retrieval and context building (local, concurrent)
+    if todo:
+        embed_queries([q["question"] for q in todo])
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="eval-gen") as pool:
+        prepared = dict(zip(
+            [q["id"] for q in todo],
+            pool.map(lambda q: rag.prepare_generation(q["question"], k=k, chunker=chunker), todo),
+        ))
+
+    # 2. Generation batch (questions refused by the early-refusal gate are already answered)
+    generated = run_batch([
+        BatchRequest(qid, LLM_MODEL, to_openai_messages(p[4]), LLM_TEMPERATURE)
+        for qid, p in prepared.items() if p[4] is not None
+    ], job="generate", backend=batch_backend)
+
+    answers: dict[str, str] = {}
+    for q in todo:
+        refusal = prepared[q["id"]][3].get("refusal")
+        if refusal:
+            answers[q["id"]] = refusal
+            continue
+        res = generated[q["id"]]
+        if res.error:
+            print(f"{q['id']:<6} {'FAILED':>17}  generation: {res.error}")
+        else:
+            answers[q["id"]] = res.content
+
+    # 3. Judge batch for answers without a cached judgement
+    by_id = {q["id"]: q for q in todo}
+    scores: dict[str, dict] = {}
+    judge_requests = []
+    for qid, answer in answers.items():
+        question, context_text = by_id[qid]["question"], prepared[qid][1]
+        key = _judge_key(question, context_text, answer, judge_model)
+        cached = cache.get(key)
+        if cached is not None:
+            scores[qid] = cached
+        else:
+            messages = _JUDGE_PROMPT.format_messages(question=question, context=context_text, answer=answer)
+            judge_requests.append(BatchRequest(qid, judge_model, to_openai_messages(messages), 0.0))
+
+    judged = run_batch(judge_requests, job="judge", backend=batch_backend)
+    for qid, res in judged.items():
+        if res.error:
+            print(f"{qid:<6} {'FAILED':>17}  judge: {res.error}")
+            continue
+        parsed = _parse_scores(res.content)
+        question, context_text = by_id[qid]["question"], prepared[qid][1]
+        if parsed["faithfulness"] is not None:
+            cache.put(_judge_key(question, context_text, answers[qid], judge_model), parsed)
+        scores[qid] = parsed
+
+    # 4. Ingest into the usual record format
+    print(f"\n{'ID':<6} {'Faithful':>8} {'Relevant':>8}  Question")
+    print("-" * 70)
+    results: dict[str, dict] = dict(done)
+    for q in todo:
+        qid = q["id"]
+        if qid not in scores:
+            continue
+        _hits, context_text, sources, confidence, _messages = prepared[qid]
+        answer = answers[qid]
+        if rag._is_refused(answer):
+            sources = []
+        results[qid] = _make_record(
+            q, chunker, k, judge_model, answer, sources, confidence, context_text, scores[qid]
+        )
+        _print_row(results[qid])
+
+    ordered = _write_ordered(results, ml_questions, chunker, k, judge_model, resume)
+    _print_summary(ordered, len(ml_questions))
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generation-level evaluation")
     parser.add_argument(
@@ -183,8 +446,37 @@ def main():
     parser.add_argument(
         "--judge-model", default="gpt-4.1", help="OpenAI model to use as judge (default: gpt-4.1)"
     )
+    parser.add_argument(
+        "--workers", type=int, default=8, help="Questions generated and judged concurrently (default: 8)"
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Keep existing results (including other chunkers, k values and judges) and only "
+             "evaluate question IDs not yet scored with these settings",
+    )
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate and judge through the batch interface instead of synchronous calls",
+    )
+    parser.add_argument(
+        "--batch-backend",
+        default=BATCH_BACKEND,
+        choices=["openai", "local"],
+        help=f"Batch backend: provider Batch API or local stand-in (default: {BATCH_BACKEND})",
+    )
     args = parser.parse_args()
-    evaluate(chunker=args.chunker, k=args.k, judge_model=args.judge_model)
+    if args.batch:
+        evaluate_batch(
+            chunker=args.chunker, k=args.k, judge_model=args.judge_model,
+            backend=args.batch_backend, workers=args.workers, resume=args.resume,
+        )
+    else:
+        evaluate(
+            chunker=args.chunker, k=args.k, judge_model=args.judge_model,
+            workers=args.workers, resume=args.resume,
+        )
 
 
 if __name__ == "__main__":
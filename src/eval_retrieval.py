@@ -8,6 +8,14 @@ this script runs retrieval using one or more chunker strategies and computes:
   Recall@k     — fraction of relevant article titles that were retrieved
   Hit rate     — 1 if at least one relevant article was retrieved, else 0
   MRR          — reciprocal rank of the first relevant chunk hit
+  nDCG@k       — discounted gain of relevant articles at their first rank,
+                 normalised by the ideal ordering
+
+With several --k values, plain dense modes (token, semantic, parent_child)
+retrieve each question once at the largest k and score every cutoff on a
+prefix of that ranking.  Multi-query, hybrid and multicollection rankings
+depend on k (fusion pools and per-source depths scale with it), so those
+modes retrieve once per cutoff.
 
 Title matching is done with substring containment in both directions to handle
 Wikipedia redirects (e.g. "Transformer (machine learning)" → "Transformer
@@ -17,21 +25,39 @@ Usage
 -----
     uv run python -m src.eval_retrieval                          # token vs semantic
     uv run python -m src.eval_retrieval --chunkers token multiquery_token
+    uv run python -m src.eval_retrieval --chunkers token multicollection   # fused token+semantic+parent_child
+    uv run python -m src.eval_retrieval --chunkers hybrid_token multiquery_token  # needs src.bm25 index
     uv run python -m src.eval_retrieval --k 15                   # change top-k
+    uv run python -m src.eval_retrieval --k 5 10 15 30           # sweep cutoffs (one pass for dense modes)
+    uv run python -m src.eval_retrieval --workers 16 --rate 5    # 16 in flight, ≤ 5 starts/s
+
+Questions × chunkers are evaluated concurrently on a bounded thread pool
+(--workers, default 8), optionally rate-limited (--rate questions × chunkers
+started per second; each may run several searches) to stay under API limits.  Results are printed and saved in question order
+regardless of completion order.
+
+All questions are embedded up front in one batched call and each embedding
+is fanned out to every mode's collection; multi-query variants are generated
+once per question and shared by every multiquery_* mode.
 """
 
 from __future__ import annotations
 
 import argparse
 import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
 
+import numpy as np
 from dotenv import load_dotenv
 load_dotenv()
 
-from src.retrieve import search
-from src.retrieve_multiquery import search_multiquery
+from src.config import HYBRID_SEARCH
+from src.retrieve import embed_queries, search, search_multicollection
+from src.retrieve_multiquery import generate_queries, search_multiquery
 
 QUESTIONS_PATH = Path("eval/questions.jsonl")
 OUT_PATH = Path("eval/retrieval_results.jsonl")
@@ -70,61 +96,152 @@ def _is_relevant(retrieved_title: str, relevant_titles: list[str]) -> bool:
 
 # ── Per-question metrics ──────────────────────────────────────────────────────
 
-def _run_search(question: str, k: int, mode: str) -> list:
+class SharedQueries:
+    """
+    Per-question inputs shared by every retrieval mode in a run: question
+    embeddings (computed up front in one batched call) and multi-query
+    variants (generated once per question, on first use).  Without this each
+    mode would re-embed the question and re-run query generation.
+    """
+
+    def __init__(self, questions: list[str]) -> None:
+        questions = list(dict.fromkeys(questions))
+        self.vectors = dict(zip(questions, embed_queries(questions)))
+        self._variants: dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def variants(self, question: str) -> list[str]:
+        with self._lock:
+            future = self._variants.get(question)
+            owner = future is None
+            if owner:
+                future = self._variants[question] = Future()
+        if owner:
+            try:
+                future.set_result(generate_queries(question))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+
+def _run_search(
+    question: str, k: int, mode: str, shared: SharedQueries | None = None, verbose: bool = True,
+) -> list:
     """Dispatch to the correct search function based on *mode*."""
+    qv = shared.vectors.get(question) if shared else None
     if mode.startswith("multiquery_"):
         chunker = mode[len("multiquery_"):]
-        return search_multiquery(question, k=k, chunker=chunker)
-    return search(question, k=k, chunker=mode)
+        queries = shared.variants(question) if shared else None
+        return search_multiquery(
+            question, k=k, chunker=chunker, queries=queries, query_vector=qv, verbose=verbose,
+        )
+    if mode == "multicollection":
+        return search_multicollection(question, k=k, query_vector=qv)
+    if mode.startswith("hybrid_"):
+        return search(question, k=k, chunker=mode[len("hybrid_"):], hybrid=True, query_vector=qv)
+    return search(question, k=k, chunker=mode, query_vector=qv)
 
 
-def compute_metrics(
+def _depth(mode: str, k: int) -> int:
+    """How many hits *mode* returns for top-k (multi-query returns a 2k fused pool)."""
+    return k * 2 if mode.startswith("multiquery_") else k
+
+
+def _prefix_exact(mode: str) -> bool:
+    """
+    True when *mode*'s top-k is the first k hits of its top-K for any K > k,
+    i.e. plain dense search.  Fused rankings (multi-query, hybrid,
+    multicollection) are re-ordered by candidates that only appear at larger k.
+    """
+    return mode in ("token", "semantic", "parent_child") and not HYBRID_SEARCH
+
+
+def compute_metrics_multi(
     question: str,
     relevant_titles: list[str],
     chunker: str,
-    k: int,
-) -> dict:
-    """Run retrieval and return precision, recall, hit rate, and MRR."""
-    hits = _run_search(question, k=k, mode=chunker)
+    ks: list[int],
+    shared: SharedQueries | None = None,
+    verbose: bool = True,
+) -> dict[int, dict]:
+    """
+    Return precision, recall, hit rate, MRR and nDCG for every cutoff in *ks*.
+    Plain dense modes retrieve once at max(ks) and score each cutoff on a
+    prefix of that ranking; other modes retrieve once per cutoff.  *verbose*
+    controls the multi-query modes' query printout.
+    """
+    if len(ks) > 1 and not _prefix_exact(chunker):
+        return {
+            k: compute_metrics_multi(question, relevant_titles, chunker, [k], shared, verbose)[k]
+            for k in ks
+        }
 
-    # Deduplicate retrieved titles (a single article may have many chunks)
+    hits = _run_search(question, k=max(ks), mode=chunker, shared=shared, verbose=verbose)
+    titles = [(h.fields.get("title") or "").strip() for h in hits]
+    n = len(titles)
+
+    # Per-hit flags: relevant, and first occurrence of its article title
+    rel_cache: dict[str, bool] = {}
+    rel = np.array(
+        [bool(t) and rel_cache.setdefault(t, _is_relevant(t, relevant_titles)) for t in titles],
+        dtype=bool,
+    )
     seen: set[str] = set()
-    unique_titles: list[str] = []
-    for h in hits:
-        t = (h.fields.get("title") or "").strip()
+    first = np.zeros(n, dtype=bool)
+    for i, t in enumerate(titles):
         if t and t not in seen:
             seen.add(t)
-            unique_titles.append(t)
+            first[i] = True
 
-    relevant_retrieved = [t for t in unique_titles if _is_relevant(t, relevant_titles)]
+    # Cumulative counts over the ranking; index [c] = value for the first c hits
+    uniq_cum = np.concatenate(([0], np.cumsum(first)))
+    rel_uniq_cum = np.concatenate(([0], np.cumsum(first & rel)))
+    # nDCG: each relevant article earns a gain of 1 at its first (deduplicated) rank
+    discounts = 1.0 / np.log2(np.arange(2, n + 2))
+    dcg_cum = np.concatenate(([0.0], np.cumsum((first & rel) * discounts)))
+    first_rel = int(np.argmax(rel)) + 1 if rel.any() else None
 
-    n_retrieved = len(unique_titles)
-    n_relevant_retrieved = len(relevant_retrieved)
     n_relevant = len(relevant_titles)
+    unique_titles = [t for t, f in zip(titles, first) if f]
+    unique_rel = [bool(r) for r, f in zip(rel, first) if f]
+
+    out = {}
+    for k in ks:
+        c = min(_depth(chunker, k), n)
+        n_retrieved = int(uniq_cum[c])
+        n_relevant_retrieved = int(rel_uniq_cum[c])
+        ideal = min(n_relevant, c)
+        idcg = float(np.sum(1.0 / np.log2(np.arange(2, ideal + 2)))) if ideal else 0.0
+
+        precision = n_relevant_retrieved / n_retrieved if n_retrieved > 0 else 0.0
+        recall    = min(n_relevant_retrieved / n_relevant, 1.0) if n_relevant > 0 else 0.0
+        # MRR: rank is position in the full (non-deduplicated) hit list
+        mrr       = 1.0 / first_rel if first_rel is not None and first_rel <= c else 0.0
+        ndcg      = float(dcg_cum[c]) / idcg if idcg else 0.0
+
+        out[k] = {
+            "precision": round(precision, 3),
+            "recall":    round(recall, 3),
+            "hit":       n_relevant_retrieved > 0,
+            "mrr":       round(mrr, 3),
+            "ndcg":      round(ndcg, 3),
+            "n_relevant":           n_relevant,
+            "n_relevant_retrieved": n_relevant_retrieved,
+            "n_retrieved_unique":   n_retrieved,
+            "relevant_retrieved":   [t for t, r in zip(unique_titles[:n_retrieved], unique_rel) if r],
+            "retrieved_titles":     unique_titles[:n_retrieved],
+        }
+    return out
 
-    precision = n_relevant_retrieved / n_retrieved if n_retrieved > 0 else 0.0
-    recall    = min(n_relevant_retrieved / n_relevant, 1.0) if n_relevant > 0 else 0.0
-    hit       = n_relevant_retrieved > 0
-
-    # MRR: rank is position in the full (non-deduplicated) hit list
-    mrr = 0.0
-    for rank, h in enumerate(hits, start=1):
-        t = (h.fields.get("title") or "").strip()
-        if _is_relevant(t, relevant_titles):
-            mrr = 1.0 / rank
-            break
-
-    return {
-        "precision": round(precision, 3),
-        "recall":    round(recall, 3),
-        "hit":       hit,
-        "mrr":       round(mrr, 3),
-        "n_relevant":           n_relevant,
-        "n_relevant_retrieved": n_relevant_retrieved,
-        "n_retrieved_unique":   n_retrieved,
-        "relevant_retrieved":   relevant_retrieved,
-        "retrieved_titles":     unique_titles,
-    }
+
+def compute_metrics(
+    question: str,
+    relevant_titles: list[str],
+    chunker: str,
+    k: int,
+) -> dict:
+    """Run retrieval and return precision, recall, hit rate, MRR and nDCG at *k*."""
+    return compute_metrics_multi(question, relevant_titles, chunker, [k])[k]
 
 
 # ── Aggregation ───────────────────────────────────────────────────────────────
@@ -133,7 +250,7 @@ def aggregate(results: list[dict]) -> dict:
     """Mean metrics across all evaluated questions."""
     if not results:
         return {}
-    keys = ["precision", "recall", "hit", "mrr"]
+    keys = ["precision", "recall", "hit", "mrr", "ndcg"]
     return {k: round(sum(r[k] for r in results) / len(results), 3) for k in keys}
 
 
@@ -191,8 +308,8 @@ def print_results_table(all_results: dict[str, list[dict]], questions: list[dict
     print("=" * len(sep))
     print("  AGGREGATE SUMMARY")
     print("=" * len(sep))
-    metrics = ["precision", "recall", "hit", "mrr"]
-    labels  = ["Precision@k", "Recall@k   ", "Hit Rate   ", "MRR        "]
+    metrics = ["precision", "recall", "hit", "mrr", "ndcg"]
+    labels  = ["Precision@k", "Recall@k   ", "Hit Rate   ", "MRR        ", "nDCG@k     "]
     for label, metric in zip(labels, metrics):
         print(f"  {label}  " + "   ".join(
             f"{c.upper()}: {agg[metric]:.3f} {_bar(agg[metric])}"
@@ -201,6 +318,27 @@ def print_results_table(all_results: dict[str, list[dict]], questions: list[dict
     print()
 
 
+# ── Concurrency ───────────────────────────────────────────────────────────────
+
+class _RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all worker threads."""
+
+    def __init__(self, rate: float | None) -> None:
+        self._interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self) -> None:
+        if not self._interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next, now)
+            self._next = slot + self._interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 # ── Main ──────────────────────────────────────────────────────────────────────
 
 def load_questions() -> list[dict]:
@@ -213,32 +351,66 @@ def load_questions() -> list[dict]:
     return qs
 
 
-def main(chunkers: list[str], k: int) -> None:
+def main(chunkers: list[str], ks: list[int], workers: int = 8, rate: float | None = None) -> None:
     questions = load_questions()
     eval_qs   = [q for q in questions if q.get("relevant_titles")]  # skip refusal-only
+    ks = sorted(set(ks))
+    k = ks[0] if len(ks) == 1 else ks
 
-    print(f"\nEvaluating {len(eval_qs)} questions with k={k}, chunkers={chunkers} …\n")
+    # One column per chunker, or per chunker@k when sweeping several cutoffs
+    def label(chunker: str, cutoff: int) -> str:
+        return chunker if len(ks) == 1 else f"{chunker}@{cutoff}"
 
-    all_results: dict[str, list[dict]] = {c: [] for c in chunkers}
-    records = []
+    labels = [label(c, kc) for c in chunkers for kc in ks]
 
-    for q in eval_qs:
-        qid      = q["id"]
-        question = q["question"]
-        relevant = q["relevant_titles"]
+    print(
+        f"\nEvaluating {len(eval_qs)} questions with k={k}, chunkers={chunkers} "
+        f"(workers={workers}, rate={rate or 'unlimited'}) …\n"
+    )
 
-        row: dict = {"id": qid, "question": question, "relevant_titles": relevant, "k": k}
+    limiter = _RateLimiter(rate)
+    # Embed every question once, in one call, for all modes
+    shared = SharedQueries([q["question"] for q in eval_qs])
 
-        for chunker in chunkers:
-            metrics = compute_metrics(question, relevant, chunker, k)
-            all_results[chunker].append({"id": qid, **metrics})
-            row[chunker] = metrics
-            p, r, h, m = metrics["precision"], metrics["recall"], metrics["hit"], metrics["mrr"]
-            hit_sym = "✓" if h else "✗"
-            print(f"  [{chunker:>8}] {qid}: P={p:.3f}  R={r:.3f}  Hit={hit_sym}  MRR={m:.3f}")
+    def task(question: str, relevant: list[str], chunker: str) -> dict[int, dict]:
+        limiter.wait()
+        # Concurrent multi-query searches would interleave their query printouts
+        return compute_metrics_multi(question, relevant, chunker, ks, shared=shared, verbose=workers <= 1)
 
-        print()
-        records.append(row)
+    all_results: dict[str, list[dict]] = {lbl: [] for lbl in labels}
+    records = []
+
+    with ThreadPoolExecutor(max_workers=max(workers, 1), thread_name_prefix="eval") as pool:
+        futures = {
+            (q["id"], chunker): pool.submit(task, q["question"], q["relevant_titles"], chunker)
+            for q in eval_qs
+            for chunker in chunkers
+        }
+
+        # Consume in question order so output is identical to a sequential run
+        for q in eval_qs:
+            qid      = q["id"]
+            question = q["question"]
+            relevant = q["relevant_titles"]
+
+            row: dict = {"id": qid, "question": question, "relevant_titles": relevant, "k": k}
+
+            for chunker in chunkers:
+                by_k = futures[(qid, chunker)].result()
+                for kc in ks:
+                    lbl = label(chunker, kc)
+                    metrics = by_k[kc]
+                    all_results[lbl].append({"id": qid, **metrics})
+                    row[lbl] = metrics
+                    p, r, h, m = metrics["precision"], metrics["recall"], metrics["hit"], metrics["mrr"]
+                    hit_sym = "✓" if h else "✗"
+                    print(
+                        f"  [{lbl:>8}] {qid}: P={p:.3f}  R={r:.3f}  Hit={hit_sym}  MRR={m:.3f}"
+                        f"  nDCG={metrics['ndcg']:.3f}"
+                    )
+
+            print()
+            records.append(row)
 
     # Print comparison table
     print_results_table(all_results, questions)
@@ -257,8 +429,8 @@ def main(chunkers: list[str], k: int) -> None:
             "chunkers": chunkers,
             "timestamp": datetime.now(timezone.utc).isoformat(),
         }
-        for c in chunkers:
-            summary[c] = aggregate(all_results[c])
+        for lbl in labels:
+            summary[lbl] = aggregate(all_results[lbl])
         f.write(json.dumps(summary, ensure_ascii=False) + "\n")
 
     print(f"Results saved to: {OUT_PATH}")
@@ -269,15 +441,33 @@ if __name__ == "__main__":
     parser.add_argument(
         "--chunkers",
         nargs="+",
-        choices=["token", "semantic", "parent_child", "multiquery_token", "multiquery_semantic"],
+        choices=[
+            "token", "semantic", "parent_child",
+            "multiquery_token", "multiquery_semantic", "multicollection",
+            "hybrid_token", "hybrid_semantic", "hybrid_parent_child",
+        ],
         default=["token", "semantic"],
         help="Retrieval modes to evaluate (default: token semantic).",
     )
     parser.add_argument(
         "--k",
         type=int,
-        default=10,
-        help="Number of chunks to retrieve per query (default: 10).",
+        nargs="+",
+        default=[10],
+        help="Cutoff(s) to score; dense modes score them all from one retrieval at the largest (default: 10).",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=8,
+        help="Questions × chunkers evaluated concurrently (default: 8; 1 = sequential).",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=None,
+        help="Maximum questions × chunkers started per second across all workers; each may "
+             "run several searches (default: unlimited).",
     )
     args = parser.parse_args()
-    main(chunkers=args.chunkers, k=args.k)
+    main(chunkers=args.chunkers, ks=args.k, workers=args.workers, rate=args.rate)
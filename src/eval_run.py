@@ -1,8 +1,14 @@
+import argparse
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from datetime import datetime, timezone
 
+from src import rag
+from src.batch import BatchRequest, get_backend, run_batch, to_openai_messages
+from src.config import BATCH_BACKEND, LLM_MODEL, LLM_TEMPERATURE
 from src.rag import generate_answer
+from src.retrieve import embed_queries
 
 QUESTIONS_PATH = Path("eval/questions.jsonl")
 OUT_PATH = Path("eval/results.jsonl")
@@ -51,37 +57,91 @@ def check_expectations(q, answer, sources):
     return ok, notes
 
 
+def _write_record(out, q, answer, sources, confidence):
+    qid = q.get("id")
+    question = q["question"]
+
+    ok, notes = check_expectations(q, answer, sources)
+
+    record = {
+        "id": qid,
+        "question": question,
+        "answer": answer,
+        "confidence": confidence,
+        "sources": sources,
+        "ok": ok,
+        "notes": notes,
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+    }
+
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+    status = "OK" if ok else "FAIL"
+    print(f"[{status}] {qid}: {question}")
+
+
 def main():
     questions = load_questions()
     OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    # One batched embedding call up front; generate_answer() hits the memo
+    embed_queries([q["question"] for q in questions])
 
     with OUT_PATH.open("w", encoding="utf-8") as out:
         for q in questions:
-            qid = q.get("id")
-            question = q["question"]
+            answer, sources, hits, confidence, _ctx = generate_answer(q["question"], k=15)
+            _write_record(out, q, answer, sources, confidence)
 
-            answer, sources, hits, confidence, _ctx = generate_answer(question, k=15)
+    print(f"\nWrote results to: {OUT_PATH}")
 
-            ok, notes = check_expectations(q, answer, sources)
 
-            record = {
-                "id": qid,
-                "question": question,
-                "answer": answer,
-                "confidence": confidence,
-                "sources": sources,
-                "ok": ok,
-                "notes": notes,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-            }
+def main_batch(backend: str = BATCH_BACKEND, workers: int = 8):
+    """
+    Same run, but every answer is generated in one batch job (see src.batch);
+    only retrieval and context building happen locally.
+    """
+    questions = load_questions()
+    OUT_PATH.parent.mkdir(parents=True, exist_ok=True)
+    embed_queries([q["question"] for q in questions])
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="eval-run") as pool:
+        prepared = list(pool.map(lambda q: rag.prepare_generation(q["question"], k=15), questions))
 
-            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    results = run_batch([
+        BatchRequest(str(i), LLM_MODEL, to_openai_messages(p[4]), LLM_TEMPERATURE)
+        for i, p in enumerate(prepared) if p[4] is not None
+    ], job="eval_run", backend=get_backend(backend))
 
-            status = "OK" if ok else "FAIL"
-            print(f"[{status}] {qid}: {question}")
+    with OUT_PATH.open("w", encoding="utf-8") as out:
+        for i, (q, (_hits, _ctx, sources, confidence, messages)) in enumerate(zip(questions, prepared)):
+            if messages is None:
+                # Answered by the early-refusal gate
+                _write_record(out, q, confidence["refusal"], [], confidence)
+                continue
+            res = results[str(i)]
+            if res.error:
+                print(f"[FAIL] {q.get('id')}: generation failed — {res.error}")
+                continue
+            answer = res.content
+            _write_record(out, q, answer, [] if rag._is_refused(answer) else sources, confidence)
 
     print(f"\nWrote results to: {OUT_PATH}")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Run the eval question set end to end.")
+    parser.add_argument(
+        "--batch",
+        action="store_true",
+        help="Generate all answers in one batch job instead of synchronous calls",
+    )
+    parser.add_argument(
+        "--batch-backend",
+        default=BATCH_BACKEND,
+        choices=["openai", "local"],
+        help=f"Batch backend: provider Batch API or local stand-in (default: {BATCH_BACKEND})",
+    )
+    args = parser.parse_args()
+    if args.batch:
+        main_batch(backend=args.batch_backend)
+    else:
+        main()
\ No newline at end of file
@@ -0,0 +1,123 @@
+"""
+Rank fusion: merge several ranked hit lists into a single ranking.
+
+Used wherever one question produces more than one result list — multi-query
+variants, several Qdrant collections searched in parallel, or dense + lexical
+retrieval.  Merging by raw cosine distance favours whichever list produced
+the single closest hit; fusion methods instead reward documents that several
+lists agree on.
+
+Methods
+-------
+rrf      Reciprocal-rank fusion: sum of 1 / (rrf_k + rank) over lists.
+         Uses ranks only, so it is safe across lists with different score
+         scales (cosine distance vs BM25).
+combsum  Sum of per-list min-max normalised relevance.
+combmnz  combsum × number of lists the document appears in.
+max      Best per-list normalised relevance (closest to the old behaviour).
+
+Every hit in every list is expected to follow the pipeline convention that a
+lower ``score`` is better.  The fused value is written to ``Hit.fused_score``
+(higher = better).
+
+When several lists return the same chunk, the dense (Qdrant) copy is kept,
+with the best cosine distance among dense copies, its payload and its stored
+vector.  A lexical (BM25) copy is used only for chunks no dense list found:
+its negated BM25 score is not comparable with a cosine distance, and its
+fields are rebuilt from chunks.jsonl rather than the Qdrant payload.
+"""
+
+from __future__ import annotations
+
+from dataclasses import replace
+from typing import Callable
+
+from src.vector_store import Hit
+
+FUSION_METHODS = ("rrf", "combsum", "combmnz", "max")
+
+
+def hit_key(h: Hit) -> tuple:
+    """Identity of a hit across lists — chunk ids are only unique per collection."""
+    return (h.fields.get("chunker"), h.id)
+
+
+def _is_lexical(h: Hit) -> bool:
+    """True for BM25 hits (src.bm25), whose score is a negated BM25 score."""
+    return "bm25" in h.fields
+
+
+def _merge(kept: Hit | None, h: Hit) -> Hit:
+    """The copy of one chunk to keep when *h* is seen after *kept* (see module docstring)."""
+    if kept is None:
+        return h
+    if _is_lexical(kept) != _is_lexical(h):
+        return h if _is_lexical(kept) else kept
+    best = h if h.score < kept.score else kept
+    if best.vector is None:
+        other = kept if best is h else h
+        if other.vector is not None:
+            best = replace(best, vector=other.vector)
+    return best
+
+
+def _normalised_relevance(hits: list[Hit]) -> list[float]:
+    """Map each hit's score (lower = better) onto [0, 1] relevance (higher = better)."""
+    if not hits:
+        return []
+    scores = [h.score for h in hits]
+    lo, hi = min(scores), max(scores)
+    if hi == lo:
+        return [1.0] * len(hits)
+    return [(hi - s) / (hi - lo) for s in scores]
+
+
+def fuse(
+    ranked_lists: list[list[Hit]],
+    method: str = "rrf",
+    *,
+    rrf_k: int = 60,
+    key: Callable[[Hit], tuple] = hit_key,
+) -> list[Hit]:
+    """
+    Fuse *ranked_lists* (each best-first) into one list ordered by fused score.
+
+    Ties are broken by dense before lexical-only hits, then best original
+    score, then first appearance.
+    """
+    if method not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{method}'. Choose from: {list(FUSION_METHODS)}")
+
+    fused: dict[tuple, float] = {}
+    counts: dict[tuple, int] = {}
+    best: dict[tuple, Hit] = {}
+
+    for hits in ranked_lists:
+        relevance = _normalised_relevance(hits) if method != "rrf" else None
+        seen_in_list: set[tuple] = set()
+        for rank, h in enumerate(hits, start=1):
+            hk = key(h)
+            if hk in seen_in_list:
+                continue
+            seen_in_list.add(hk)
+
+            if method == "rrf":
+                contrib = 1.0 / (rrf_k + rank)
+            else:
+                contrib = relevance[rank - 1]
+
+            if method == "max":
+                fused[hk] = max(fused.get(hk, 0.0), contrib)
+            else:
+                fused[hk] = fused.get(hk, 0.0) + contrib
+            counts[hk] = counts.get(hk, 0) + 1
+            best[hk] = _merge(best.get(hk), h)
+
+    if method == "combmnz":
+        fused = {hk: v * counts[hk] for hk, v in fused.items()}
+
+    order = {hk: i for i, hk in enumerate(best)}
+    ranked = sorted(
+        fused, key=lambda hk: (-fused[hk], _is_lexical(best[hk]), best[hk].score, order[hk])
+    )
+    return [replace(best[hk], fused_score=fused[hk]) for hk in ranked]
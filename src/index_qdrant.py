@@ -14,14 +14,20 @@ import argparse
 import json
 import os
 import time
-import uuid
 from pathlib import Path
 
+import tiktoken
 from dotenv import load_dotenv
 from langchain_openai import OpenAIEmbeddings
 from qdrant_client.models import PointStruct
 
-from src.vector_store import COLLECTION_NAMES, EMBEDDING_DIM, QdrantVectorStore
+from src.vector_store import (
+    COLLECTION_NAMES,
+    EMBEDDING_DIM,
+    QdrantVectorStore,
+    chunk_payload,
+    point_id,
+)
 
 load_dotenv()
 
@@ -39,6 +45,22 @@ def load_chunks(chunks_path: Path, limit: int | None = None):
     return rows
 
 
+def add_token_counts(records: list[dict], encoding_name: str = "cl100k_base") -> list[dict]:
+    """
+    Attach exact token counts for ``text`` and ``parent_text``.
+
+    The ``token_count`` written at ingest time is approximate for the semantic
+    chunker and refers to the child for parent-child, so recount here with the
+    same encoding rag.py budgets the context with.
+    """
+    enc = tiktoken.get_encoding(encoding_name)
+    for r in records:
+        r["text_tokens"] = len(enc.encode(r["text"] or ""))
+        parent = r.get("parent_text")
+        r["parent_text_tokens"] = len(enc.encode(parent)) if parent else None
+    return records
+
+
 def embed_with_retry(emb, texts, retries=5):
     """Embed with retry logic to make indexing resilient to transient API errors."""
     for attempt in range(retries):
@@ -73,30 +95,20 @@ def main(
 
     inserted = 0
     for start in range(0, len(chunks), batch_size):
-        batch = chunks[start : start + batch_size]
+        batch = add_token_counts(chunks[start : start + batch_size])
         texts = [r["text"] for r in batch]
         vectors = embed_with_retry(emb, texts)
 
         points = [
-            PointStruct(
-                id=str(uuid.uuid5(uuid.NAMESPACE_DNS, str(r["id"]))),
-                vector=v,
-                payload={
-                    "text": r["text"],
-                    "title": r.get("title"),
-                    "section": r.get("section"),
-                    "source_url": r.get("source_url"),
-                    "chunk_id": str(r.get("chunk_index")),
-                    "parent_text": r.get("parent_text"),
-                },
-            )
+            PointStruct(id=point_id(r["id"]), vector=v, payload=chunk_payload(r))
             for r, v in zip(batch, vectors)
         ]
         store.upsert(points)
         inserted += len(points)
         print(f"Inserted {inserted}/{len(chunks)}")
 
-    print("Done indexing.")
+    build_id = store.mark_build()
+    print(f"Done indexing (build {build_id}).")
 
     # Quick retrieval smoke test
     query = "Explain the difference between supervised and unsupervised learning."
@@ -1,40 +1,80 @@
 from __future__ import annotations
+import asyncio
+import threading
+from collections import Counter, OrderedDict
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+import numpy as np
 import tiktoken
-from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import StrOutputParser
-from src.retrieve import search
+from src.retrieve import (
+    acollection_version,
+    aembed_query,
+    asearch,
+    collection_version,
+    embed_query,
+    search,
+)
+from src.rerank import rerank
+from src.context_packing import knapsack, trim_to_budget
+from src.compress import compress_hits
+from src.answer_cache import AnswerCache, CachedAnswer, replay_stream
+from src import calibration, cassette, request_log, singleflight, topic_gate, tracing, usage
+from src.tracing import Trace
 from src.config import (
     LLM_MODEL,
+    LLM_TEMPERATURE,
     DEFAULT_K,
     MAX_PER_TITLE,
     MAX_TOTAL_HITS,
     MAX_CONTEXT_TOKENS,
-    CONF_HIGH_THRESHOLD,
-    CONF_MEDIUM_THRESHOLD,
-    CONF_HIGH_VALUE,
-    CONF_MEDIUM_VALUE,
-    CONF_LOW_VALUE,
-    CONF_SPREAD_THRESHOLD_1,
-    CONF_SPREAD_THRESHOLD_2,
-    CONF_SPREAD_PENALTY,
-    CONF_GOOD_HIT_THRESHOLD,
-    CONF_MULTI_SOURCE_BOOST,
     REFUSAL_PHRASES,
     PREVIEW_CHARS,
+    ANSWER_CACHE_ENABLED,
+    ANSWER_CACHE_SIMILARITY,
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_PATH,
+    RERANK_ENABLED,
+    DIVERSITY_STRATEGY,
+    MMR_LAMBDA,
+    CONTEXT_PACKING,
+    CONTEXT_TRIM_TO_FIT,
+    COMPRESSION_ENABLED,
+    SINGLE_FLIGHT_ENABLED,
 )
 from dotenv import load_dotenv
 load_dotenv()
 
-_llm = ChatOpenAI(model=LLM_MODEL, temperature=0.2)
-_parser = StrOutputParser()
+# stream_usage=True makes the final streamed chunk carry token usage
+_llm = cassette.chat_model(model=LLM_MODEL, temperature=LLM_TEMPERATURE, stream_usage=True)
+
+# Confidence parameters: latest fitted artefact, else the config defaults
+_calibration = calibration.load()
 
 # Token counter for context budgeting
 _enc = tiktoken.get_encoding("cl100k_base")
 
+# Semantic answer cache — None when disabled in config
+_answer_cache = (
+    AnswerCache(
+        threshold=ANSWER_CACHE_SIMILARITY,
+        max_entries=ANSWER_CACHE_MAX_ENTRIES,
+        path=ANSWER_CACHE_PATH,
+    )
+    if ANSWER_CACHE_ENABLED
+    else None
+)
+
+# Bump whenever the prompt changes so cached answers from the old prompt are not reused
+PROMPT_VERSION = "v4"
 
-_prompt = ChatPromptTemplate.from_template(
-"""
+
+# Static instructions, sent as the system message.  This block must stay
+# byte-identical across requests (no template variables, no timestamps) so the
+# provider's automatic prompt caching can reuse it; everything request-specific
+# goes in the human message after it.
+_SYSTEM_PROMPT = """\
 You are an ML/AI tutor. You ONLY answer questions about machine learning, data science, and AI.
 
 If the question is not about machine learning, data science, or AI — regardless of what the context contains — respond with exactly:
@@ -55,28 +95,62 @@ STRICT GROUNDING RULES — you MUST follow these:
 - If a detail is not in the context, omit it or say "my sources don't cover this detail."
 - Include citations inline like [1], [2] matching the context blocks.
 - Do not cite sources you did not use.
-
-CONTEXT:
-{context}
-
-QUESTION:
-{question}
 """
-)
+
+_prompt = ChatPromptTemplate.from_messages([
+    ("system", _SYSTEM_PROMPT),
+    ("human", "CONTEXT:\n{context}\n\nQUESTION:\n{question}"),
+])
 
 
 def _token_len(text: str) -> int:
     return len(_enc.encode(text or ""))
 
 
+@lru_cache(maxsize=8192)
+def _header_tokens(citation_num: int, title: str, url: str | None) -> int:
+    """Token cost of a context block header; titles and URLs repeat across requests."""
+    return _token_len(f"[{citation_num}] Title: {title}\nURL: {url}\n\n")
+
+
+def _block_token_len(h, citation_num: int, title: str, url: str | None, text: str) -> int:
+    """
+    Token cost of a context block, using the counts stored in the payload at
+    index time (``text_tokens`` / ``parent_text_tokens``) plus the cached
+    header cost.  Falls back to encoding the text when the payload has none.
+    """
+    field = "parent_text_tokens" if h.fields.get("parent_text") else "text_tokens"
+    text_tokens = h.fields.get(field)
+    if text_tokens is None:
+        text_tokens = _token_len(text)
+    return _header_tokens(citation_num, title, url) + text_tokens
+
+
+def _rank_key(h) -> tuple:
+    """
+    Sort key for hits (ascending = best first).
+
+    Reranked hits come first, ordered by reranker score.  Then fused hits
+    (multi-query / multi-collection / hybrid) by fused score, and plain hits
+    by cosine distance.
+    """
+    reranked = getattr(h, "rerank_score", None)
+    if reranked is not None:
+        return (0, -reranked)
+    fused = getattr(h, "fused_score", None)
+    if fused is not None:
+        return (1, -fused)
+    return (1, getattr(h, "score", 1e9))
+
+
 def _select_diverse_hits(hits, *, max_per_title: int = MAX_PER_TITLE, max_total: int = MAX_TOTAL_HITS):
     """
     Select a diverse subset of hits:
-    - sort by score (lower is better for Zvec cosine distance)
+    - sort by rank (fused score if present, else cosine distance)
     - keep at most `max_per_title` per title
     - return at most `max_total` hits
     """
-    hits_sorted = sorted(hits, key=lambda h: getattr(h, "score", 1e9))
+    hits_sorted = sorted(hits, key=_rank_key)
 
     out = []
     per_title: dict[str, int] = {}
@@ -94,9 +168,76 @@ def _select_diverse_hits(hits, *, max_per_title: int = MAX_PER_TITLE, max_total:
     return out
 
 
+def _relevance(hits) -> np.ndarray:
+    """
+    Relevance in [0, 1] (higher = better) for MMR, from the strongest ranking
+    signal available: reranker score, then fused score, then cosine similarity.
+    Hits lacking the chosen signal get 0.
+    """
+    for attr in ("rerank_score", "fused_score"):
+        if any(getattr(h, attr, None) is not None for h in hits):
+            raw = np.array([
+                getattr(h, attr) if getattr(h, attr, None) is not None else np.nan
+                for h in hits
+            ], dtype=np.float32)
+            break
+    else:
+        raw = np.array([1.0 - getattr(h, "score", 1.0) for h in hits], dtype=np.float32)
+
+    lo, hi = np.nanmin(raw), np.nanmax(raw)
+    rel = (raw - lo) / (hi - lo) if hi > lo else np.ones_like(raw)
+    return np.nan_to_num(rel, nan=0.0)
+
+
+def _select_mmr_hits(hits, *, lam: float = MMR_LAMBDA, max_per_title: int = MAX_PER_TITLE,
+                     max_total: int = MAX_TOTAL_HITS):
+    """
+    Select hits by maximal marginal relevance over their embeddings:
+
+        argmax_i  lam * relevance(i) - (1 - lam) * max_{j in selected} cos(i, j)
+
+    Near-duplicate chunks (overlapping windows, redirected articles) are
+    penalised even when they come from different titles.  The per-title cap
+    still applies.  Hits without a vector count as dissimilar to everything.
+    """
+    if not hits:
+        return []
+
+    rel = _relevance(hits)
+    dim = next((len(h.vector) for h in hits if getattr(h, "vector", None) is not None), 0)
+    vecs = np.zeros((len(hits), dim), dtype=np.float32)
+    for i, h in enumerate(hits):
+        if getattr(h, "vector", None) is not None:
+            vecs[i] = h.vector
+    norms = np.linalg.norm(vecs, axis=1, keepdims=True)
+    vecs = np.divide(vecs, norms, out=np.zeros_like(vecs), where=norms > 0)
+    sim = vecs @ vecs.T
+
+    titles = [h.fields.get("title") or "Unknown" for h in hits]
+    per_title: dict[str, int] = {}
+    available = np.ones(len(hits), dtype=bool)
+    max_sim = np.zeros(len(hits), dtype=np.float32)
+    out = []
+
+    while len(out) < max_total and available.any():
+        scores = lam * rel - (1.0 - lam) * max_sim
+        scores[~available] = -np.inf
+        i = int(np.argmax(scores))
+        available[i] = False
+
+        title = titles[i]
+        if per_title.get(title, 0) >= max_per_title:
+            continue
+        per_title[title] = per_title.get(title, 0) + 1
+        out.append(hits[i])
+        max_sim = np.maximum(max_sim, sim[:, i])
+
+    return out
+
+
 def _confidence_from_sources(sources: list[dict]) -> dict:
     """
-    Heuristic confidence derived from Zvec cosine distance scores in `sources`.
+    Heuristic confidence derived from Qdrant cosine distance scores in `sources`.
 
     Expects each item to have 'score' (float | None) and optionally 'title'.
     Lower score = more similar (good).
@@ -105,8 +246,12 @@ def _confidence_from_sources(sources: list[dict]) -> dict:
     Penalises wide spread between best and worst hit.
     Boosts when multiple distinct titles score well (multi-source agreement).
 
+    Parameters come from _calibration (see calibration.py).
+
     Returns a dict with label, numeric value in [0, 1], and debug fields.
+    The raw (title, score) pairs are kept so eval_calibration can refit.
     """
+    p = _calibration
     valid = [s for s in sources if s.get("score") is not None]
     if not valid:
         return {"label": "Low", "value": 0.0, "best": None, "worst": None,
@@ -121,24 +266,24 @@ def _confidence_from_sources(sources: list[dict]) -> dict:
     top3 = scores_sorted[:3]
     anchor = sum(top3) / len(top3)
 
-    if anchor <= CONF_HIGH_THRESHOLD:
-        label, value = "High", CONF_HIGH_VALUE
-    elif anchor <= CONF_MEDIUM_THRESHOLD:
-        label, value = "Medium", CONF_MEDIUM_VALUE
+    if anchor <= p.high_threshold:
+        label, value = "High", p.high_value
+    elif anchor <= p.medium_threshold:
+        label, value = "Medium", p.medium_value
     else:
-        label, value = "Low", CONF_LOW_VALUE
+        label, value = "Low", p.low_value
 
     # Spread penalty: noisy hit set lowers confidence
-    if spread > CONF_SPREAD_THRESHOLD_1:
-        value -= CONF_SPREAD_PENALTY
-    if spread > CONF_SPREAD_THRESHOLD_2:
-        value -= CONF_SPREAD_PENALTY
+    if spread > p.spread_threshold_1:
+        value -= p.spread_penalty
+    if spread > p.spread_threshold_2:
+        value -= p.spread_penalty
 
     # Multi-source agreement boost: ≥3 good hits from ≥2 distinct titles
-    good_hits = [s for s in valid if s["score"] < CONF_GOOD_HIT_THRESHOLD]
+    good_hits = [s for s in valid if s["score"] < p.good_hit_threshold]
     unique_good_titles = len({s.get("title", "") for s in good_hits})
     if len(good_hits) >= 3 and unique_good_titles >= 2:
-        value += CONF_MULTI_SOURCE_BOOST
+        value += p.multi_source_boost
 
     value = max(0.0, min(1.0, value))
 
@@ -151,6 +296,8 @@ def _confidence_from_sources(sources: list[dict]) -> dict:
         "spread": round(spread, 4),
         "good_hits": len(good_hits),
         "unique_good_titles": unique_good_titles,
+        "calibration": p.version,
+        "source_scores": [[s.get("title", ""), s["score"]] for s in valid],
     }
 
 
@@ -159,68 +306,116 @@ def _build_context(
     *,
     max_context_tokens: int = MAX_CONTEXT_TOKENS,
     max_chunks_per_title: int = MAX_PER_TITLE,
+    packing: str = CONTEXT_PACKING,
+    question: str | None = None,
+    trim_to_fit: bool = CONTEXT_TRIM_TO_FIT,
 ) -> tuple[str, list[dict]]:
     """
     Build a bounded, deduplicated context string with numbered citations.
 
+    packing="greedy" walks hits in rank order and skips any block that would
+    overflow the budget.  packing="knapsack" picks the subset of blocks with
+    the highest total relevance that fits (see context_packing.py).  With
+    trim_to_fit and a question, the best block left out is trimmed to its most
+    relevant sentences to fill the remaining budget.
+
     Returns:
       context_str: formatted text blocks with [n] labels
       sources: list of dicts with citation metadata for UI display
     """
-    # Zvec cosine distance: lower score = more similar
-    hits_sorted = sorted(hits, key=lambda h: getattr(h, "score", 1e9))
-
-    sources: list[dict] = []
-    context_parts: list[str] = []
-    used_tokens = 0
+    # Reranker / fused score if present, else cosine distance (lower = more similar)
+    hits_sorted = sorted(hits, key=_rank_key)
 
-    per_title_count: dict[str, int] = {}
+    # ── Candidates: deduplicated, in rank order ───────────────────────────────
+    candidates: list[dict] = []
     seen: set[tuple] = set()  # (title, chunk_id) dedup guard
 
-    citation_num = 1
-
     for h in hits_sorted:
         title = h.fields.get("title") or "Unknown"
         chunk_id = h.fields.get("chunk_id")
-        text = h.fields.get("parent_text") or h.fields.get("text") or ""
-        url = h.fields.get("source_url")
-        score = getattr(h, "score", None)
-
         key = (title, chunk_id)
         if key in seen:
             continue
         seen.add(key)
 
-        # Limit redundancy: only include up to N chunks per page/title
-        per_title_count.setdefault(title, 0)
-        if per_title_count[title] >= max_chunks_per_title:
-            continue
+        text = h.fields.get("parent_text") or h.fields.get("text") or ""
+        url = h.fields.get("source_url")
+        candidates.append({
+            "rank": len(candidates),
+            "hit": h,
+            "title": title,
+            "chunk_id": chunk_id,
+            "url": url,
+            "text": text,
+            # Header cost at this position is an upper bound: final citation
+            # numbers can only be smaller once candidates are dropped
+            "tokens": _block_token_len(h, len(candidates) + 1, title, url, text),
+        })
 
-        block = f"[{citation_num}] Title: {title}\nURL: {url}\n\n{text}".strip()
-        block_tokens = _token_len(block)
+    # ── Selection under the token budget ─────────────────────────────────────
+    selected: list[dict] = []
+    per_title_count: dict[str, int] = {}
 
-        # Skip chunks that would exceed the token budget
-        if used_tokens + block_tokens > max_context_tokens:
-            continue
+    if packing == "knapsack":
+        # Limit redundancy first (best-ranked N per title), then pack optimally
+        pool = []
+        for c in candidates:
+            if per_title_count.get(c["title"], 0) < max_chunks_per_title:
+                per_title_count[c["title"]] = per_title_count.get(c["title"], 0) + 1
+                pool.append(c)
+        if pool:
+            values = 0.1 + 0.9 * _relevance([c["hit"] for c in pool])
+            chosen = knapsack(list(values), [c["tokens"] for c in pool], max_context_tokens)
+            selected = [pool[i] for i in chosen]
+    else:
+        used_tokens = 0
+        for c in candidates:
+            # Limit redundancy: only include up to N chunks per page/title
+            if per_title_count.get(c["title"], 0) >= max_chunks_per_title:
+                continue
+            # Skip chunks that would exceed the token budget
+            if used_tokens + c["tokens"] > max_context_tokens:
+                continue
+            selected.append(c)
+            used_tokens += c["tokens"]
+            per_title_count[c["title"]] = per_title_count.get(c["title"], 0) + 1
+            if used_tokens >= max_context_tokens:
+                break
+
+    if trim_to_fit and question:
+        remaining = max_context_tokens - sum(c["tokens"] for c in selected)
+        selected_ranks = {c["rank"] for c in selected}
+        selected_titles = Counter(c["title"] for c in selected)
+        left_out = [
+            c for c in candidates
+            if c["rank"] not in selected_ranks
+            and selected_titles[c["title"]] < max_chunks_per_title
+        ]
+        if left_out and remaining > 0:
+            best = left_out[0]
+            header = _header_tokens(len(candidates), best["title"], best["url"])
+            trimmed = trim_to_budget(question, best["text"], remaining - header, _token_len)
+            if trimmed:
+                selected.append({**best, "text": trimmed})
+                selected.sort(key=lambda c: c["rank"])
+
+    # ── Numbered blocks + citation metadata ───────────────────────────────────
+    sources: list[dict] = []
+    context_parts: list[str] = []
 
+    for citation_num, c in enumerate(selected, start=1):
+        text = c["text"]
+        block = f"[{citation_num}] Title: {c['title']}\nURL: {c['url']}\n\n{text}".strip()
         context_parts.append(block)
-        used_tokens += block_tokens
-
         sources.append({
             "n": citation_num,
-            "title": title,
-            "url": url,
-            "score": score,
-            "chunk_id": chunk_id,
+            "title": c["title"],
+            "url": c["url"],
+            "score": getattr(c["hit"], "score", None),
+            "chunk_id": c["chunk_id"],
             "preview": (text or "")[:PREVIEW_CHARS].replace("\n", " "),
         })
 
-        per_title_count[title] += 1
-        citation_num += 1
-
-        if used_tokens >= max_context_tokens:
-            break
-
     return "\n\n---\n\n".join(context_parts), sources
 
 
@@ -245,36 +440,520 @@ def _retrieve_and_build(
       context: context string passed to the LLM
       sources: citation metadata for the chunks that made it into context
       confidence: confidence dict computed from sources (what the LLM actually sees)
+
+    When the early-refusal gate (topic_gate.py) rejects the question, context
+    and sources are empty and confidence["refusal"] holds the canned answer;
+    callers return it instead of calling the LLM.
     """
-    if use_multiquery:
-        from src.retrieve_multiquery import search_multiquery
-        hits = search_multiquery(question, k=k, chunker=chunker)
-    else:
-        hits = search(question, k=k, chunker=chunker)
+    use_mmr = DIVERSITY_STRATEGY == "mmr"
+
+    refusal = topic_gate.check_topic(question)
+    if refusal is not None:
+        return _refused([], refusal)
+
+    with tracing.span("retrieve", chunker=chunker, k=k, multiquery=use_multiquery) as sp:
+        if use_multiquery:
+            from src.retrieve_multiquery import search_multiquery
+            hits = search_multiquery(question, k=k, chunker=chunker, with_vectors=use_mmr)
+        else:
+            hits = search(question, k=k, chunker=chunker, with_vectors=use_mmr)
+        if sp is not None:
+            sp.attrs["hits"] = len(hits)
 
-    diverse_hits = _select_diverse_hits(hits)
-    context, sources = _build_context(diverse_hits)
+    return _build_from_hits(question, hits, use_mmr)
+
+
+async def _aretrieve_and_build(
+    question: str,
+    k: int,
+    chunker: str,
+    use_multiquery: bool,
+) -> tuple:
+    """
+    Async _retrieve_and_build(): the embedding, Qdrant and query-generation
+    calls are awaited.  The CPU stages after retrieval are shared; they run
+    inline unless reranking or compression is enabled (model inference and
+    sentence embedding), in which case they move to a worker thread so the
+    event loop is not blocked.
+    """
+    use_mmr = DIVERSITY_STRATEGY == "mmr"
+
+    refusal = await topic_gate.acheck_topic(question)
+    if refusal is not None:
+        return _refused([], refusal)
+
+    with tracing.span("retrieve", chunker=chunker, k=k, multiquery=use_multiquery) as sp:
+        if use_multiquery:
+            from src.retrieve_multiquery import asearch_multiquery
+            hits = await asearch_multiquery(question, k=k, chunker=chunker, with_vectors=use_mmr)
+        else:
+            hits = await asearch(question, k=k, chunker=chunker, with_vectors=use_mmr)
+        if sp is not None:
+            sp.attrs["hits"] = len(hits)
+
+    if RERANK_ENABLED or COMPRESSION_ENABLED:
+        return await asyncio.to_thread(_build_from_hits, question, hits, use_mmr)
+    return _build_from_hits(question, hits, use_mmr)
+
+
+def _build_from_hits(question: str, hits: list, use_mmr: bool) -> tuple:
+    """Coverage check, rerank, selection, compression and context building for *hits*."""
+    refusal = topic_gate.check_coverage(hits)
+    if refusal is not None:
+        return _refused(hits, refusal)
+
+    if RERANK_ENABLED:
+        with tracing.span("rerank", candidates=len(hits)):
+            hits = rerank(question, hits)
+
+    # MMR needs every embedding; a hit without one would look unlike all others
+    use_mmr = use_mmr and all(getattr(h, "vector", None) is not None for h in hits)
+    with tracing.span("select", strategy="mmr" if use_mmr else "title_cap"):
+        if use_mmr:
+            diverse_hits = _select_mmr_hits(hits)
+        else:
+            diverse_hits = _select_diverse_hits(hits)
+
+    if COMPRESSION_ENABLED:
+        with tracing.span("compress", chunks=len(diverse_hits)):
+            diverse_hits = compress_hits(question, diverse_hits)
+
+    with tracing.span("build_context", packing=CONTEXT_PACKING) as sp:
+        context, sources = _build_context(diverse_hits, question=question)
+        if sp is not None:
+            sp.attrs["sources"] = len(sources)
 
     # Confidence is computed from `sources` — the exact chunks sent to the LLM,
     # not the broader diverse_hits pool, so the signal reflects what the model saw.
     confidence = _confidence_from_sources(sources)
 
+    trace = tracing.current()
+    if trace is not None:
+        trace.attrs["hit_ids"] = [h.id for h in hits]
+        trace.attrs["source_chunk_ids"] = [s["chunk_id"] for s in sources]
+        trace.attrs["confidence"] = confidence.get("value")
+
     return hits, context, sources, confidence
 
 
+def _refused(hits: list, refusal: topic_gate.Refusal) -> tuple:
+    """_retrieve_and_build() result for a question stopped by the early-refusal gate."""
+    scores = [h.score for h in hits if getattr(h, "score", None) is not None]
+    confidence = {
+        "label": "Low",
+        "value": 0.0,
+        "best": min(scores) if scores else None,
+        "worst": max(scores) if scores else None,
+        "reason": refusal.reason,
+        "refusal": refusal.text,
+    }
+    trace = tracing.current()
+    if trace is not None:
+        trace.attrs["refused"] = refusal.kind
+        trace.attrs["hit_ids"] = [h.id for h in hits]
+        trace.attrs["source_chunk_ids"] = []
+        trace.attrs["confidence"] = 0.0
+    return hits, "", [], confidence
+
+
+def _refusal_stream(text: str, trace: Trace):
+    """Canned refusal as a token stream, finishing *trace* like an LLM stream would."""
+    return _traced_stream(replay_stream(text), trace, "gate.refusal", ttft_name=None)
+
+
+def _arefusal_stream(text: str, trace: Trace):
+    """Async _refusal_stream()."""
+    return _atraced_stream(_areplay_stream(text), trace, "gate.refusal", ttft_name=None)
+
+
+# ── LLM calls ─────────────────────────────────────────────────────────────────
+
+def _invoke_llm(context: str, question: str) -> str:
+    """Blocking generation; reports token usage including cached prompt tokens."""
+    with tracing.span("llm.generate", model=LLM_MODEL) as sp:
+        try:
+            msg = (_prompt | _llm).invoke({"question": question, "context": context})
+        except Exception as e:
+            if sp is not None:
+                sp.attrs["error"] = type(e).__name__
+            raise
+        counts = usage.from_llm_metadata(msg.usage_metadata)
+        if sp is not None:
+            sp.attrs.update(counts)
+    usage.record("generate", LLM_MODEL, **counts)
+    return msg.content
+
+
+def _stream_llm(context: str, question: str, traces: list[Trace]):
+    """
+    Yield answer text chunks; records token usage once the stream completes
+    (usage arrives on the final chunk), against the first of *traces* that
+    is still open.  *traces* may grow while the stream runs.
+    """
+    meta = None
+    for chunk in (_prompt | _llm).stream({"question": question, "context": context}):
+        if chunk.usage_metadata:
+            meta = chunk.usage_metadata
+        if chunk.content:
+            yield chunk.content
+    _record_stream_usage(meta, traces)
+
+
+async def _astream_llm(context: str, question: str, traces: list[Trace]):
+    """Async _stream_llm()."""
+    meta = None
+    async for chunk in (_prompt | _llm).astream({"question": question, "context": context}):
+        if chunk.usage_metadata:
+            meta = chunk.usage_metadata
+        if chunk.content:
+            yield chunk.content
+    _record_stream_usage(meta, traces)
+
+
+def _record_stream_usage(meta: dict | None, traces: list[Trace]) -> None:
+    # A subscriber that stopped reading early may already have finished its
+    # trace; the counts still go to the process totals if nobody is left.
+    trace = next((t for t in traces if not t.finished), None)
+    counts = usage.from_llm_metadata(meta)
+    usage.record("generate", LLM_MODEL, trace=trace, **counts)
+
+
+class _StreamTiming:
+    """Time-to-first-token and total stream time for one answer stream."""
+
+    def __init__(self, trace: Trace, name: str, ttft_name: str | None) -> None:
+        self.trace, self.name, self.ttft_name = trace, name, ttft_name
+        self.start = trace.now_ms()
+        self.first: float | None = None
+        self.n_chunks = 0
+
+    def token(self) -> None:
+        if self.first is None:
+            self.first = self.trace.now_ms()
+            if self.ttft_name:
+                self.trace.record(self.ttft_name, self.start, self.first)
+        self.n_chunks += 1
+
+    def close(self) -> None:
+        self.trace.record(self.name, self.start, self.trace.now_ms(), chunks=self.n_chunks)
+        _finish(self.trace)
+
+
+def _traced_stream(token_stream, trace: Trace, name: str = "llm.stream", ttft_name: str | None = "llm.ttft"):
+    """
+    Pass tokens through, recording time-to-first-token and total stream time
+    on *trace*, then finish the trace once the stream is exhausted.
+    """
+    timing = _StreamTiming(trace, name, ttft_name)
+    try:
+        for token in token_stream:
+            timing.token()
+            yield token
+    finally:
+        timing.close()
+
+
+async def _atraced_stream(token_stream, trace: Trace, name: str = "llm.stream", ttft_name: str | None = "llm.ttft"):
+    """Async _traced_stream() over an async token stream."""
+    timing = _StreamTiming(trace, name, ttft_name)
+    try:
+        async for token in token_stream:
+            timing.token()
+            yield token
+    finally:
+        timing.close()
+
+
+async def _areplay_stream(answer: str):
+    """replay_stream() as an async iterator."""
+    for token in replay_stream(answer):
+        yield token
+
+
+# ── Answer cache helpers ──────────────────────────────────────────────────────
+
+@dataclass
+class _PendingAnswer:
+    """State handed from retrieve_context() to answer_stream() for one question."""
+    trace: Trace
+    namespace: str | None = None
+    vector: list[float] | None = None
+    hits: list | None = None
+    sources: list[dict] | None = None
+    confidence: dict | None = None
+    cached: CachedAnswer | None = None
+    refusal: str | None = None
+
+
+# retrieve_context() and answer_stream() are called separately by app.py, so
+# the trace and cache state for the in-flight question are parked here, keyed
+# by (question, context), until the answer stream is requested.  Streamlit
+# sessions and server requests park and collect concurrently, hence the lock.
+_pending_answers: OrderedDict[tuple[str, str], _PendingAnswer] = OrderedDict()
+_pending_lock = threading.Lock()
+_MAX_PENDING = 256
+
+
+def disable_answer_cache() -> None:
+    """
+    Turn the semantic answer cache off for this process, so every question is
+    answered by the pipeline (evals, benchmarks, replays).
+    """
+    global _answer_cache
+    _answer_cache = None
+
+
+def _cache_namespace(k: int, chunker: str, use_multiquery: bool, version: str | None = None) -> str:
+    # Cached entries carry confidence, so a refit calibration starts a new namespace
+    return (
+        f"{chunker}|k={k}|mq={int(use_multiquery)}"
+        f"|prompt={PROMPT_VERSION}|calib={_calibration.version or 'defaults'}"
+        f"|{version or collection_version(chunker)}"
+    )
+
+
+def _cache_lookup(question: str, k: int, chunker: str, use_multiquery: bool):
+    """Return (cached entry or None, namespace, query vector)."""
+    namespace = _cache_namespace(k, chunker, use_multiquery)
+    qv = embed_query(question)
+    return _cache_match(qv, namespace), namespace, qv
+
+
+async def _acache_lookup(question: str, k: int, chunker: str, use_multiquery: bool):
+    """Async _cache_lookup()."""
+    namespace = _cache_namespace(k, chunker, use_multiquery, await acollection_version(chunker))
+    qv = await aembed_query(question)
+    return _cache_match(qv, namespace), namespace, qv
+
+
+def _cache_match(qv: list[float], namespace: str) -> CachedAnswer | None:
+    with tracing.span("answer_cache.lookup") as sp:
+        cached = _answer_cache.lookup(qv, namespace)
+        if sp is not None:
+            sp.attrs["hit"] = cached is not None
+    trace = tracing.current()
+    if trace is not None:
+        trace.attrs["answer_cache_hit"] = cached is not None
+    return cached
+
+
+def _cache_store(question: str, answer: str, pending: _PendingAnswer, context: str) -> None:
+    _answer_cache.store(pending.vector, pending.namespace, CachedAnswer(
+        question=question,
+        answer=answer,
+        sources=pending.sources,
+        confidence=pending.confidence,
+        context=context,
+        hits=pending.hits,
+    ))
+
+
+def _stream_and_store(token_stream, question: str, context: str, pending: _PendingAnswer):
+    """Pass tokens through unchanged and cache the full answer once the stream completes."""
+    parts: list[str] = []
+    for token in token_stream:
+        parts.append(token)
+        yield token
+    _cache_store(question, "".join(parts), pending, context)
+
+
+async def _astream_and_store(token_stream, question: str, context: str, pending: _PendingAnswer):
+    """Async _stream_and_store()."""
+    parts: list[str] = []
+    async for token in token_stream:
+        parts.append(token)
+        yield token
+    _cache_store(question, "".join(parts), pending, context)
+
+
+def _park_pending(question: str, context: str, pending: _PendingAnswer) -> None:
+    with _pending_lock:
+        _pending_answers[(question, context)] = pending
+        while len(_pending_answers) > _MAX_PENDING:
+            _pending_answers.popitem(last=False)
+
+
+def _take_pending(question: str, context: str) -> _PendingAnswer | None:
+    with _pending_lock:
+        return _pending_answers.pop((question, context), None)
+
+
+# ── Request coalescing (see singleflight.py) ──────────────────────────────────
+#
+# Identical requests in flight at the same time share one retrieval (keyed by
+# normalised question, k, chunker and multiquery) and one LLM answer (keyed by
+# normalised question and context).  Only the first caller's pending state is
+# used to fill the answer cache.
+
+_retrievals = singleflight.SingleFlight()
+_aretrievals = singleflight.AsyncSingleFlight()
+_generations = singleflight.SingleFlight()
+_answer_streams = singleflight.StreamGroup()
+_aanswer_streams = singleflight.AsyncStreamGroup()
+
+
+# Trace attributes set during retrieval.  A follower's trace does not run the
+# stages that set them, so they are copied over from the leader's call; the
+# request log needs them on every line (see src/replay.py).
+_RETRIEVAL_ATTRS = ("hit_ids", "source_chunk_ids", "confidence", "refused")
+
+
+def _with_retrieval_attrs(result: tuple) -> tuple[tuple, dict]:
+    """Pair a retrieval result with the attributes it set on the current trace."""
+    trace = tracing.current()
+    attrs = {} if trace is None else {k: trace.attrs[k] for k in _RETRIEVAL_ATTRS if k in trace.attrs}
+    return result, attrs
+
+
+def _adopt_retrieval_attrs(attrs: dict) -> None:
+    trace = tracing.current()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+
+def _retrieve(question: str, k: int, chunker: str, use_multiquery: bool) -> tuple:
+    """_retrieve_and_build(), shared with an identical request already in flight."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return _retrieve_and_build(question, k, chunker, use_multiquery)
+    key = (singleflight.normalise_question(question), k, chunker, use_multiquery)
+    (result, attrs), shared = _retrievals.do(
+        key, lambda: _with_retrieval_attrs(_retrieve_and_build(question, k, chunker, use_multiquery))
+    )
+    if shared:
+        _adopt_retrieval_attrs(attrs)
+    return result
+
+
+async def _aretrieve(question: str, k: int, chunker: str, use_multiquery: bool) -> tuple:
+    """Async _retrieve()."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return await _aretrieve_and_build(question, k, chunker, use_multiquery)
+    key = (singleflight.normalise_question(question), k, chunker, use_multiquery)
+
+    async def lead() -> tuple[tuple, dict]:
+        return _with_retrieval_attrs(await _aretrieve_and_build(question, k, chunker, use_multiquery))
+
+    (result, attrs), shared = await _aretrievals.do(key, lead)
+    if shared:
+        _adopt_retrieval_attrs(attrs)
+    return result
+
+
+def _generate(context: str, question: str) -> tuple[str, bool]:
+    """_invoke_llm(), shared with an identical request in flight.  Returns (answer, shared)."""
+    if not SINGLE_FLIGHT_ENABLED:
+        return _invoke_llm(context, question), False
+    key = (singleflight.normalise_question(question), context)
+    return _generations.do(key, lambda: _invoke_llm(context, question))
+
+
+def _answer_tokens(context: str, question: str, trace: Trace, pending: _PendingAnswer | None):
+    """
+    Traced LLM token stream for *context*, stored in the answer cache on
+    completion when *pending* carries a cache namespace.  Identical requests
+    in flight subscribe to one shared stream.
+    """
+    def source(traces):
+        token_stream = _stream_llm(context, question, traces)
+        if pending is not None and pending.namespace is not None:
+            token_stream = _stream_and_store(token_stream, question, context, pending)
+        return token_stream
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return _traced_stream(source([trace]), trace)
+    key = (singleflight.normalise_question(question), context)
+    token_stream, shared = _answer_streams.subscribe(key, source, trace)
+    return _traced_stream(token_stream, trace, "singleflight.stream" if shared else "llm.stream")
+
+
+def _aanswer_tokens(context: str, question: str, trace: Trace, pending: _PendingAnswer | None):
+    """Async _answer_tokens()."""
+    def source(traces):
+        token_stream = _astream_llm(context, question, traces)
+        if pending is not None and pending.namespace is not None:
+            token_stream = _astream_and_store(token_stream, question, context, pending)
+        return token_stream
+
+    if not SINGLE_FLIGHT_ENABLED:
+        return _atraced_stream(source([trace]), trace)
+    key = (singleflight.normalise_question(question), context)
+    token_stream, shared = _aanswer_streams.subscribe(key, source, trace)
+    return _atraced_stream(token_stream, trace, "singleflight.stream" if shared else "llm.stream")
+
+
+def _ensure_trace(trace: Trace | None, name: str, question: str, **attrs) -> Trace:
+    """Return *trace* (or a new one) carrying the request's settings as attributes."""
+    if trace is None:
+        trace = Trace(name)
+    trace.attrs.setdefault("question", question)
+    for key, value in attrs.items():
+        trace.attrs.setdefault(key, value)
+    return trace
+
+
+def _finish(trace: Trace) -> None:
+    """Finish *trace* once and append it, with its token spend, to the request log."""
+    usage.settle(trace.usage)   # count embedding tokens before the trace is exported
+    if not trace.finish():
+        return
+    spend = usage.summarise(trace.usage)
+    request_log.append({
+        "ts": datetime.fromtimestamp(trace.wall_start_ns / 1e9, timezone.utc).isoformat(),
+        "trace_id": trace.id,
+        **trace.attrs,
+        "total_ms": round(trace.total_ms(), 3),
+        "stage_ms": trace.stage_ms(),
+        "usage": spend,
+    })
+
+
+# ── Public API ────────────────────────────────────────────────────────────────
+#
+# Every entry point accepts an optional `trace` (src.tracing.Trace).  Pass one
+# in to read per-stage timings afterwards (trace.waterfall(), trace.to_dict());
+# otherwise a trace is created internally and only exported (see config).
+
 def generate_answer(
     question: str,
     k: int = DEFAULT_K,
     chunker: str = "token",
     use_multiquery: bool = False,
+    trace: Trace | None = None,
 ):
-    """Retrieve context and return a complete LLM answer (blocking)."""
-    hits, context, sources, confidence = _retrieve_and_build(
-        question, k, chunker, use_multiquery
+    """
+    Retrieve context and return a complete LLM answer (blocking).  The trace
+    is finished even when retrieval or the LLM call raises, with the
+    exception type as its ``error`` attribute.
+    """
+    trace = _ensure_trace(
+        trace, "generate_answer", question, chunker=chunker, k=k, multiquery=use_multiquery
     )
-
-    chain = _prompt | _llm | _parser
-    answer = chain.invoke({"question": question, "context": context})
+    try:
+        with trace.activate():
+            if _answer_cache is not None:
+                cached, namespace, qv = _cache_lookup(question, k, chunker, use_multiquery)
+                if cached is not None:
+                    sources = [] if _is_refused(cached.answer) else cached.sources
+                    return cached.answer, sources, cached.hits, cached.confidence, cached.context
+
+            hits, context, sources, confidence = _retrieve(
+                question, k, chunker, use_multiquery
+            )
+
+            refusal = confidence.get("refusal")
+            answer, shared = (refusal, False) if refusal else _generate(context, question)
+
+        if _answer_cache is not None and refusal is None and not shared:
+            _cache_store(
+                question, answer,
+                _PendingAnswer(trace, namespace, qv, hits, sources, confidence),
+                context,
+            )
+    except BaseException as e:
+        trace.attrs.setdefault("error", type(e).__name__)
+        raise
+    finally:
+        _finish(trace)
 
     if _is_refused(answer):
         return answer, [], hits, confidence, context
@@ -287,12 +966,16 @@ def stream_answer(
     k: int = DEFAULT_K,
     chunker: str = "token",
     use_multiquery: bool = False,
+    trace: Trace | None = None,
 ):
     """
     Retrieve context and return a streaming token iterator for the LLM response.
 
     Retrieval and context-building happen upfront (blocking); only the LLM
-    generation streams token-by-token.
+    generation streams token-by-token.  On an answer-cache hit the stored
+    answer is replayed as a stream instead.  If retrieval raises, the trace is
+    finished with the exception type as its ``error`` attribute; otherwise the
+    returned stream finishes it.
 
     Returns:
       token_stream: generator yielding str chunks (pass to st.write_stream)
@@ -301,14 +984,34 @@ def stream_answer(
       confidence: confidence dict computed from sources
       context: context string sent to the LLM
     """
-    hits, context, sources, confidence = _retrieve_and_build(
-        question, k, chunker, use_multiquery
+    trace = _ensure_trace(
+        trace, "stream_answer", question, chunker=chunker, k=k, multiquery=use_multiquery
     )
-
-    chain = _prompt | _llm | _parser
-    token_stream = chain.stream({"question": question, "context": context})
-
-    return token_stream, sources, hits, confidence, context
+    try:
+        with trace.activate():
+            if _answer_cache is not None:
+                cached, namespace, qv = _cache_lookup(question, k, chunker, use_multiquery)
+                if cached is not None:
+                    token_stream = _traced_stream(
+                        replay_stream(cached.answer), trace, "answer_cache.replay", ttft_name=None
+                    )
+                    return (token_stream, cached.sources, cached.hits,
+                            cached.confidence, cached.context)
+
+            hits, context, sources, confidence = _retrieve(
+                question, k, chunker, use_multiquery
+            )
+
+        if confidence.get("refusal"):
+            return _refusal_stream(confidence["refusal"], trace), sources, hits, confidence, context
+
+        pending = None
+        if _answer_cache is not None:
+            pending = _PendingAnswer(trace, namespace, qv, hits, sources, confidence)
+        return _answer_tokens(context, question, trace, pending), sources, hits, confidence, context
+    except BaseException as e:
+        finish_trace(trace, error=type(e).__name__)
+        raise
 
 
 def retrieve_context(
@@ -316,21 +1019,76 @@ def retrieve_context(
     k: int = DEFAULT_K,
     chunker: str = "token",
     use_multiquery: bool = False,
+    trace: Trace | None = None,
 ) -> tuple:
     """
     Run retrieval and context-building only — no LLM call.
 
     Use this together with answer_stream() when you want to show step-by-step
     status updates in the UI between the retrieval and generation phases.
+    On an answer-cache hit the cached retrieval is returned and the following
+    answer_stream() call replays the cached answer.  The trace is continued
+    (and finished) by the matching answer_stream() call, or finished here
+    with an ``error`` attribute if retrieval raises.
 
     Returns: (hits, context, sources, confidence)
     """
-    return _retrieve_and_build(question, k, chunker, use_multiquery)
+    trace = _ensure_trace(
+        trace, "answer", question, chunker=chunker, k=k, multiquery=use_multiquery
+    )
+    try:
+        with trace.activate():
+            if _answer_cache is None:
+                hits, context, sources, confidence = _retrieve(
+                    question, k, chunker, use_multiquery
+                )
+                _park_pending(question, context, _PendingAnswer(trace, refusal=confidence.get("refusal")))
+                return hits, context, sources, confidence
+
+            cached, namespace, qv = _cache_lookup(question, k, chunker, use_multiquery)
+            if cached is not None:
+                hits, context, sources, confidence = (
+                    cached.hits, cached.context, cached.sources, cached.confidence
+                )
+            else:
+                hits, context, sources, confidence = _retrieve(
+                    question, k, chunker, use_multiquery
+                )
+
+        _park_pending(question, context, _PendingAnswer(
+            trace, namespace, qv, hits, sources, confidence, cached=cached,
+            refusal=confidence.get("refusal"),
+        ))
+        return hits, context, sources, confidence
+    except BaseException as e:
+        finish_trace(trace, error=type(e).__name__)
+        raise
+
+
+def prepare_generation(
+    question: str,
+    k: int = DEFAULT_K,
+    chunker: str = "token",
+    use_multiquery: bool = False,
+):
+    """
+    Retrieval and context-building plus the exact chat messages the LLM would
+    receive, without calling it — for offline batch jobs (see src.batch).
+    messages is None when the early-refusal gate has already answered
+    (confidence["refusal"]).
+
+    Returns: (hits, context, sources, confidence, messages)
+    """
+    hits, context, sources, confidence = _retrieve_and_build(question, k, chunker, use_multiquery)
+    if confidence.get("refusal"):
+        return hits, context, sources, confidence, None
+    messages = _prompt.format_messages(context=context, question=question)
+    return hits, context, sources, confidence, messages
 
 
-def answer_stream(context: str, question: str):
+def answer_stream(context: str, question: str, trace: Trace | None = None):
     """
-    Return a LangChain token stream for a pre-built context string.
+    Return a token stream for a pre-built context string.
 
     Pair with retrieve_context() to stream the LLM answer after showing
     retrieval progress in the UI:
@@ -339,5 +1097,146 @@ def answer_stream(context: str, question: str):
         token_stream = answer_stream(context, question)
         answer = st.write_stream(token_stream)
     """
-    chain = _prompt | _llm | _parser
-    return chain.stream({"question": question, "context": context})
+    pending = _take_pending(question, context)
+    trace = _ensure_trace(trace or (pending.trace if pending else None), "answer_stream", question)
+
+    if pending is not None and pending.cached is not None:
+        return _traced_stream(
+            replay_stream(pending.cached.answer), trace, "answer_cache.replay", ttft_name=None
+        )
+    if pending is not None and pending.refusal:
+        return _refusal_stream(pending.refusal, trace)
+
+    return _answer_tokens(context, question, trace, pending)
+
+
+def discard_pending(question: str, context: str) -> None:
+    """
+    Drop what retrieve_context() parked for a question whose answer will not
+    be streamed (e.g. a retrieval-only request), and finish its trace.
+    """
+    pending = _take_pending(question, context)
+    if pending is not None:
+        _finish(pending.trace)
+
+
+def finish_trace(trace: Trace, error: str | None = None) -> None:
+    """
+    Finish and log *trace* for a request that ended before its answer stream
+    did, e.g. on a timeout during retrieval.  *error* is kept as a trace
+    attribute.  Does nothing if the trace is already finished.
+    """
+    if error is not None and not trace.finished:
+        trace.attrs.setdefault("error", error)
+    _finish(trace)
+
+
+# ── Async API ─────────────────────────────────────────────────────────────────
+#
+# Twins of retrieve_context() / stream_answer() / answer_stream() for servers
+# that keep many questions in flight on one event loop: embedding, Qdrant and
+# LLM calls are awaited on async clients instead of blocking a thread each.
+# Arguments, return values, tracing, the answer cache and the early-refusal
+# gate behave exactly as in the sync versions; token streams are async
+# iterators.
+
+async def aretrieve_context(
+    question: str,
+    k: int = DEFAULT_K,
+    chunker: str = "token",
+    use_multiquery: bool = False,
+    trace: Trace | None = None,
+) -> tuple:
+    """
+    Async retrieve_context().  Pair with aanswer_stream().
+
+    Returns: (hits, context, sources, confidence)
+    """
+    trace = _ensure_trace(
+        trace, "answer", question, chunker=chunker, k=k, multiquery=use_multiquery
+    )
+    try:
+        with trace.activate():
+            if _answer_cache is None:
+                hits, context, sources, confidence = await _aretrieve(
+                    question, k, chunker, use_multiquery
+                )
+                _park_pending(question, context, _PendingAnswer(trace, refusal=confidence.get("refusal")))
+                return hits, context, sources, confidence
+
+            cached, namespace, qv = await _acache_lookup(question, k, chunker, use_multiquery)
+            if cached is not None:
+                hits, context, sources, confidence = (
+                    cached.hits, cached.context, cached.sources, cached.confidence
+                )
+            else:
+                hits, context, sources, confidence = await _aretrieve(
+                    question, k, chunker, use_multiquery
+                )
+
+        _park_pending(question, context, _PendingAnswer(
+            trace, namespace, qv, hits, sources, confidence, cached=cached,
+            refusal=confidence.get("refusal"),
+        ))
+        return hits, context, sources, confidence
+    except BaseException as e:
+        finish_trace(trace, error=type(e).__name__)
+        raise
+
+
+async def astream_answer(
+    question: str,
+    k: int = DEFAULT_K,
+    chunker: str = "token",
+    use_multiquery: bool = False,
+    trace: Trace | None = None,
+):
+    """
+    Async stream_answer(): awaits retrieval, then returns an async token
+    iterator for the LLM response.
+
+    Returns: (token_stream, sources, hits, confidence, context)
+    """
+    trace = _ensure_trace(
+        trace, "stream_answer", question, chunker=chunker, k=k, multiquery=use_multiquery
+    )
+    try:
+        with trace.activate():
+            if _answer_cache is not None:
+                cached, namespace, qv = await _acache_lookup(question, k, chunker, use_multiquery)
+                if cached is not None:
+                    token_stream = _atraced_stream(
+                        _areplay_stream(cached.answer), trace, "answer_cache.replay", ttft_name=None
+                    )
+                    return (token_stream, cached.sources, cached.hits,
+                            cached.confidence, cached.context)
+
+            hits, context, sources, confidence = await _aretrieve(
+                question, k, chunker, use_multiquery
+            )
+
+        if confidence.get("refusal"):
+            return _arefusal_stream(confidence["refusal"], trace), sources, hits, confidence, context
+
+        pending = None
+        if _answer_cache is not None:
+            pending = _PendingAnswer(trace, namespace, qv, hits, sources, confidence)
+        return _aanswer_tokens(context, question, trace, pending), sources, hits, confidence, context
+    except BaseException as e:
+        finish_trace(trace, error=type(e).__name__)
+        raise
+
+
+def aanswer_stream(context: str, question: str, trace: Trace | None = None):
+    """Async answer_stream(): an async token iterator for a context from aretrieve_context()."""
+    pending = _take_pending(question, context)
+    trace = _ensure_trace(trace or (pending.trace if pending else None), "answer_stream", question)
+
+    if pending is not None and pending.cached is not None:
+        return _atraced_stream(
+            _areplay_stream(pending.cached.answer), trace, "answer_cache.replay", ttft_name=None
+        )
+    if pending is not None and pending.refusal:
+        return _arefusal_stream(pending.refusal, trace)
+
+    return _aanswer_tokens(context, question, trace, pending)
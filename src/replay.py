@@ -0,0 +1,186 @@
+"""
+Offline replay benchmark over a captured request log.
+
+Re-runs the questions recorded in the request log (see request_log.py) through
+the pipeline with their original chunker / k / multi-query settings, at a
+configurable concurrency and arrival rate, and reports p50 / p95 / p99
+latency per stage plus overall throughput.  This is a load test shaped like
+real traffic: real question mix, real settings, real repeat rate.
+
+Modes
+-----
+  retrieve   retrieve_context() only — no generation cost
+  stream     stream_answer(), consuming the full token stream (as the app does)
+  generate   generate_answer(), blocking
+
+Requests are issued open-loop: request i is released at i / rate seconds
+(--rate 0 releases them all at once) and waits for a free worker, so queueing
+shows up in the "queue" row when the offered rate exceeds what the pipeline
+can sustain.  The answer cache is disabled unless --answer-cache is given,
+since a replayed log would otherwise be served almost entirely from it, and
+replayed requests are not appended to the request log.
+
+Usage
+-----
+    uv run python -m src.replay                                   # logs/requests.jsonl, stream mode
+    uv run python -m src.replay --mode retrieve --concurrency 8 --rate 4
+    uv run python -m src.replay --log logs/requests.jsonl --limit 200 --out eval/replay.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from dotenv import load_dotenv
+load_dotenv()
+
+from src import rag, request_log
+from src.config import REQUEST_LOG_PATH
+from src.tracing import Trace
+
+MODES = ("retrieve", "stream", "generate")
+PERCENTILES = (50, 95, 99)
+
+
+def _run_one(record: dict, mode: str) -> Trace:
+    question = record["question"]
+    kwargs = {
+        "k": record.get("k", rag.DEFAULT_K),
+        "chunker": record.get("chunker", "token"),
+        "use_multiquery": bool(record.get("multiquery", False)),
+    }
+    trace = Trace("replay", mode=mode)
+    if mode == "retrieve":
+        rag.retrieve_context(question, trace=trace, **kwargs)
+    elif mode == "stream":
+        token_stream, *_ = rag.stream_answer(question, trace=trace, **kwargs)
+        for _ in token_stream:
+            pass
+    else:
+        rag.generate_answer(question, trace=trace, **kwargs)
+    return trace
+
+
+def replay(
+    records: list[dict],
+    *,
+    mode: str = "stream",
+    concurrency: int = 4,
+    rate: float = 0.0,
+) -> dict:
+    """
+    Replay *records* and return latency percentiles per stage and throughput.
+
+    Stage latencies come from each request's trace; "total" is the wall time
+    of the request itself and "queue" the time it waited for a worker after
+    its scheduled release.
+    """
+    samples: dict[str, list[float]] = {}
+    errors: list[str] = []
+    lock = threading.Lock()
+
+    def task(i: int, record: dict, release: float) -> None:
+        started = time.perf_counter()
+        try:
+            trace = _run_one(record, mode)
+        except Exception as e:
+            with lock:
+                errors.append(f"{type(e).__name__}: {e}")
+            return
+        total_ms = (time.perf_counter() - started) * 1000
+        with lock:
+            samples.setdefault("queue", []).append(max(started - release, 0.0) * 1000)
+            samples.setdefault("total", []).append(total_ms)
+            for stage, ms in trace.stage_ms().items():
+                samples.setdefault(stage, []).append(ms)
+        print(f"  [{i + 1}/{len(records)}] {total_ms:8.1f} ms  {record['question'][:70]}")
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="replay") as pool:
+        for i, record in enumerate(records):
+            release = t0 + (i / rate if rate > 0 else 0.0)
+            delay = release - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(task, i, record, release)
+    wall_s = time.perf_counter() - t0
+
+    completed = len(records) - len(errors)
+    return {
+        "mode": mode,
+        "concurrency": concurrency,
+        "rate": rate,
+        "requests": len(records),
+        "completed": completed,
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "wall_s": round(wall_s, 3),
+        "throughput_rps": round(completed / wall_s, 3) if wall_s else 0.0,
+        "stages": {
+            stage: {
+                "n": len(values),
+                **{
+                    f"p{p}": round(float(v), 3)
+                    for p, v in zip(PERCENTILES, np.percentile(values, PERCENTILES))
+                },
+            }
+            for stage, values in sorted(samples.items())
+        },
+    }
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"\nReplayed {report['completed']}/{report['requests']} requests "
+        f"({report['errors']} errors) in {report['wall_s']:.1f}s — "
+        f"{report['throughput_rps']:.2f} req/s  "
+        f"[mode={report['mode']}, concurrency={report['concurrency']}, rate={report['rate'] or 'max'}]\n"
+    )
+    header = f"{'Stage':<24} {'n':>5} " + " ".join(f"{f'p{p} ms':>10}" for p in PERCENTILES)
+    print(header)
+    print("─" * len(header))
+    for stage, s in report["stages"].items():
+        print(f"{stage:<24} {s['n']:>5} " + " ".join(f"{s[f'p{p}']:>10.1f}" for p in PERCENTILES))
+    for err in report["error_samples"]:
+        print(f"  error: {err}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a captured request log as a load test.")
+    parser.add_argument("--log", type=Path, default=Path(REQUEST_LOG_PATH or "logs/requests.jsonl"),
+                        help="Request log to replay (default: REQUEST_LOG_PATH).")
+    parser.add_argument("--mode", choices=MODES, default="stream")
+    parser.add_argument("--concurrency", type=int, default=4, help="Parallel requests (default: 4).")
+    parser.add_argument("--rate", type=float, default=0.0,
+                        help="Arrival rate in requests/s; 0 = release all at once (default).")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N records.")
+    parser.add_argument("--answer-cache", action="store_true",
+                        help="Keep the semantic answer cache enabled during the replay.")
+    parser.add_argument("--out", type=Path, default=None, help="Also write the report as JSON here.")
+    args = parser.parse_args()
+
+    records = [r for r in request_log.read(args.log) if r.get("question")]
+    if args.limit:
+        records = records[: args.limit]
+
+    request_log.configure(None)
+    if not args.answer_cache:
+        rag.disable_answer_cache()
+
+    print(f"Replaying {len(records)} requests from {args.log} …")
+    report = replay(records, mode=args.mode, concurrency=args.concurrency, rate=args.rate)
+    print_report(report)
+
+    if args.out:
+        report["timestamp"] = datetime.now(timezone.utc).isoformat()
+        report["log"] = str(args.log)
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        args.out.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        print(f"\nReport saved to: {args.out}")
@@ -0,0 +1,51 @@
+"""
+Structured request log.
+
+rag.py appends one JSON line per answered question to REQUEST_LOG_PATH
+(see config.py) once the answer has been fully generated or streamed:
+
+    ts, trace_id          when the request started, its trace id
+    question, chunker, k, multiquery
+    answer_cache_hit      whether the answer came from the semantic cache
+    hit_ids               retrieved point ids, in rank order
+    source_chunk_ids      chunks that made it into the LLM context
+    confidence            confidence value shown to the user
+    total_ms, stage_ms    end-to-end and per-stage latency (see tracing.py)
+    usage                 token counts and cost per component (see usage.py)
+
+src/replay.py re-runs a captured log against the pipeline as a load test.
+"""
+
+from __future__ import annotations
+
+import json
+import threading
+from pathlib import Path
+
+from src.config import REQUEST_LOG_PATH
+
+_lock = threading.Lock()
+_path: Path | None = Path(REQUEST_LOG_PATH) if REQUEST_LOG_PATH else None
+
+
+def configure(path: str | Path | None) -> None:
+    """Redirect the log to *path*, or disable it with None."""
+    global _path
+    _path = Path(path) if path else None
+
+
+def append(record: dict) -> None:
+    """Append *record* as one JSON line; a no-op when logging is disabled."""
+    if _path is None:
+        return
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+    with _lock:
+        _path.parent.mkdir(parents=True, exist_ok=True)
+        with _path.open("a", encoding="utf-8") as f:
+            f.write(line)
+
+
+def read(path: str | Path | None = None) -> list[dict]:
+    """Load every record from a request log (default: the configured one)."""
+    with Path(path or _path).open("r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
@@ -0,0 +1,179 @@
+"""
+Optional reranking stage between retrieval and context building.
+
+Cosine distance between a query embedding and a chunk embedding is a coarse
+relevance signal.  A reranker reads the query and each candidate chunk
+together and rescores the top-k candidates, so the handful of chunks that
+make it into the LLM context are chosen on a better signal.
+
+Two scorers are available:
+
+CrossEncoderReranker  A small (ideally quantised) ONNX cross-encoder such as
+                      ms-marco-MiniLM-L-6-v2, run on CPU via onnxruntime.
+                      Needs ``onnxruntime`` and ``tokenizers`` installed and
+                      RERANK_MODEL_PATH pointing at a directory containing
+                      model.onnx and tokenizer.json.
+LexicalReranker       Query-term coverage plus a phrase bonus.  No model and
+                      no extra dependencies; used when no model is configured
+                      or it fails to load.
+
+Candidates are scored best-first in batches.  Once RERANK_BUDGET_MS is spent,
+remaining candidates are left unscored and keep their retrieval order behind
+the reranked ones.  Scores are kept in an LRU cache keyed by query and
+chunk (collection and id, see src.fusion.hit_key).
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import replace
+from pathlib import Path
+
+import numpy as np
+
+from src.bm25 import tokenize
+from src.config import (
+    RERANK_MODEL_PATH,
+    RERANK_BATCH_SIZE,
+    RERANK_BUDGET_MS,
+    RERANK_CACHE_SIZE,
+)
+from src.fusion import hit_key
+
+
+# ── Scorers ───────────────────────────────────────────────────────────────────
+
+class LexicalReranker:
+    """Fraction of query terms present in the chunk, plus a bonus per matched query bigram."""
+
+    name = "lexical"
+
+    def score(self, query: str, passages: list[str]) -> list[float]:
+        q_terms = tokenize(query)
+        if not q_terms:
+            return [0.0] * len(passages)
+        q_set = set(q_terms)
+        q_bigrams = set(zip(q_terms, q_terms[1:]))
+
+        scores = []
+        for text in passages:
+            d_terms = tokenize(text)
+            coverage = len(q_set.intersection(d_terms)) / len(q_set)
+            phrase = (
+                len(q_bigrams.intersection(zip(d_terms, d_terms[1:]))) / len(q_bigrams)
+                if q_bigrams else 0.0
+            )
+            scores.append(coverage + 0.5 * phrase)
+        return scores
+
+
+class CrossEncoderReranker:
+    """ONNX cross-encoder; higher score = more relevant."""
+
+    name = "cross_encoder"
+
+    def __init__(self, model_dir: str | Path, max_length: int = 512) -> None:
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_dir = Path(model_dir)
+        opts = ort.SessionOptions()
+        opts.intra_op_num_threads = 2
+        self._session = ort.InferenceSession(
+            str(model_dir / "model.onnx"), opts, providers=["CPUExecutionProvider"]
+        )
+        self._inputs = {i.name for i in self._session.get_inputs()}
+        self._tokenizer = Tokenizer.from_file(str(model_dir / "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=max_length)
+        self._tokenizer.enable_padding()
+
+    def score(self, query: str, passages: list[str]) -> list[float]:
+        encodings = self._tokenizer.encode_batch([(query, p) for p in passages])
+        feeds = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        logits = self._session.run(None, {k: v for k, v in feeds.items() if k in self._inputs})[0]
+        return [float(x) for x in np.asarray(logits).reshape(len(passages), -1)[:, -1]]
+
+
+def _load_scorer():
+    if RERANK_MODEL_PATH:
+        try:
+            return CrossEncoderReranker(RERANK_MODEL_PATH)
+        except Exception as e:
+            print(f"Cross-encoder unavailable ({type(e).__name__}: {e}); using lexical reranker.")
+    return LexicalReranker()
+
+
+_scorer = None
+_scorer_lock = threading.Lock()
+
+_score_cache: OrderedDict[tuple[str, tuple], float] = OrderedDict()   # LRU: hits move to the end
+_cache_lock = threading.Lock()
+
+
+def clear_cache() -> None:
+    """Forget every cached (query, chunk) score."""
+    with _cache_lock:
+        _score_cache.clear()
+
+
+def _get_scorer():
+    global _scorer
+    with _scorer_lock:
+        if _scorer is None:
+            _scorer = _load_scorer()
+        return _scorer
+
+
+# ── Rerank ────────────────────────────────────────────────────────────────────
+
+def rerank(
+    query: str,
+    hits: list,
+    *,
+    batch_size: int = RERANK_BATCH_SIZE,
+    budget_ms: float = RERANK_BUDGET_MS,
+) -> list:
+    """
+    Return *hits* reordered by reranker score (best first).
+
+    Reranked hits are copies with ``rerank_score`` set; hits left unscored
+    because the latency budget ran out follow in their original order.
+    """
+    scorer = _get_scorer()
+    deadline = time.perf_counter() + budget_ms / 1000.0
+
+    scores: dict[int, float] = {}
+    todo: list[int] = []
+    with _cache_lock:
+        for i, h in enumerate(hits):
+            key = (query, hit_key(h))
+            cached = _score_cache.get(key)
+            if cached is not None:
+                _score_cache.move_to_end(key)
+                scores[i] = cached
+            else:
+                todo.append(i)
+
+    for start in range(0, len(todo), batch_size):
+        if time.perf_counter() >= deadline:
+            break
+        batch = todo[start:start + batch_size]
+        passages = [hits[i].fields.get("text") or "" for i in batch]
+        batch_scores = scorer.score(query, passages)
+        with _cache_lock:
+            for i, s in zip(batch, batch_scores):
+                scores[i] = s
+                _score_cache[(query, hit_key(hits[i]))] = s
+            while len(_score_cache) > RERANK_CACHE_SIZE:
+                _score_cache.popitem(last=False)
+
+    reranked = sorted(scores, key=lambda i: (-scores[i], i))
+    out = [replace(hits[i], rerank_score=scores[i]) for i in reranked]
+    out.extend(h for i, h in enumerate(hits) if i not in scores)
+    return out
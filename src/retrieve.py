@@ -1,17 +1,31 @@
 from __future__ import annotations
 
+import asyncio
 import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain_openai import OpenAIEmbeddings
-from src.config import EMBEDDING_MODEL
+from src import bm25, cassette, singleflight, tracing, usage
+from src.config import (
+    EMBEDDING_MODEL,
+    FUSION_METHOD,
+    RRF_K,
+    MULTICOLLECTION_CHUNKERS,
+    HYBRID_SEARCH,
+    HYBRID_LEXICAL_K,
+    SINGLE_FLIGHT_ENABLED,
+)
+from src.fusion import fuse
 from src.vector_store import QdrantVectorStore, COLLECTION_NAMES
 
 # Module-level singletons — prevent Streamlit from recreating them on every rerun
-_emb = OpenAIEmbeddings(model=EMBEDDING_MODEL)
+_emb = cassette.embeddings(model=EMBEDDING_MODEL)
 _stores: dict[str, QdrantVectorStore] = {}
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieve")
 
 
 def _get_store(chunker: str) -> QdrantVectorStore:
@@ -21,15 +35,333 @@ def _get_store(chunker: str) -> QdrantVectorStore:
             raise ValueError(
                 f"Unknown chunker '{chunker}'. Choose from: {list(COLLECTION_NAMES)}"
             )
-        url = os.environ["QDRANT_URL"]
-        api_key = os.environ["QDRANT_API_KEY"]
+        if cassette.replaying():
+            url = api_key = None   # served from recordings; no credentials needed
+        else:
+            url = os.environ["QDRANT_URL"]
+            api_key = os.environ["QDRANT_API_KEY"]
         _stores[chunker] = QdrantVectorStore(
             url=url, api_key=api_key, collection_name=collection_name
         )
     return _stores[chunker]
 
 
-def search(query: str, k: int = 8, chunker: str = "token"):
-    """Return top-k Qdrant hits for a query using the specified collection."""
-    qv = _emb.embed_query(query)
-    return _get_store(chunker).search(qv, k=k)
+# Bounded LRU memo of query embeddings shared by embed_query() / embed_queries()
+_EMBED_MEMO_SIZE = 1024
+_query_vectors: OrderedDict[str, tuple[float, ...]] = OrderedDict()
+_memo_lock = threading.Lock()
+
+
+def clear_query_memo() -> None:
+    """Forget every memoised query embedding."""
+    with _memo_lock:
+        _query_vectors.clear()
+
+
+def _memo_get(query: str) -> tuple[float, ...] | None:
+    with _memo_lock:
+        v = _query_vectors.get(query)
+        if v is not None:
+            _query_vectors.move_to_end(query)
+        return v
+
+
+def _memo_put(query: str, vector) -> tuple[float, ...]:
+    v = tuple(vector)
+    with _memo_lock:
+        _query_vectors[query] = v
+        _query_vectors.move_to_end(query)
+        while len(_query_vectors) > _EMBED_MEMO_SIZE:
+            _query_vectors.popitem(last=False)
+    return v
+
+
+# Concurrent memo misses for the same query share one embedding call
+_embed_flights = singleflight.SingleFlight()
+_aembed_flights = singleflight.AsyncSingleFlight()
+
+
+def _embed_and_memo(query: str) -> tuple[float, ...]:
+    with tracing.span("embed.query"):
+        v = _memo_put(query, _emb.embed_query(query))
+    usage.record("embed.query", EMBEDDING_MODEL, texts=[query])
+    return v
+
+
+async def _aembed_and_memo(query: str) -> tuple[float, ...]:
+    with tracing.span("embed.query"):
+        v = _memo_put(query, await _emb.aembed_query(query))
+    usage.record("embed.query", EMBEDDING_MODEL, texts=[query])
+    return v
+
+
+def embed_query(query: str) -> list[float]:
+    """
+    Embed a query string.
+
+    Memoised so the answer cache in rag.py and search() below share a single
+    embedding call for the same question.
+    """
+    v = _memo_get(query)
+    if v is None:
+        if SINGLE_FLIGHT_ENABLED:
+            v, _shared = _embed_flights.do(query, lambda: _embed_and_memo(query))
+        else:
+            v = _embed_and_memo(query)
+    return list(v)
+
+
+async def aembed_query(query: str) -> list[float]:
+    """Async embed_query(); shares the same memo."""
+    v = _memo_get(query)
+    if v is None:
+        if SINGLE_FLIGHT_ENABLED:
+            v, _shared = await _aembed_flights.do(query, lambda: _aembed_and_memo(query))
+        else:
+            v = await _aembed_and_memo(query)
+    return list(v)
+
+
+def embed_documents(texts: list[str], *, component: str = "embed.documents") -> list[list[float]]:
+    """
+    Embed a batch of texts in one call (not memoised).  *component* labels
+    the call in token-usage accounting.
+    """
+    with tracing.span("embed.batch", n=len(texts)):
+        vectors = _emb.embed_documents(texts)
+    usage.record(component, EMBEDDING_MODEL, texts=texts)
+    return vectors
+
+
+async def aembed_documents(texts: list[str], *, component: str = "embed.documents") -> list[list[float]]:
+    """Async embed_documents()."""
+    with tracing.span("embed.batch", n=len(texts)):
+        vectors = await _emb.aembed_documents(texts)
+    usage.record(component, EMBEDDING_MODEL, texts=texts)
+    return vectors
+
+
+def embed_queries(queries: list[str]) -> list[list[float]]:
+    """Embed several query strings with a single embed_documents() call."""
+    found = {q: _memo_get(q) for q in dict.fromkeys(queries)}
+    missing = [q for q, v in found.items() if v is None]
+    if missing:
+        for q, v in zip(missing, embed_documents(missing, component="embed.queries")):
+            found[q] = _memo_put(q, v)
+    return [list(found[q]) for q in queries]
+
+
+async def aembed_queries(queries: list[str]) -> list[list[float]]:
+    """Async embed_queries()."""
+    found = {q: _memo_get(q) for q in dict.fromkeys(queries)}
+    missing = [q for q, v in found.items() if v is None]
+    if missing:
+        for q, v in zip(missing, await aembed_documents(missing, component="embed.queries")):
+            found[q] = _memo_put(q, v)
+    return [list(found[q]) for q in queries]
+
+
+def collection_version(chunker: str = "token") -> str:
+    """Return the version identifier of the collection backing *chunker*."""
+    return _get_store(chunker).collection_version()
+
+
+async def acollection_version(chunker: str = "token") -> str:
+    """Async collection_version()."""
+    return await _get_store(chunker).acollection_version()
+
+
+async def apoints_count(chunker: str = "token") -> int:
+    """Live point count of the collection backing *chunker*."""
+    return await _get_store(chunker).apoints_count()
+
+
+def sample_vectors(chunker: str = "token", limit: int = 1000) -> list[list[float]]:
+    """Return up to *limit* stored embeddings from the collection backing *chunker*."""
+    return _get_store(chunker).sample_vectors(limit)
+
+
+def search_by_vector(
+    query_vector: list[float],
+    k: int = 8,
+    chunker: str = "token",
+    with_vectors: bool = False,
+):
+    """Return top-k Qdrant hits for a pre-computed query embedding."""
+    with tracing.span("qdrant.search", chunker=chunker, k=k):
+        return _get_store(chunker).search(query_vector, k=k, with_vectors=with_vectors)
+
+
+async def asearch_by_vector(
+    query_vector: list[float],
+    k: int = 8,
+    chunker: str = "token",
+    with_vectors: bool = False,
+):
+    """Async search_by_vector()."""
+    with tracing.span("qdrant.search", chunker=chunker, k=k):
+        return await _get_store(chunker).asearch(query_vector, k=k, with_vectors=with_vectors)
+
+
+def search(
+    query: str,
+    k: int = 8,
+    chunker: str = "token",
+    hybrid: bool = HYBRID_SEARCH,
+    with_vectors: bool = False,
+    query_vector: list[float] | None = None,
+):
+    """
+    Return top-k Qdrant hits for a query using the specified collection.
+
+    With ``hybrid=True`` the local BM25 index is searched alongside the dense
+    index and the two rankings are fused (see search_hybrid()).
+    With ``with_vectors=True`` dense hits also carry their stored embeddings.
+    Pass *query_vector* to reuse an embedding of *query* computed by the
+    caller (e.g. one embedding fanned out to several collections).
+    """
+    if hybrid:
+        return search_hybrid(
+            query, k=k, chunker=chunker, with_vectors=with_vectors, query_vector=query_vector
+        )
+    qv = query_vector if query_vector is not None else embed_query(query)
+    return search_by_vector(qv, k=k, chunker=chunker, with_vectors=with_vectors)
+
+
+async def asearch(
+    query: str,
+    k: int = 8,
+    chunker: str = "token",
+    hybrid: bool = HYBRID_SEARCH,
+    with_vectors: bool = False,
+    query_vector: list[float] | None = None,
+):
+    """Async search(): the embedding and Qdrant calls are awaited, not blocking a thread."""
+    if hybrid:
+        return await asearch_hybrid(
+            query, k=k, chunker=chunker, with_vectors=with_vectors, query_vector=query_vector
+        )
+    qv = query_vector if query_vector is not None else await aembed_query(query)
+    return await asearch_by_vector(qv, k=k, chunker=chunker, with_vectors=with_vectors)
+
+
+def search_hybrid(
+    query: str,
+    k: int = 8,
+    chunker: str = "token",
+    fusion: str = FUSION_METHOD,
+    lexical_k: int | None = None,
+    with_vectors: bool = False,
+    query_vector: list[float] | None = None,
+):
+    """
+    Dense + BM25 retrieval, fused into a single ranking of up to k hits.
+    Pass *query_vector* to reuse an embedding computed by the caller.
+
+    The lexical search runs on the pool while the query is embedded and the
+    dense search runs.  Lexical-only hits are then scored against the query
+    vector in one filtered Qdrant call so every returned hit carries a real
+    cosine distance for the confidence heuristics; with ``with_vectors=True``
+    the same call fetches their embeddings, so every hit carries a vector.
+    """
+    lexical_future = tracing.submit(
+        _executor, bm25.search, query, lexical_k or HYBRID_LEXICAL_K, chunker
+    )
+    qv = query_vector if query_vector is not None else embed_query(query)
+    dense = search_by_vector(qv, k=k, chunker=chunker, with_vectors=with_vectors)
+    lexical = lexical_future.result()
+
+    fused, missing = _fuse_hybrid(dense, lexical, fusion, k)
+    if missing:
+        with tracing.span("qdrant.score_ids", n=len(missing)):
+            scored = _get_store(chunker).search_ids(qv, missing, with_vectors=with_vectors)
+        _fill_lexical_only(fused, scored)
+    return fused
+
+
+async def asearch_hybrid(
+    query: str,
+    k: int = 8,
+    chunker: str = "token",
+    fusion: str = FUSION_METHOD,
+    lexical_k: int | None = None,
+    with_vectors: bool = False,
+    query_vector: list[float] | None = None,
+):
+    """Async search_hybrid(); the BM25 search runs on a worker thread meanwhile."""
+    lexical_task = asyncio.ensure_future(
+        asyncio.to_thread(bm25.search, query, lexical_k or HYBRID_LEXICAL_K, chunker)
+    )
+    qv = query_vector if query_vector is not None else await aembed_query(query)
+    dense = await asearch_by_vector(qv, k=k, chunker=chunker, with_vectors=with_vectors)
+    lexical = await lexical_task
+
+    fused, missing = _fuse_hybrid(dense, lexical, fusion, k)
+    if missing:
+        with tracing.span("qdrant.score_ids", n=len(missing)):
+            scored = await _get_store(chunker).asearch_ids(qv, missing, with_vectors=with_vectors)
+        _fill_lexical_only(fused, scored)
+    return fused
+
+
+def _fuse_hybrid(dense: list, lexical: list, fusion: str, k: int) -> tuple[list, list]:
+    """Fused top-k, and ids of lexical-only hits still needing a distance (and vector)."""
+    fused = fuse([dense, lexical], method=fusion, rrf_k=RRF_K)[:k]
+    dense_ids = {h.id for h in dense}
+    missing = [h.id for h in fused if h.id not in dense_ids]
+    return fused, missing
+
+
+def _fill_lexical_only(fused: list, scored: list) -> None:
+    """Give lexical-only hits their cosine distance (and vector) from *scored*."""
+    by_id = {h.id: h for h in scored}
+    for h in fused:
+        s = by_id.get(h.id)
+        if s is not None:
+            h.score = s.score
+            h.vector = s.vector if s.vector is not None else h.vector
+        elif "bm25" in h.fields:
+            h.score = 1.0   # not in the collection; treat as unrelated
+
+
+def search_multicollection(
+    query: str,
+    k: int = 8,
+    chunkers: list[str] | None = None,
+    fusion: str = FUSION_METHOD,
+    query_vector: list[float] | None = None,
+):
+    """
+    Search several collections in parallel with one query embedding and fuse
+    the per-collection rankings into a single list of up to k hits.
+    Pass *query_vector* to reuse an embedding computed by the caller.
+
+    Each hit's ``fields["chunker"]`` records the collection it came from.
+    """
+    chunkers = chunkers or MULTICOLLECTION_CHUNKERS
+    qv = query_vector if query_vector is not None else embed_query(query)
+    futures = [tracing.submit(_executor, search_by_vector, qv, k, c) for c in chunkers]
+    return _fuse_collections(chunkers, [f.result() for f in futures], fusion, k)
+
+
+async def asearch_multicollection(
+    query: str,
+    k: int = 8,
+    chunkers: list[str] | None = None,
+    fusion: str = FUSION_METHOD,
+    query_vector: list[float] | None = None,
+):
+    """Async search_multicollection()."""
+    chunkers = chunkers or MULTICOLLECTION_CHUNKERS
+    qv = query_vector if query_vector is not None else await aembed_query(query)
+    results = await asyncio.gather(*(asearch_by_vector(qv, k, c) for c in chunkers))
+    return _fuse_collections(chunkers, results, fusion, k)
+
+
+def _fuse_collections(chunkers: list[str], results: list[list], fusion: str, k: int) -> list:
+    ranked_lists = []
+    for chunker, hits in zip(chunkers, results):
+        for h in hits:
+            h.fields["chunker"] = chunker
+        ranked_lists.append(hits)
+    return fuse(ranked_lists, method=fusion, rrf_k=RRF_K)[:k]
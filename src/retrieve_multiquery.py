@@ -1,6 +1,6 @@
 """
 Multi-Query retrieval: generates several rephrasings of the user's question,
-runs each through the vector index, then merges and deduplicates the results.
+runs each through the vector index, then fuses the per-query rankings.
 
 Why this helps
 --------------
@@ -13,6 +13,14 @@ alternative phrasings — more formal, more informal, more specific, more genera
 The original question is always included as query #1, so the method can only
 add relevant results; it never removes what the plain search would find.
 
+Latency
+-------
+The original question's search is launched as soon as the call starts and runs
+while the LLM is still writing variants.  The variants are then embedded in a
+single batched call and searched concurrently, so multi-query mode costs
+roughly one LLM call on top of a plain search.  asearch_multiquery() does
+the same with tasks on the event loop instead of pool threads.
+
 Usage (standalone)
 ------------------
     uv run python -m src.retrieve_multiquery
@@ -20,15 +28,25 @@ Usage (standalone)
 
 from __future__ import annotations
 
+import asyncio
 import time
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 load_dotenv()
 
-from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 
-from src.retrieve import search
+from src import cassette, tracing, usage
+from src.config import FUSION_METHOD, RRF_K
+from src.fusion import fuse
+from src.retrieve import (
+    aembed_queries,
+    asearch,
+    asearch_by_vector,
+    embed_queries,
+    search,
+    search_by_vector,
+)
 
 # ── Query generation ──────────────────────────────────────────────────────────
 
@@ -45,9 +63,8 @@ Return ONLY the rephrasings, one per line, with no numbering, bullets, or extra
 Question: {question}"""
 )
 
-_llm = ChatOpenAI(model="gpt-4.1-mini", temperature=0.4)
-_parser = StrOutputParser()
-_query_chain = _QUERY_GEN_PROMPT | _llm | _parser
+_llm = cassette.chat_model(model="gpt-4.1-mini", temperature=0.4)
+_query_chain = _QUERY_GEN_PROMPT | _llm
 
 
 def generate_queries(question: str, n: int = 3, retries: int = 3) -> list[str]:
@@ -57,16 +74,9 @@ def generate_queries(question: str, n: int = 3, retries: int = 3) -> list[str]:
     """
     for attempt in range(retries):
         try:
-            raw = _query_chain.invoke({"question": question, "n": n})
-            variants = [q.strip() for q in raw.strip().splitlines() if q.strip()]
-            # Deduplicate while preserving order; always put original first
-            seen = {question.lower()}
-            unique = [question]
-            for v in variants:
-                if v.lower() not in seen:
-                    seen.add(v.lower())
-                    unique.append(v)
-            return unique[:n + 1]  # original + up to n variants
+            with tracing.span("multiquery.generate", attempt=attempt):
+                msg = _query_chain.invoke({"question": question, "n": n})
+            return _parse_variants(question, msg, n)
         except Exception as e:
             wait = 2 ** attempt
             print(f"Query generation failed ({type(e).__name__}). Retrying in {wait}s…")
@@ -76,42 +86,148 @@ def generate_queries(question: str, n: int = 3, retries: int = 3) -> list[str]:
     return [question]
 
 
+async def agenerate_queries(question: str, n: int = 3, retries: int = 3) -> list[str]:
+    """Async generate_queries()."""
+    for attempt in range(retries):
+        try:
+            with tracing.span("multiquery.generate", attempt=attempt):
+                msg = await _query_chain.ainvoke({"question": question, "n": n})
+            return _parse_variants(question, msg, n)
+        except Exception as e:
+            wait = 2 ** attempt
+            print(f"Query generation failed ({type(e).__name__}). Retrying in {wait}s…")
+            await asyncio.sleep(wait)
+
+    return [question]
+
+
+def _parse_variants(question: str, msg, n: int) -> list[str]:
+    """Record the call's usage and turn the LLM output into [question, *variants]."""
+    usage.record(
+        "multiquery.generate", _llm.model_name,
+        **usage.from_llm_metadata(msg.usage_metadata),
+    )
+    variants = [q.strip() for q in msg.content.strip().splitlines() if q.strip()]
+    # Deduplicate while preserving order; always put original first
+    seen = {question.lower()}
+    unique = [question]
+    for v in variants:
+        if v.lower() not in seen:
+            seen.add(v.lower())
+            unique.append(v)
+    return unique[:n + 1]  # original + up to n variants
+
+
 # ── Multi-query search ────────────────────────────────────────────────────────
 
+# Shared pool for overlapping query generation with the Qdrant searches
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="multiquery")
+
+
 def search_multiquery(
     question: str,
     k: int = 8,
     chunker: str = "token",
     n_variants: int = 3,
+    fusion: str = FUSION_METHOD,
+    with_vectors: bool = False,
+    queries: list[str] | None = None,
+    query_vector: list[float] | None = None,
+    verbose: bool = True,
 ) -> list:
     """
     Run retrieval for the original question plus *n_variants* rephrasings,
-    then merge and deduplicate results ranked by best (lowest) cosine distance.
+    then fuse the per-query rankings (see src.fusion; reciprocal-rank fusion
+    by default) into one deduplicated list.
+
+    Callers searching several collections for the same question can pass the
+    output of generate_queries() as *queries* and the question's embedding
+    as *query_vector* so neither is recomputed per collection.  With
+    verbose=False the generated queries are not printed (e.g. when many
+    searches run concurrently and the output would interleave).
+
+    If query generation or the variant embedding raises, the original
+    search is cancelled (or, if already running, left to finish unread).
 
     Returns up to k * 2 hits so the caller has a richer pool to re-rank.
     """
-    queries = generate_queries(question, n=n_variants)
+    # Start the original query's search immediately; it doesn't need the LLM
+    original_future = tracing.submit(
+        _executor, search, question, k, chunker,
+        with_vectors=with_vectors, query_vector=query_vector,
+    )
+
+    try:
+        if queries is None:
+            queries = generate_queries(question, n=n_variants)
+        if verbose:
+            _print_queries(queries)
+
+        variants = queries[1:]
+        vectors = embed_queries(variants) if variants else []
+    except BaseException:
+        original_future.cancel()   # no-op once running; its result is simply dropped
+        raise
+
+    variant_futures = [
+        tracing.submit(_executor, search_by_vector, v, k, chunker, with_vectors)
+        for v in vectors
+    ]
+
+    ranked_lists = [f.result() for f in [original_future, *variant_futures]]
+    return _fuse_queries(ranked_lists, fusion, k)
+
+
+async def asearch_multiquery(
+    question: str,
+    k: int = 8,
+    chunker: str = "token",
+    n_variants: int = 3,
+    fusion: str = FUSION_METHOD,
+    with_vectors: bool = False,
+    queries: list[str] | None = None,
+    query_vector: list[float] | None = None,
+    verbose: bool = True,
+) -> list:
+    """
+    Async search_multiquery(); same overlap of query generation and searches.
+    If query generation or embedding fails, the original search is cancelled
+    and awaited before the error propagates.
+    """
+    original_task = asyncio.ensure_future(
+        asearch(question, k, chunker, with_vectors=with_vectors, query_vector=query_vector)
+    )
 
+    try:
+        if queries is None:
+            queries = await agenerate_queries(question, n=n_variants)
+        if verbose:
+            _print_queries(queries)
+
+        variants = queries[1:]
+        vectors = await aembed_queries(variants) if variants else []
+    except BaseException:
+        # Await the cancelled search so its outcome is retrieved, not left on the loop
+        original_task.cancel()
+        await asyncio.gather(original_task, return_exceptions=True)
+        raise
+
+    variant_searches = [asearch_by_vector(v, k, chunker, with_vectors) for v in vectors]
+
+    ranked_lists = await asyncio.gather(original_task, *variant_searches)
+    return _fuse_queries(ranked_lists, fusion, k)
+
+
+def _print_queries(queries: list[str]) -> None:
     print(f"  [multiquery] Generated {len(queries)} queries:")
     for i, q in enumerate(queries):
         label = "(original)" if i == 0 else f"(variant {i})"
         print(f"    {label} {q}")
 
-    # Collect hits across all queries; deduplicate by chunk id
-    seen_ids: set[str] = set()
-    merged: list = []
-
-    for query in queries:
-        hits = search(query, k=k, chunker=chunker)
-        for hit in hits:
-            hit_id = getattr(hit, "id", None) or hit.fields.get("chunk_id", "")
-            if hit_id not in seen_ids:
-                seen_ids.add(hit_id)
-                merged.append(hit)
-
-    # Re-rank by cosine distance score (lower = more similar)
-    merged.sort(key=lambda h: getattr(h, "score", 1e9))
 
+def _fuse_queries(ranked_lists: list[list], fusion: str, k: int) -> list:
+    with tracing.span("fusion", method=fusion, lists=len(ranked_lists)):
+        merged = fuse(ranked_lists, method=fusion, rrf_k=RRF_K)
     return merged[: k * 2]
 
 
@@ -0,0 +1,386 @@
+"""
+HTTP serving layer for the RAG pipeline.
+
+The Streamlit app reruns its whole script on every interaction and cannot be
+load-balanced or called by other services.  This module exposes the async
+pipeline (see the Async API section of rag.py) over HTTP instead:
+
+  POST /search     {"question", "k", "chunker", "hybrid"}      → {"hits"}
+  POST /retrieve   {"question", "k", "chunker", "multiquery"}  → {"hits", "context", "sources", "confidence", "trace"}
+  POST /answer     same body as /retrieve                      → text/event-stream (below)
+  GET  /healthz    liveness: the process is up and serving requests
+  GET  /readyz     readiness: not shutting down and Qdrant answers; 503 otherwise
+
+/answer streams server-sent events:
+
+  retrieved  {"hits", "sources", "confidence"}   once, before the first token
+  token      {"text"}                            one per answer chunk
+  done       {"refused", "trace"}                refusal flag; trace id, per-stage ms, waterfall, token usage
+  error      {"status", "error"}                 instead of done; the stream then ends
+
+Limits
+------
+At most SERVER_MAX_CONCURRENCY search / retrieve / answer requests run at once
+per process.  A request waits up to SERVER_QUEUE_TIMEOUT_S for a slot, then
+gets 503 with Retry-After.  /search, /retrieve and the retrieval part of
+/answer are bounded by SERVER_REQUEST_TIMEOUT_S (504).  The whole answer stream
+is bounded by SERVER_STREAM_TIMEOUT_S; when that runs out the stream ends with
+an error event.  If the client disconnects, its request is cancelled along with
+any LLM call still running.
+
+Between requests a process holds only its in-memory caches (answer cache,
+query-embedding memo).  Run as many processes or replicas behind a load
+balancer as the traffic needs.  The app is a plain ASGI callable with no web
+framework.  It needs an ASGI server such as uvicorn, which is optional and not
+in the default dependencies.
+
+Usage
+-----
+    uv run --with uvicorn python -m src.server --port 8000 --workers 4
+    uv run --with uvicorn uvicorn src.server:app --port 8000
+    curl -N localhost:8000/answer -d '{"question": "What is overfitting?"}'
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import logging
+from contextlib import asynccontextmanager, suppress
+from dataclasses import asdict
+
+from dotenv import load_dotenv
+load_dotenv()
+
+from src import rag, retrieve
+from src.config import (
+    HYBRID_SEARCH,
+    SERVER_HOST,
+    SERVER_MAX_BODY_BYTES,
+    SERVER_MAX_CONCURRENCY,
+    SERVER_MAX_K,
+    SERVER_PORT,
+    SERVER_QUEUE_TIMEOUT_S,
+    SERVER_READY_TIMEOUT_S,
+    SERVER_REQUEST_TIMEOUT_S,
+    SERVER_STREAM_TIMEOUT_S,
+)
+from src.tracing import Trace
+from src.usage import summarise as summarise_usage
+
+CHUNKERS = ("token", "semantic", "parent_child")
+
+log = logging.getLogger(__name__)
+
+_slots: asyncio.Semaphore | None = None   # created on first use, inside the server's event loop
+_in_flight = 0
+_shutting_down = False
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: list[tuple[bytes, bytes]] | None = None) -> None:
+        super().__init__(message)
+        self.status, self.message, self.headers = status, message, headers or []
+
+
+class ClientDisconnected(Exception):
+    pass
+
+
+# ── Request / response helpers ────────────────────────────────────────────────
+
+def _json_default(o):
+    return o.item() if hasattr(o, "item") else str(o)   # numpy scalars from rerank / fusion
+
+
+def _dumps(payload) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode("utf-8")
+
+
+async def _send_json(send, status: int, payload, headers: list | None = None) -> None:
+    body = _dumps(payload)
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            *(headers or []),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_event(send, event: str, payload) -> None:
+    data = b"event: " + event.encode() + b"\ndata: " + _dumps(payload) + b"\n\n"
+    await send({"type": "http.response.body", "body": data, "more_body": True})
+
+
+async def _read_json(receive) -> dict:
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ClientDisconnected
+        body += message.get("body", b"")
+        if len(body) > SERVER_MAX_BODY_BYTES:
+            raise HTTPError(413, f"Body larger than {SERVER_MAX_BODY_BYTES} bytes")
+        if not message.get("more_body"):
+            break
+    try:
+        data = json.loads(body or b"{}")
+    except ValueError:
+        raise HTTPError(400, "Body must be JSON") from None
+    if not isinstance(data, dict):
+        raise HTTPError(400, "Body must be a JSON object")
+    return data
+
+
+def _params(body: dict, flag: str, default: bool) -> dict:
+    """Validated question / k / chunker plus one boolean option (*flag*) from a request body."""
+    question = body.get("question")
+    if not isinstance(question, str) or not question.strip():
+        raise HTTPError(422, "'question' must be a non-empty string")
+    k = body.get("k", rag.DEFAULT_K)
+    if not isinstance(k, int) or isinstance(k, bool) or not 1 <= k <= SERVER_MAX_K:
+        raise HTTPError(422, f"'k' must be an integer between 1 and {SERVER_MAX_K}")
+    chunker = body.get("chunker", "token")
+    if chunker not in CHUNKERS:
+        raise HTTPError(422, f"'chunker' must be one of {list(CHUNKERS)}")
+    value = body.get(flag, default)
+    if not isinstance(value, bool):
+        raise HTTPError(422, f"'{flag}' must be a boolean")
+    return {"question": question.strip(), "k": k, "chunker": chunker, flag: value}
+
+
+def _hit(h) -> dict:
+    d = asdict(h)
+    d.pop("vector", None)
+    return d
+
+
+def _trace_summary(trace: Trace) -> dict:
+    return {
+        "trace_id": trace.id,
+        "total_ms": round(trace.total_ms(), 3),
+        "stage_ms": trace.stage_ms(),
+        "waterfall": trace.waterfall(),
+        "usage": summarise_usage(trace.usage),
+    }
+
+
+@asynccontextmanager
+async def _slot():
+    """Hold one of the SERVER_MAX_CONCURRENCY request slots; 503 if none frees up in time."""
+    global _slots, _in_flight
+    if _slots is None:
+        _slots = asyncio.Semaphore(SERVER_MAX_CONCURRENCY)
+    try:
+        async with asyncio.timeout(SERVER_QUEUE_TIMEOUT_S):
+            await _slots.acquire()
+    except TimeoutError:
+        raise HTTPError(503, "Server busy; retry shortly", [(b"retry-after", b"1")]) from None
+    _in_flight += 1
+    try:
+        yield
+    finally:
+        _in_flight -= 1
+        _slots.release()
+
+
+async def _until_disconnect(coro, receive):
+    """Run *coro*, cancelling it if the client disconnects first."""
+    task = asyncio.ensure_future(coro)
+
+    async def watch() -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    watcher = asyncio.ensure_future(watch())
+    try:
+        await asyncio.wait({task, watcher}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        watcher.cancel()
+        if not task.done():
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+    if task.cancelled():
+        raise ClientDisconnected
+    return task.result()
+
+
+# ── Endpoints ─────────────────────────────────────────────────────────────────
+
+async def healthz() -> tuple[int, dict]:
+    return 200, {"status": "ok", "in_flight": _in_flight, "max_concurrency": SERVER_MAX_CONCURRENCY}
+
+
+async def readyz() -> tuple[int, dict]:
+    if _shutting_down:
+        return 503, {"status": "shutting down"}
+    try:
+        async with asyncio.timeout(SERVER_READY_TIMEOUT_S):
+            points = await retrieve.apoints_count("token")
+    except Exception as e:
+        return 503, {"status": "unavailable", "error": f"{type(e).__name__}: {e}"}
+    if not points:
+        return 503, {"status": "unavailable", "error": "token collection is empty"}
+    return 200, {"status": "ready", "points": points}
+
+
+async def search(body: dict, send) -> None:
+    p = _params(body, "hybrid", HYBRID_SEARCH)
+    async with asyncio.timeout(SERVER_REQUEST_TIMEOUT_S):
+        hits = await retrieve.asearch(p["question"], k=p["k"], chunker=p["chunker"], hybrid=p["hybrid"])
+    await _send_json(send, 200, {"hits": [_hit(h) for h in hits]})
+
+
+async def retrieve_context(body: dict, send) -> None:
+    p = _params(body, "multiquery", False)
+    trace = Trace("retrieve")
+    try:
+        async with asyncio.timeout(SERVER_REQUEST_TIMEOUT_S):
+            hits, context, sources, confidence = await rag.aretrieve_context(
+                p["question"], k=p["k"], chunker=p["chunker"], use_multiquery=p["multiquery"], trace=trace,
+            )
+    except BaseException as e:
+        rag.finish_trace(trace, error=type(e).__name__)
+        raise
+    rag.discard_pending(p["question"], context)   # no answer stream follows; finishes the trace
+    await _send_json(send, 200, {
+        "hits": [_hit(h) for h in hits],
+        "context": context,
+        "sources": sources,
+        "confidence": confidence,
+        "trace": _trace_summary(trace),
+    })
+
+
+async def answer(body: dict, send) -> None:
+    """
+    Retrieval runs before the response starts, so its errors and timeouts
+    still get a proper status code.  Once tokens are streaming, failures
+    arrive as an error event instead.
+    """
+    deadline = asyncio.get_running_loop().time() + SERVER_STREAM_TIMEOUT_S
+    p = _params(body, "multiquery", False)
+    trace = Trace("answer")
+    try:
+        async with asyncio.timeout(SERVER_REQUEST_TIMEOUT_S):
+            token_stream, sources, hits, confidence, _context = await rag.astream_answer(
+                p["question"], k=p["k"], chunker=p["chunker"], use_multiquery=p["multiquery"], trace=trace,
+            )
+    except BaseException as e:
+        rag.finish_trace(trace, error=type(e).__name__)
+        raise
+
+    try:
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [
+                (b"content-type", b"text/event-stream; charset=utf-8"),
+                (b"cache-control", b"no-cache"),
+                (b"x-accel-buffering", b"no"),   # stop nginx-style proxies buffering the stream
+            ],
+        })
+        await _send_event(send, "retrieved", {
+            "hits": [_hit(h) for h in hits], "sources": sources, "confidence": confidence,
+        })
+        parts = []
+        try:
+            async with asyncio.timeout_at(deadline):
+                async for token in token_stream:
+                    parts.append(token)
+                    await _send_event(send, "token", {"text": token})
+        except TimeoutError:
+            await _send_event(send, "error", {"status": 504, "error": "Answer stream timed out"})
+        except Exception as e:
+            log.exception("/answer stream failed")
+            await _send_event(send, "error", {"status": 500, "error": f"{type(e).__name__}: {e}"})
+        else:
+            await _send_event(send, "done", {
+                "refused": rag._is_refused("".join(parts)), "trace": _trace_summary(trace),
+            })
+    finally:
+        await token_stream.aclose()
+        rag.finish_trace(trace)   # in case the stream never started
+    await send({"type": "http.response.body", "body": b""})
+
+
+PROBES = {"/healthz": healthz, "/readyz": readyz}
+ENDPOINTS = {"/search": search, "/retrieve": retrieve_context, "/answer": answer}
+
+
+# ── ASGI app ──────────────────────────────────────────────────────────────────
+
+async def _lifespan(receive, send) -> None:
+    global _shutting_down
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            _shutting_down = False
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            _shutting_down = True
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send) -> None:
+    if scope["type"] == "lifespan":
+        return await _lifespan(receive, send)
+    if scope["type"] != "http":
+        return
+
+    started = False
+
+    async def tracked_send(message) -> None:
+        nonlocal started
+        started = started or message["type"] == "http.response.start"
+        await send(message)
+
+    path, method = scope["path"], scope["method"]
+    try:
+        if path in PROBES:
+            if method != "GET":
+                raise HTTPError(405, "Use GET", [(b"allow", b"GET")])
+            status, payload = await PROBES[path]()
+            await _send_json(tracked_send, status, payload)
+        elif path in ENDPOINTS:
+            if method != "POST":
+                raise HTTPError(405, "Use POST", [(b"allow", b"POST")])
+            body = await _read_json(receive)
+            async with _slot():
+                await _until_disconnect(ENDPOINTS[path](body, tracked_send), receive)
+        else:
+            raise HTTPError(404, f"No route for {path}")
+    except ClientDisconnected:
+        return
+    except HTTPError as e:
+        if not started:
+            await _send_json(tracked_send, e.status, {"error": e.message}, e.headers)
+    except TimeoutError:
+        if not started:
+            await _send_json(tracked_send, 504, {"error": f"Timed out after {SERVER_REQUEST_TIMEOUT_S:g} s"})
+    except Exception as e:
+        log.exception("%s %s failed", method, path)
+        if not started:
+            await _send_json(tracked_send, 500, {"error": f"{type(e).__name__}: {e}"})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve the RAG pipeline over HTTP (ASGI).")
+    parser.add_argument("--host", default=SERVER_HOST, help=f"Bind address (default: {SERVER_HOST}).")
+    parser.add_argument("--port", type=int, default=SERVER_PORT, help=f"Port (default: {SERVER_PORT}).")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes, each with its own caches and concurrency limit (default: 1).")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    try:
+        import uvicorn
+    except ImportError:
+        raise SystemExit("src.server needs an ASGI server: uv run --with uvicorn python -m src.server")
+    uvicorn.run("src.server:app", host=args.host, port=args.port, workers=args.workers)
@@ -0,0 +1,265 @@
+"""
+Single-flight request coalescing.
+
+When a question trends (e.g. a class assignment), many users submit the
+same text at once, and each used to run its own embedding, search and
+generation.  rag.py now lets concurrent identical requests share one
+in-flight computation:
+
+  Retrieval   keyed by (normalised question, k, chunker, multiquery).  The
+              first caller runs retrieval and context building.  Callers
+              arriving while it runs wait for it and get the same result.
+  Generation  keyed by (normalised question, context).  The first caller's
+              LLM stream is shared: a later caller first gets the tokens
+              already produced, then follows live.  Every subscriber
+              receives the same text.
+
+Only in-flight work is shared.  A key is released as soon as its computation
+finishes; later repeats go to the answer cache, if it is enabled.
+Followers' traces show a singleflight.wait span in place of the stages they
+skipped.  LLM token usage is counted once, when the shared stream completes,
+on the earliest subscriber's trace that is still open.
+
+SingleFlight and StreamGroup serve threaded callers (the sync API, app.py).
+AsyncSingleFlight and AsyncStreamGroup serve the async API (server.py).
+"""
+
+from __future__ import annotations
+
+import asyncio
+import threading
+from concurrent.futures import Future
+from typing import Callable, Hashable
+
+from src import tracing
+
+
+def normalise_question(question: str) -> str:
+    """Case- and whitespace-insensitive form of *question*, used in coalescing keys."""
+    return " ".join(question.split()).casefold()
+
+
+# ── One-shot calls ────────────────────────────────────────────────────────────
+
+class SingleFlight:
+    """At most one call per key at a time; concurrent callers share its result (or exception)."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._calls: dict[Hashable, Future] = {}
+
+    def do(self, key: Hashable, fn: Callable):
+        """Return (result, shared); *shared* is True when another caller's call produced it."""
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+            if leader:
+                future = self._calls[key] = Future()
+        if not leader:
+            with tracing.span("singleflight.wait"):
+                return future.result(), True
+        try:
+            result = fn()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+        future.set_result(result)
+        return result, False
+
+
+class AsyncSingleFlight:
+    """
+    Async SingleFlight.  The call runs as its own task, so a caller that is
+    cancelled (e.g. its client disconnected) does not cancel it for the rest.
+    """
+
+    def __init__(self) -> None:
+        self._tasks: dict[Hashable, asyncio.Task] = {}
+
+    def _release(self, key: Hashable, task: asyncio.Task) -> None:
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+        if not task.cancelled():
+            task.exception()   # mark retrieved even if every caller has gone
+
+    async def do(self, key: Hashable, make_coro: Callable):
+        """Return (result, shared), awaiting the call already in flight for *key* if there is one."""
+        task = self._tasks.get(key)
+        if task is None:
+            task = asyncio.ensure_future(make_coro())
+            self._tasks[key] = task
+            task.add_done_callback(lambda t: self._release(key, t))
+            return await asyncio.shield(task), False
+        with tracing.span("singleflight.wait"):
+            return await asyncio.shield(task), True
+
+
+# ── Shared token streams ──────────────────────────────────────────────────────
+#
+# Subscriber counts live on each stream but are only changed under the
+# owning group's lock, so joining a stream and abandoning it cannot race.
+
+_ABANDONED = "shared stream abandoned by all subscribers"
+
+
+class _SharedStream:
+    """
+    Tokens from one source iterator, replayable by any number of threads.
+    Whichever subscriber needs the next token pulls it from the source, so
+    the stream keeps going as long as anyone is reading.
+    """
+
+    def __init__(self, source, group: StreamGroup, key: Hashable) -> None:
+        self._source, self._group, self._key = source, group, key
+        self._tokens: list[str] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self._pull_lock = threading.Lock()   # held while waiting on the source
+        self.subscribers = 0
+
+    def _pull(self, i: int) -> None:
+        with self._pull_lock:
+            if i < len(self._tokens) or self._done:
+                return
+            try:
+                self._tokens.append(next(self._source))
+                return
+            except StopIteration:
+                pass
+            except Exception as e:
+                self._error = e
+            self._done = True
+        self._group._release(self._key, self)
+
+    def _abandon(self) -> None:
+        with self._pull_lock:
+            if not self._done:
+                self._source.close()
+                self._done, self._error = True, RuntimeError(_ABANDONED)
+
+    def iterate(self):
+        i = 0
+        try:
+            while True:
+                if i < len(self._tokens):
+                    yield self._tokens[i]
+                    i += 1
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    self._pull(i)
+        finally:
+            if self._group._leave(self._key, self):
+                self._abandon()
+
+
+class _AsyncSharedStream:
+    """
+    Async _SharedStream.  A pump task reads the source, so a subscriber
+    that is cancelled never interrupts the stream for the others.  The
+    source is closed once every subscriber has gone.
+    """
+
+    def __init__(self, source, group: AsyncStreamGroup, key: Hashable) -> None:
+        self._group, self._key = group, key
+        self._tokens: list[str] = []
+        self._done = False
+        self._error: BaseException | None = None
+        self._changed = asyncio.Event()
+        self.subscribers = 0
+        self._task = asyncio.ensure_future(self._pump(source))
+
+    def _wake(self) -> None:
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def _pump(self, source) -> None:
+        try:
+            async for token in source:
+                self._tokens.append(token)
+                self._wake()
+        except asyncio.CancelledError:
+            self._error = RuntimeError(_ABANDONED)
+        except Exception as e:
+            self._error = e
+        finally:
+            self._done = True
+            self._wake()
+            self._group._release(self._key, self)
+            await source.aclose()
+
+    def _abandon(self) -> None:
+        self._task.cancel()
+
+    async def iterate(self):
+        i = 0
+        try:
+            while True:
+                if i < len(self._tokens):
+                    yield self._tokens[i]
+                    i += 1
+                elif self._done:
+                    if self._error is not None:
+                        raise self._error
+                    return
+                else:
+                    await self._changed.wait()
+        finally:
+            if self._group._leave(self._key, self):
+                self._abandon()
+
+
+class StreamGroup:
+    """Token streams shared by key while in flight (threaded callers)."""
+
+    _stream_cls = _SharedStream
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._streams: dict[Hashable, _SharedStream] = {}
+
+    def subscribe(self, key: Hashable, make_source: Callable, member=None):
+        """
+        Return (token iterator, shared).  The first caller for *key* starts
+        make_source(members); callers that join while it is still in flight
+        get the same tokens, from the beginning.  *members* is a live list of
+        each subscriber's *member* (e.g. its trace), in join order.
+        """
+        with self._lock:
+            stream = self._streams.get(key)
+            shared = stream is not None
+            if not shared:
+                members: list = []
+                stream = self._streams[key] = self._stream_cls(make_source(members), self, key)
+                stream.members = members
+            if member is not None:
+                stream.members.append(member)
+            stream.subscribers += 1
+        return stream.iterate(), shared
+
+    def _release(self, key: Hashable, stream) -> None:
+        """Forget *stream* once it has finished; new callers start afresh."""
+        with self._lock:
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+
+    def _leave(self, key: Hashable, stream) -> bool:
+        """Drop one subscriber; True when it was the last and the stream should stop."""
+        with self._lock:
+            stream.subscribers -= 1
+            if stream.subscribers or stream._done:
+                return False
+            if self._streams.get(key) is stream:
+                del self._streams[key]
+            return True
+
+
+class AsyncStreamGroup(StreamGroup):
+    """Async StreamGroup: subscriptions are async iterators."""
+
+    _stream_cls = _AsyncSharedStream
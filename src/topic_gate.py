@@ -0,0 +1,257 @@
+"""
+Early-refusal gate.
+
+Off-topic questions ("What is the capital of France?") used to run full
+retrieval, context building and an LLM call, only to come back with the
+canned refusal.  The gate stops them before most of that work:
+
+  1. Topic check.  The query embedding is compared with a small set of
+     on-topic prototypes: k-means centroids of vectors sampled from the
+     index.  If the best cosine similarity is below
+     TOPIC_GATE_MIN_SIMILARITY, the question is refused as off-topic.  The
+     query embedding is the memoised one that the answer cache and search()
+     use anyway, so a refusal here costs one embedding call and a single
+     matrix-vector product.
+  2. Coverage check.  After the search, if even the best hit is further
+     away than NO_COVERAGE_MAX_DISTANCE, the question is refused as not
+     covered.  Rerank, compression and the LLM call are skipped.  Off until
+     NO_COVERAGE_MAX_DISTANCE is set: on-topic and off-topic best-hit
+     distances overlap, so the threshold has to come from report().
+
+Refusals use the canned texts in config (REFUSAL_OFF_TOPIC,
+REFUSAL_NO_COVERAGE).  rag._is_refused() recognises them the same way as a
+refusal from the LLM.
+
+Prototypes are built once per index and saved to TOPIC_GATE_PATH.  Without
+that file the topic check is off.  The build also embeds the eval questions
+and prints, for on-topic and expected-refusal questions, their prototype
+similarity and best-hit distance, so both thresholds can be checked against
+the current index.
+
+Usage
+-----
+    uv run python -m src.topic_gate                          # token collection
+    uv run python -m src.topic_gate --chunkers token semantic --prototypes 128
+    uv run python -m src.topic_gate --report-only            # thresholds vs eval questions
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+from dataclasses import dataclass
+from datetime import datetime, timezone
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+
+from src import tracing
+from src.config import (
+    NO_COVERAGE_MAX_DISTANCE,
+    REFUSAL_NO_COVERAGE,
+    REFUSAL_OFF_TOPIC,
+    TOPIC_GATE_ENABLED,
+    TOPIC_GATE_MIN_SIMILARITY,
+    TOPIC_GATE_PATH,
+    TOPIC_GATE_PROTOTYPES,
+    TOPIC_GATE_SAMPLE,
+)
+
+QUESTIONS_PATH = Path("eval/questions.jsonl")
+
+
+@dataclass
+class Refusal:
+    kind: str      # "off_topic" | "no_coverage"
+    text: str      # canned answer
+    reason: str    # short explanation for the debug panel
+
+
+@lru_cache(maxsize=1)
+def _prototypes() -> np.ndarray | None:
+    """Unit-norm prototype matrix (P, dim), or None when not built."""
+    path = Path(TOPIC_GATE_PATH) if TOPIC_GATE_PATH else None
+    if path is None or not path.exists():
+        return None
+    with np.load(path) as data:
+        return data["prototypes"].astype(np.float32)
+
+
+def topic_similarity(query_vector: list[float]) -> float | None:
+    """Best cosine similarity between *query_vector* and the on-topic prototypes."""
+    protos = _prototypes()
+    if protos is None:
+        return None
+    q = np.asarray(query_vector, dtype=np.float32)
+    q /= np.linalg.norm(q) or 1.0
+    return float((protos @ q).max())
+
+
+def check_topic(question: str) -> Refusal | None:
+    """Refuse obvious off-topic questions from the query embedding alone."""
+    if not TOPIC_GATE_ENABLED or _prototypes() is None:
+        return None
+    from src.retrieve import embed_query
+
+    with tracing.span("gate.topic") as sp:
+        sim = topic_similarity(embed_query(question))
+        if sp is not None:
+            sp.attrs["similarity"] = round(sim, 4)
+    return _topic_verdict(sim)
+
+
+async def acheck_topic(question: str) -> Refusal | None:
+    """Async check_topic()."""
+    if not TOPIC_GATE_ENABLED or _prototypes() is None:
+        return None
+    from src.retrieve import aembed_query
+
+    with tracing.span("gate.topic") as sp:
+        sim = topic_similarity(await aembed_query(question))
+        if sp is not None:
+            sp.attrs["similarity"] = round(sim, 4)
+    return _topic_verdict(sim)
+
+
+def _topic_verdict(sim: float) -> Refusal | None:
+    if sim < TOPIC_GATE_MIN_SIMILARITY:
+        return Refusal("off_topic", REFUSAL_OFF_TOPIC, f"Off-topic (prototype similarity {sim:.2f})")
+    return None
+
+
+def check_coverage(hits: list) -> Refusal | None:
+    """Refuse when even the best retrieved hit is too far from the question."""
+    if not TOPIC_GATE_ENABLED or NO_COVERAGE_MAX_DISTANCE is None:
+        return None
+    scores = [h.score for h in hits if getattr(h, "score", None) is not None]
+    if not scores:
+        return Refusal("no_coverage", REFUSAL_NO_COVERAGE, "No retrieval hits")
+    best = min(scores)
+    if best > NO_COVERAGE_MAX_DISTANCE:
+        return Refusal("no_coverage", REFUSAL_NO_COVERAGE, f"No coverage (best distance {best:.2f})")
+    return None
+
+
+# ── Building prototypes ───────────────────────────────────────────────────────
+
+def _kmeans(x: np.ndarray, k: int, iters: int = 25, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on unit-norm rows of *x*; returns unit-norm centroids."""
+    rng = np.random.default_rng(seed)
+    k = min(k, len(x))
+    centroids = x[rng.choice(len(x), size=k, replace=False)]
+    for _ in range(iters):
+        assign = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, x)
+        empty = ~np.bincount(assign, minlength=k).astype(bool)
+        sums[empty] = centroids[empty]
+        centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+    return centroids
+
+
+def build(chunkers: list[str], n_prototypes: int, sample: int, path: Path) -> np.ndarray:
+    from src.retrieve import collection_version, sample_vectors
+
+    vectors = []
+    for chunker in chunkers:
+        v = sample_vectors(chunker, limit=sample)
+        print(f"  {chunker}: sampled {len(v)} vectors")
+        vectors.extend(v)
+    x = np.asarray(vectors, dtype=np.float32)
+    x /= np.linalg.norm(x, axis=1, keepdims=True)
+    protos = _kmeans(x, n_prototypes)
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    np.savez_compressed(
+        path,
+        prototypes=protos,
+        meta=json.dumps({
+            "built_at": datetime.now(timezone.utc).isoformat(),
+            "collections": {c: collection_version(c) for c in chunkers},
+            "sampled": len(x),
+        }),
+    )
+    _prototypes.cache_clear()
+    print(f"Saved {len(protos)} prototypes to: {path}")
+    return protos
+
+
+def _print_groups(title: str, questions: list[dict], values: list[float]) -> None:
+    on = np.array([v for q, v in zip(questions, values) if not q.get("expect_refusal")])
+    off = np.array([v for q, v in zip(questions, values) if q.get("expect_refusal")])
+    print(f"\n{title}")
+    print(f"{'Group':<16} {'n':>3} {'min':>6} {'median':>7} {'max':>6}")
+    print("-" * 42)
+    for name, v in (("on-topic", on), ("expect refusal", off)):
+        if len(v):
+            print(f"{name:<16} {len(v):>3} {v.min():>6.3f} {np.median(v):>7.3f} {v.max():>6.3f}")
+
+
+def _print_misses(questions: list[dict], refused: list[bool], values: list[float]) -> None:
+    for q, r, v in zip(questions, refused, values):
+        if r != bool(q.get("expect_refusal")):
+            verdict = "wrongly refused" if r else "not refused"
+            print(f"  {q['id']:<5} {v:.3f}  {verdict}: {q['question'][:55]}")
+
+
+def _print_split(questions: list[dict], values: list[float], *, higher_is_on_topic: bool) -> None:
+    sign = 1 if higher_is_on_topic else -1
+    on = [sign * v for q, v in zip(questions, values) if not q.get("expect_refusal")]
+    off = [sign * v for q, v in zip(questions, values) if q.get("expect_refusal")]
+    if not on or not off:
+        return
+    lo, hi = sorted((sign * max(off), sign * min(on)))
+    if max(off) < min(on):
+        print(f"  Separable: any threshold in ({lo:.3f}, {hi:.3f}) splits the eval set.")
+    else:
+        print(f"  Not separable: the groups overlap on ({lo:.3f}, {hi:.3f}).")
+
+
+def report(chunker: str = "token") -> None:
+    """
+    Prototype similarity and best-hit distance (in *chunker*'s collection) of
+    on-topic vs expected-refusal eval questions, against the current thresholds.
+    """
+    from src.retrieve import embed_queries, search_by_vector
+
+    questions = [json.loads(line) for line in QUESTIONS_PATH.open(encoding="utf-8") if line.strip()]
+    vectors = embed_queries([q["question"] for q in questions])
+
+    if _prototypes() is None:
+        print(f"No prototypes at {TOPIC_GATE_PATH}; build them to check the topic threshold.")
+    else:
+        sims = [topic_similarity(v) for v in vectors]
+        _print_groups("Prototype similarity (higher = more on-topic)", questions, sims)
+        print(f"\nTOPIC_GATE_MIN_SIMILARITY = {TOPIC_GATE_MIN_SIMILARITY}")
+        _print_misses(questions, [s < TOPIC_GATE_MIN_SIMILARITY for s in sims], sims)
+        _print_split(questions, sims, higher_is_on_topic=True)
+
+    best = [min((h.score for h in search_by_vector(v, k=1, chunker=chunker)), default=np.inf)
+            for v in vectors]
+    _print_groups(f"Best-hit cosine distance in {chunker} (lower = better covered)", questions, best)
+    if NO_COVERAGE_MAX_DISTANCE is None:
+        print("\nNO_COVERAGE_MAX_DISTANCE = None (coverage check off)")
+    else:
+        print(f"\nNO_COVERAGE_MAX_DISTANCE = {NO_COVERAGE_MAX_DISTANCE}")
+        _print_misses(questions, [d > NO_COVERAGE_MAX_DISTANCE for d in best], best)
+    _print_split(questions, best, higher_is_on_topic=False)
+
+
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Build the on-topic prototypes for the early-refusal gate.")
+    parser.add_argument("--chunkers", nargs="+", default=["token"],
+                        help="Collections to sample index vectors from (default: token).")
+    parser.add_argument("--prototypes", type=int, default=TOPIC_GATE_PROTOTYPES,
+                        help=f"Number of k-means prototypes (default: {TOPIC_GATE_PROTOTYPES}).")
+    parser.add_argument("--sample", type=int, default=TOPIC_GATE_SAMPLE,
+                        help=f"Vectors sampled per collection (default: {TOPIC_GATE_SAMPLE}).")
+    parser.add_argument("--report-only", action="store_true",
+                        help="Skip the build; only report eval-question similarities and distances.")
+    args = parser.parse_args()
+    if not args.report_only:
+        build(args.chunkers, args.prototypes, args.sample, Path(TOPIC_GATE_PATH))
+    report(args.chunkers[0])
@@ -0,0 +1,229 @@
+"""
+Lightweight per-request tracing.
+
+A Trace collects timed, nested spans for one question as it moves through the
+pipeline (embedding, Qdrant search, query generation, reranking, context
+building, LLM time-to-first-token …).  No external service is needed: traces
+are plain Python objects that can be rendered as a text waterfall, appended
+to a JSONL file, or — if ``opentelemetry`` is installed — replayed into the
+active OpenTelemetry tracer provider.
+
+Instrumented code just wraps a stage in ``with span("name"):``.  Spans attach
+to the trace that is active in the current context (see Trace.activate());
+with no active trace they cost a single ContextVar lookup.  Timestamps come
+from the monotonic perf_counter clock, in milliseconds since the trace began.
+
+Work handed to a thread pool keeps its parent span if submitted through
+submit(), which copies the caller's context into the worker.
+
+Streaming generators may be iterated from a different context than the one
+that created them, so they record spans after the fact with Trace.record()
+rather than entering span() across yields.
+"""
+
+from __future__ import annotations
+
+import contextvars
+import itertools
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from pathlib import Path
+
+from src.config import TRACE_JSONL_PATH, TRACE_OTEL
+
+# (active trace, id of the innermost open span or None)
+_current: contextvars.ContextVar[tuple["Trace", int | None] | None] = contextvars.ContextVar(
+    "trace_current", default=None
+)
+
+
+@dataclass
+class Span:
+    id: int
+    parent: int | None
+    name: str
+    start_ms: float
+    end_ms: float | None = None
+    attrs: dict = field(default_factory=dict)
+
+    @property
+    def duration_ms(self) -> float | None:
+        return None if self.end_ms is None else self.end_ms - self.start_ms
+
+
+class Trace:
+    """Spans for one request, timed relative to the moment the trace was created."""
+
+    def __init__(self, name: str = "request", **attrs) -> None:
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.attrs = dict(attrs)
+        self.spans: list[Span] = []
+        self.usage: list = []   # src.usage.Usage records for this request
+        self.wall_start_ns = time.time_ns()
+        self._t0 = time.perf_counter_ns()
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._finished = False
+
+    def now_ms(self) -> float:
+        return (time.perf_counter_ns() - self._t0) / 1e6
+
+    def _add(self, name: str, parent: int | None, start_ms: float, attrs: dict) -> Span:
+        s = Span(id=next(self._ids), parent=parent, name=name, start_ms=start_ms, attrs=dict(attrs))
+        with self._lock:
+            self.spans.append(s)
+        return s
+
+    @contextmanager
+    def activate(self):
+        """Make this the trace that span() records into for the enclosed block."""
+        token = _current.set((self, None))
+        try:
+            yield self
+        finally:
+            _current.reset(token)
+
+    @contextmanager
+    def span(self, name: str, **attrs):
+        """Time the enclosed block as a child of the innermost open span."""
+        cur = _current.get()
+        parent = cur[1] if cur is not None and cur[0] is self else None
+        s = self._add(name, parent, self.now_ms(), attrs)
+        token = _current.set((self, s.id))
+        try:
+            yield s
+        finally:
+            s.end_ms = self.now_ms()
+            _current.reset(token)
+
+    def add_usage(self, usage) -> None:
+        with self._lock:
+            self.usage.append(usage)
+
+    def record(self, name: str, start_ms: float, end_ms: float, parent: int | None = None, **attrs) -> Span:
+        """Add an already-timed span (for work that can't be wrapped in span())."""
+        s = self._add(name, parent, start_ms, attrs)
+        s.end_ms = end_ms
+        return s
+
+    def total_ms(self) -> float:
+        ends = [s.end_ms for s in self.spans if s.end_ms is not None]
+        return max(ends) if ends else 0.0
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.id,
+            "name": self.name,
+            "attrs": self.attrs,
+            "wall_start_ns": self.wall_start_ns,
+            "total_ms": round(self.total_ms(), 3),
+            "spans": [asdict(s) for s in sorted(self.spans, key=lambda s: s.start_ms)],
+            "usage": [asdict(u) for u in self.usage],
+        }
+
+    def stage_ms(self) -> dict[str, float]:
+        """Total milliseconds per span name (stages that run several times are summed)."""
+        out: dict[str, float] = {}
+        for s in self.spans:
+            if s.duration_ms is not None:
+                out[s.name] = round(out.get(s.name, 0.0) + s.duration_ms, 3)
+        return out
+
+    def waterfall(self, width: int = 40) -> str:
+        """Text waterfall of the spans, indented by nesting depth."""
+        total = self.total_ms() or 1.0
+        depth: dict[int, int] = {}
+        lines = []
+        for s in sorted(self.spans, key=lambda s: (s.start_ms, s.id)):
+            depth[s.id] = depth.get(s.parent, -1) + 1 if s.parent is not None else 0
+            end = s.end_ms if s.end_ms is not None else s.start_ms
+            lo = round(s.start_ms / total * width)
+            hi = max(lo + 1, round(end / total * width))
+            bar = " " * lo + "█" * (hi - lo)
+            label = ("  " * depth[s.id] + s.name)[:28]
+            lines.append(f"{label:<28} {bar:<{width}} {end - s.start_ms:8.1f} ms")
+        return "\n".join(lines)
+
+    @property
+    def finished(self) -> bool:
+        return self._finished
+
+    def finish(self) -> bool:
+        """
+        Export the trace (JSONL / OpenTelemetry, per config).  Idempotent:
+        returns True only for the call that actually finished it.
+        """
+        with self._lock:
+            if self._finished:
+                return False
+            self._finished = True
+        if TRACE_JSONL_PATH:
+            export_jsonl(self, Path(TRACE_JSONL_PATH))
+        if TRACE_OTEL:
+            export_otel(self)
+        return True
+
+
+# ── Instrumentation helpers ───────────────────────────────────────────────────
+
+def current() -> Trace | None:
+    cur = _current.get()
+    return cur[0] if cur is not None else None
+
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time the enclosed block in the active trace; a no-op when none is active."""
+    cur = _current.get()
+    if cur is None:
+        yield None
+        return
+    with cur[0].span(name, **attrs) as s:
+        yield s
+
+
+def submit(executor, fn, *args, **kwargs):
+    """executor.submit() that carries the active trace and parent span into the worker."""
+    ctx = contextvars.copy_context()
+    return executor.submit(ctx.run, fn, *args, **kwargs)
+
+
+# ── Export ────────────────────────────────────────────────────────────────────
+
+_export_lock = threading.Lock()
+
+
+def export_jsonl(trace: Trace, path: Path) -> None:
+    with _export_lock:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(trace.to_dict(), ensure_ascii=False) + "\n")
+
+
+def export_otel(trace: Trace) -> None:
+    """Replay *trace* into the configured OpenTelemetry tracer (if installed)."""
+    try:
+        from opentelemetry import trace as otel
+    except ImportError:
+        print("TRACE_OTEL is set but opentelemetry is not installed; skipping export.")
+        return
+
+    tracer = otel.get_tracer("ml-wikitutor-rag")
+
+    def ns(ms: float) -> int:
+        return trace.wall_start_ns + int(ms * 1e6)
+
+    root = tracer.start_span(trace.name, start_time=trace.wall_start_ns, attributes=trace.attrs)
+    otel_spans = {None: root}
+    for s in sorted(trace.spans, key=lambda s: (s.start_ms, s.id)):
+        parent_ctx = otel.set_span_in_context(otel_spans.get(s.parent, root))
+        attrs = {k: v for k, v in s.attrs.items() if isinstance(v, (str, bool, int, float))}
+        otel_spans[s.id] = tracer.start_span(s.name, context=parent_ctx, start_time=ns(s.start_ms), attributes=attrs)
+    for s in trace.spans:
+        otel_spans[s.id].end(end_time=ns(s.end_ms if s.end_ms is not None else s.start_ms))
+    root.end(end_time=ns(trace.total_ms()))
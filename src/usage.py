@@ -0,0 +1,188 @@
+"""
+Token usage and cost accounting.
+
+Every model call in the pipeline — query embedding, batched embeddings,
+multi-query rephrasing, answer generation — reports its token counts through
+record().  Each record is attached to the request's active Trace (see
+tracing.py) and added to process-wide totals, so spend can be attributed per
+call, per request and per process.
+
+Chat models report prompt / completion / cached-prompt tokens themselves
+(LangChain usage_metadata, including on the final streamed chunk).  The
+embeddings API response isn't surfaced by LangChain, so embedding tokens are
+counted locally with the same cl100k_base encoding the embedding models use.
+For calls made inside an open trace that count is deferred: record(texts=...)
+keeps the inputs, and settle() tokenises them when the usage is summarised
+(e.g. as the request log is written), so the request path never waits on
+tiktoken.  Calls outside a trace are counted immediately, so no inputs are
+held for a summary that may never come.
+
+Costs use the per-model prices in config.TOKEN_PRICES_PER_1M; models missing
+from that table are counted but priced at zero.
+"""
+
+from __future__ import annotations
+
+import threading
+from collections import Counter
+from dataclasses import dataclass
+
+from src import tracing
+from src.config import TOKEN_PRICES_PER_1M
+
+_COUNT_FIELDS = ("prompt_tokens", "completion_tokens", "cached_tokens")
+
+
+@dataclass
+class Usage:
+    """Token counts and cost of one model call."""
+    component: str
+    model: str
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    cost_usd: float = 0.0
+
+
+def cost_usd(model: str, prompt_tokens: int, completion_tokens: int = 0, cached_tokens: int = 0) -> float:
+    """Price a call; cached prompt tokens are billed at the cached rate."""
+    prompt_price, cached_price, completion_price = TOKEN_PRICES_PER_1M.get(model, (0.0, 0.0, 0.0))
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    return (
+        uncached * prompt_price
+        + cached_tokens * cached_price
+        + completion_tokens * completion_price
+    ) / 1_000_000
+
+
+def from_llm_metadata(meta: dict | None) -> dict:
+    """Prompt / completion / cached-prompt token counts from LangChain usage_metadata."""
+    meta = meta or {}
+    details = meta.get("input_token_details") or {}
+    return {
+        "prompt_tokens": meta.get("input_tokens", 0),
+        "completion_tokens": meta.get("output_tokens", 0),
+        "cached_tokens": details.get("cache_read", 0) or 0,
+    }
+
+
+_enc = None
+
+
+def count_tokens(texts: list[str]) -> int:
+    """Total cl100k_base tokens in *texts* (used for embedding calls)."""
+    global _enc
+    if _enc is None:
+        import tiktoken
+        _enc = tiktoken.get_encoding("cl100k_base")
+    return sum(len(_enc.encode(t or "")) for t in texts)
+
+
+# ── Recording ─────────────────────────────────────────────────────────────────
+
+_totals: dict[tuple[str, str], Counter] = {}
+_totals_lock = threading.Lock()
+
+# Embedding records of open traces whose input tokens have not been counted yet, by id()
+_uncounted: dict[int, tuple[Usage, list[str]]] = {}
+_settle_lock = threading.Lock()   # serialises counting, so a record is counted once
+
+
+def record(
+    component: str,
+    model: str,
+    *,
+    prompt_tokens: int = 0,
+    completion_tokens: int = 0,
+    cached_tokens: int = 0,
+    texts: list[str] | None = None,
+    trace: tracing.Trace | None = None,
+) -> Usage:
+    """
+    Record one model call against *trace* (default: the active trace) and the
+    process totals.  A trace that has already been finished is left alone.
+    With *texts* (embedding inputs), their tokens are added to prompt_tokens
+    later by settle() when the record joins an open trace, and right away
+    otherwise.
+    """
+    trace = trace or tracing.current()
+    traced = trace is not None and not trace.finished
+    if texts and not traced:
+        prompt_tokens += count_tokens(texts)
+        texts = None
+    u = Usage(
+        component=component,
+        model=model,
+        prompt_tokens=prompt_tokens,
+        completion_tokens=completion_tokens,
+        cached_tokens=cached_tokens,
+        cost_usd=cost_usd(model, prompt_tokens, completion_tokens, cached_tokens),
+    )
+    if traced:
+        trace.add_usage(u)
+    with _totals_lock:
+        c = _totals.setdefault((component, model), Counter())
+        c["calls"] += 1
+        for f in _COUNT_FIELDS:
+            c[f] += getattr(u, f)
+        c["cost_usd"] += u.cost_usd
+        if texts:
+            _uncounted[id(u)] = (u, list(texts))
+    return u
+
+
+def settle(records: list[Usage]) -> None:
+    """Count the deferred embedding tokens of *records* (no-op for counted ones)."""
+    with _settle_lock:
+        with _totals_lock:
+            pending = [_uncounted.pop(id(u)) for u in records if id(u) in _uncounted]
+        for u, texts in pending:
+            n = count_tokens(texts)
+            before = u.cost_usd
+            u.prompt_tokens += n
+            u.cost_usd = cost_usd(u.model, u.prompt_tokens, u.completion_tokens, u.cached_tokens)
+            with _totals_lock:
+                c = _totals[(u.component, u.model)]
+                c["prompt_tokens"] += n
+                c["cost_usd"] += u.cost_usd - before
+
+
+def summarise(records: list[Usage]) -> dict:
+    """Aggregate usage records into per-component and overall totals."""
+    settle(records)
+    by_component: dict[str, Counter] = {}
+    for u in records:
+        c = by_component.setdefault(u.component, Counter())
+        c["calls"] += 1
+        for f in _COUNT_FIELDS:
+            c[f] += getattr(u, f)
+        c["cost_usd"] += u.cost_usd
+    return _with_total(by_component)
+
+
+def process_totals() -> dict:
+    """Usage aggregated over every call made by this process so far."""
+    with _totals_lock:
+        pending = [u for u, _texts in _uncounted.values()]
+    settle(pending)
+    by_component: dict[str, Counter] = {}
+    with _totals_lock:
+        for (component, _model), c in _totals.items():
+            by_component.setdefault(component, Counter()).update(c)
+    return _with_total(by_component)
+
+
+def _fmt(c: Counter) -> dict:
+    out = {k: int(c[k]) for k in ("calls", *_COUNT_FIELDS)}
+    out["cost_usd"] = round(c["cost_usd"], 8)
+    return out
+
+
+def _with_total(by_component: dict[str, Counter]) -> dict:
+    total: Counter = Counter()
+    for c in by_component.values():
+        total.update(c)
+    return {
+        "by_component": {name: _fmt(c) for name, c in sorted(by_component.items())},
+        "total": _fmt(total),
+    }
@@ -6,10 +6,13 @@ this file and the indexing script.
 """
 from __future__ import annotations
 
+import uuid
 from dataclasses import dataclass, field
+from datetime import datetime, timezone
 
-from qdrant_client import QdrantClient
-from qdrant_client.models import Distance, PointStruct, VectorParams
+from src import cassette
+
+from qdrant_client.models import Distance, Filter, HasIdCondition, PointStruct, VectorParams
 
 # Maps chunking strategy names to Qdrant collection names.
 COLLECTION_NAMES = {
@@ -20,6 +23,33 @@ COLLECTION_NAMES = {
 
 EMBEDDING_DIM = 1536  # text-embedding-3-small output dimension
 
+BUILD_ID_KEY = "build_id"   # collection metadata key written by mark_build()
+
+
+def point_id(chunk_record_id: str) -> str:
+    """Deterministic Qdrant point id for a chunks.jsonl record id."""
+    return str(uuid.uuid5(uuid.NAMESPACE_DNS, str(chunk_record_id)))
+
+
+def chunk_payload(r: dict) -> dict:
+    """
+    Qdrant payload for a chunks.jsonl record (also the shape of Hit.fields).
+
+    ``text_tokens`` / ``parent_text_tokens`` are cl100k token counts filled in
+    by index_qdrant.py so the context builder never has to tokenise online;
+    they are None for records that don't carry them.
+    """
+    return {
+        "text": r["text"],
+        "title": r.get("title"),
+        "section": r.get("section"),
+        "source_url": r.get("source_url"),
+        "chunk_id": str(r.get("chunk_index")),
+        "parent_text": r.get("parent_text"),
+        "text_tokens": r.get("text_tokens"),
+        "parent_text_tokens": r.get("parent_text_tokens"),
+    }
+
 
 @dataclass
 class Hit:
@@ -30,19 +60,37 @@ class Hit:
     similar.  Converting Qdrant's similarity scores to distances preserves
     full compatibility with the confidence heuristics in rag.py, which were
     originally tuned for this "lower is better" convention.
+
+    ``fused_score`` is set only on hits produced by src.fusion and
+    ``rerank_score`` only on hits scored by src.rerank (both higher = better).
+    When present they take precedence over ``score`` for ranking.
     """
 
     id: str
     score: float          # cosine distance; lower = more similar
     fields: dict = field(default_factory=dict)
+    fused_score: float | None = None
+    rerank_score: float | None = None
+    vector: list[float] | None = None   # only populated when searched with_vectors=True
 
 
 class QdrantVectorStore:
     """Thin wrapper around QdrantClient for upsert and similarity search."""
 
-    def __init__(self, url: str, api_key: str, collection_name: str) -> None:
-        self._client = QdrantClient(url=url, api_key=api_key)
+    def __init__(self, url: str | None, api_key: str | None, collection_name: str) -> None:
+        # QdrantClient, or its record / replay stand-in (see cassette.py)
+        self._client = cassette.qdrant_client(url=url, api_key=api_key)
+        self._url, self._api_key = url, api_key
+        self._aclient = None   # AsyncQdrantClient, created on first async call
         self._collection_name = collection_name
+        self._version: str | None = None
+
+    @property
+    def aclient(self):
+        """AsyncQdrantClient (or its stand-in) for the async methods below."""
+        if self._aclient is None:
+            self._aclient = cassette.async_qdrant_client(url=self._url, api_key=self._api_key)
+        return self._aclient
 
     def create_collection_if_not_exists(self, vector_size: int = EMBEDDING_DIM) -> None:
         """Create the Qdrant collection if it does not already exist."""
@@ -56,30 +104,152 @@ class QdrantVectorStore:
         else:
             print(f"Qdrant collection already exists: {self._collection_name}")
 
+    def mark_build(self, build_id: str | None = None) -> str:
+        """
+        Stamp the collection metadata with a new index build id (default: a
+        UTC timestamp).  index_qdrant.py calls this after every (re)index, so
+        collection_version() changes even when the point count does not.
+        """
+        build_id = build_id or datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+        self._client.update_collection(
+            collection_name=self._collection_name,
+            metadata={BUILD_ID_KEY: build_id},
+        )
+        self._version = None
+        return build_id
+
+    def _version_of(self, info) -> str:
+        metadata = info.config.metadata or {}
+        build = metadata.get(BUILD_ID_KEY) or f"n={info.points_count}"   # pre-build-id indexes
+        return f"{self._collection_name}:{build}"
+
+    def collection_version(self) -> str:
+        """
+        Identifier for the current build of the collection.
+
+        The collection name plus the build id stamped by mark_build(), fetched
+        once per store instance (collections indexed before build ids fall
+        back to the point count).  Used to key caches so answers computed
+        against an older index are not reused after a rebuild.
+        """
+        if self._version is None:
+            info = self._client.get_collection(collection_name=self._collection_name)
+            self._version = self._version_of(info)
+        return self._version
+
+    async def acollection_version(self) -> str:
+        """Async collection_version()."""
+        if self._version is None:
+            info = await self.aclient.get_collection(collection_name=self._collection_name)
+            self._version = self._version_of(info)
+        return self._version
+
+    async def apoints_count(self) -> int:
+        """Live point count of the collection (not cached; used by readiness probes)."""
+        info = await self.aclient.get_collection(collection_name=self._collection_name)
+        return info.points_count or 0
+
     def upsert(self, points: list[PointStruct]) -> None:
         """Upsert a batch of PointStructs into the collection."""
         self._client.upsert(collection_name=self._collection_name, points=points)
 
-    def search(self, query_vector: list[float], k: int) -> list[Hit]:
+    def sample_vectors(self, limit: int) -> list[list[float]]:
+        """Return up to *limit* stored embeddings, scrolling in page order."""
+        vectors: list[list[float]] = []
+        offset = None
+        while len(vectors) < limit:
+            points, offset = self._client.scroll(
+                collection_name=self._collection_name,
+                limit=min(256, limit - len(vectors)),
+                offset=offset,
+                with_payload=False,
+                with_vectors=True,
+            )
+            vectors.extend(p.vector for p in points)
+            if offset is None:
+                break
+        return vectors
+
+    def score_ids(self, query_vector: list[float], ids: list[str]) -> dict[str, float]:
+        """
+        Return the cosine distance from *query_vector* to each point in *ids*.
+
+        Used to give hits found by other retrievers (e.g. BM25) a cosine
+        distance comparable with dense hits.
+        """
+        return {h.id: h.score for h in self.search_ids(query_vector, ids)}
+
+    async def ascore_ids(self, query_vector: list[float], ids: list[str]) -> dict[str, float]:
+        """Async score_ids()."""
+        return {h.id: h.score for h in await self.asearch_ids(query_vector, ids)}
+
+    def search_ids(self, query_vector: list[float], ids: list[str], with_vectors: bool = False) -> list[Hit]:
+        """
+        The points in *ids* as Hits scored against *query_vector* (payload
+        omitted).  With ``with_vectors=True`` they carry their embeddings, so
+        hits found by other retrievers can take part in MMR.
+        """
+        if not ids:
+            return []
+        response = self._client.query_points(**self._search_ids_query(query_vector, ids, with_vectors))
+        return self._to_hits(response, with_vectors)
+
+    async def asearch_ids(self, query_vector: list[float], ids: list[str], with_vectors: bool = False) -> list[Hit]:
+        """Async search_ids()."""
+        if not ids:
+            return []
+        response = await self.aclient.query_points(**self._search_ids_query(query_vector, ids, with_vectors))
+        return self._to_hits(response, with_vectors)
+
+    def _search_ids_query(self, query_vector: list[float], ids: list[str], with_vectors: bool) -> dict:
+        query = dict(
+            collection_name=self._collection_name,
+            query=query_vector,
+            query_filter=Filter(must=[HasIdCondition(has_id=list(ids))]),
+            limit=len(ids),
+            with_payload=False,
+        )
+        if with_vectors:   # only when asked, so recorded score-only calls still replay
+            query["with_vectors"] = True
+        return query
+
+    def search(self, query_vector: list[float], k: int, with_vectors: bool = False) -> list[Hit]:
         """
         Return the top-k most similar points as Hit objects.
 
+        With ``with_vectors=True`` each Hit also carries its stored embedding
+        (used for MMR diversification in rag.py).
+
         Qdrant returns cosine *similarity* scores in [0, 1] (higher = more
         similar).  We convert to cosine *distance* (1 - score) so the rest of
         the pipeline treats lower scores as better, matching the convention
         used throughout rag.py and config.py.
         """
-        response = self._client.query_points(
+        response = self._client.query_points(**self._search_query(query_vector, k, with_vectors))
+        return self._to_hits(response, with_vectors)
+
+    async def asearch(self, query_vector: list[float], k: int, with_vectors: bool = False) -> list[Hit]:
+        """Async search()."""
+        response = await self.aclient.query_points(**self._search_query(query_vector, k, with_vectors))
+        return self._to_hits(response, with_vectors)
+
+    def _search_query(self, query_vector: list[float], k: int, with_vectors: bool) -> dict:
+        return dict(
             collection_name=self._collection_name,
             query=query_vector,
             limit=k,
             with_payload=True,
+            with_vectors=with_vectors,
         )
+
+    @staticmethod
+    def _to_hits(response, with_vectors: bool) -> list[Hit]:
         return [
             Hit(
                 id=str(r.id),
                 score=1.0 - r.score,  # similarity → distance (lower = more similar)
                 fields=r.payload or {},
+                vector=r.vector if with_vectors else None,
             )
             for r in response.points
         ]
@@ -0,0 +1,53 @@
+"""
+Tests for src.fusion.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import unittest
+
+from src.fusion import fuse
+from src.vector_store import Hit
+
+
+def _dense(id_, score, vector=None):
+    return Hit(id=id_, score=score, fields={"text": f"qdrant {id_}", "title": "Dense"}, vector=vector)
+
+
+def _lexical(id_, bm25):
+    # Shape of src.bm25.BM25Index.search() hits: negated score, fields from chunks.jsonl
+    return Hit(id=id_, score=-bm25, fields={"text": f"chunks {id_}", "title": "Lexical", "bm25": bm25})
+
+
+class FuseDenseLexicalTest(unittest.TestCase):
+    def setUp(self):
+        self.dense = [_dense("a", 0.20, [1.0, 0.0]), _dense("b", 0.30, [0.0, 1.0])]
+        self.lexical = [_lexical("a", 12.0), _lexical("c", 8.0)]
+
+    def test_shared_chunk_keeps_dense_copy(self):
+        for method in ("rrf", "combsum", "combmnz", "max"):
+            for lists in ([self.dense, self.lexical], [self.lexical, self.dense]):
+                with self.subTest(method=method, first=lists[0][0].fields["title"]):
+                    a = {h.id: h for h in fuse(lists, method)}["a"]
+                    self.assertEqual(a.score, 0.20)
+                    self.assertEqual(a.vector, [1.0, 0.0])
+                    self.assertEqual(a.fields["text"], "qdrant a")
+                    self.assertIsNotNone(a.fused_score)
+
+    def test_lexical_only_chunk_is_kept(self):
+        fused = {h.id: h for h in fuse([self.dense, self.lexical])}
+        self.assertEqual(set(fused), {"a", "b", "c"})
+        self.assertEqual(fused["c"].fields["bm25"], 8.0)
+        self.assertIsNone(fused["c"].vector)
+
+    def test_agreement_ranks_first(self):
+        self.assertEqual(fuse([self.dense, self.lexical])[0].id, "a")
+
+    def test_dense_copies_keep_a_vector(self):
+        fused = fuse([[_dense("a", 0.1)], [_dense("a", 0.2, [1.0, 0.0])]])
+        self.assertEqual((fused[0].score, fused[0].vector), (0.1, [1.0, 0.0]))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+"""
+Hybrid (dense + BM25) retrieval feeding MMR selection.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")   # clients are built at import; never called here
+
+from src import retrieve
+from src.vector_store import Hit
+
+QV = [1.0, 0.0, 0.0]
+VECTORS = {"a": [1.0, 0.0, 0.0], "b": [0.0, 1.0, 0.0], "c": [0.99, 0.1, 0.0]}   # c ≈ a
+
+
+class _Store:
+    """Dense side: a and b from the search, c only via search_ids()."""
+
+    def search(self, query_vector, k, with_vectors=False):
+        return [
+            Hit(id=i, score=d, fields={"title": i.upper()}, vector=VECTORS[i] if with_vectors else None)
+            for i, d in (("a", 0.1), ("b", 0.5))
+        ][:k]
+
+    def search_ids(self, query_vector, ids, with_vectors=False):
+        return [Hit(id=i, score=0.12, vector=VECTORS[i] if with_vectors else None) for i in ids]
+
+
+def _bm25(query, k, chunker):
+    return [
+        Hit(id=i, score=-s, fields={"title": i.upper(), "bm25": s})
+        for i, s in (("c", 14.0), ("a", 12.0))
+    ]
+
+
+def _hybrid(with_vectors: bool) -> list:
+    with mock.patch.object(retrieve, "_get_store", return_value=_Store()), \
+         mock.patch.object(retrieve.bm25, "search", _bm25):
+        return retrieve.search_hybrid("q", k=3, fusion="rrf", with_vectors=with_vectors, query_vector=QV)
+
+
+class HybridVectorsTest(unittest.TestCase):
+    def test_every_hit_carries_a_vector(self):
+        hits = _hybrid(with_vectors=True)
+        self.assertEqual([h.id for h in hits], ["a", "c", "b"])
+        self.assertEqual({h.id: h.vector for h in hits}, VECTORS)
+        self.assertEqual({h.id: h.score for h in hits}, {"a": 0.1, "c": 0.12, "b": 0.5})
+        self.assertNotIn("bm25", hits[0].fields)   # shared chunk keeps the Qdrant payload
+
+    def test_without_vectors(self):
+        self.assertTrue(all(h.vector is None for h in _hybrid(with_vectors=False)))
+
+
+class HybridMMRTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from src import rag
+        except Exception as e:   # rag loads the cl100k tokenizer at import
+            raise unittest.SkipTest(f"src.rag unavailable: {type(e).__name__}")
+        cls.rag = rag
+
+    def test_mmr_penalises_lexical_near_duplicate(self):
+        selected = self.rag._select_mmr_hits(_hybrid(with_vectors=True), lam=0.5, max_total=2)
+        self.assertEqual([h.id for h in selected], ["a", "b"])
+
+    def test_mmr_skipped_when_a_vector_is_missing(self):
+        hits = _hybrid(with_vectors=False)
+        with mock.patch.object(self.rag, "_select_mmr_hits") as mmr:
+            self.rag._build_from_hits("q", hits, use_mmr=True)
+        mmr.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,68 @@
+"""
+Tests for src.retrieve_multiquery when embedding the variant queries fails.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import asyncio
+import os
+import threading
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")   # clients are built at import; never called here
+
+from src import retrieve_multiquery as mq
+
+QUERIES = ["q", "variant one", "variant two"]
+
+
+def _embed_fails(texts):
+    raise RuntimeError("embedding failed")
+
+
+async def _aembed_fails(texts):
+    await asyncio.sleep(0)   # let the original search start
+    raise RuntimeError("embedding failed")
+
+
+class SyncVariantEmbedErrorTest(unittest.TestCase):
+    def test_error_propagates_without_waiting_on_the_search(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def search(*args, **kwargs):
+            release.wait(5)
+            return []
+
+        with mock.patch.object(mq, "search", search), \
+             mock.patch.object(mq, "embed_queries", _embed_fails):
+            with self.assertRaisesRegex(RuntimeError, "embedding failed"):
+                mq.search_multiquery("q", queries=QUERIES, verbose=False)
+
+
+class AsyncVariantEmbedErrorTest(unittest.IsolatedAsyncioTestCase):
+    async def test_original_search_is_cancelled_and_awaited(self):
+        log, loop_errors = [], []
+        asyncio.get_running_loop().set_exception_handler(lambda loop, ctx: loop_errors.append(ctx))
+
+        async def asearch(*args, **kwargs):
+            try:
+                await asyncio.sleep(5)
+            except asyncio.CancelledError:
+                log.append("cancelled")
+                raise
+            return []
+
+        with mock.patch.object(mq, "asearch", asearch), \
+             mock.patch.object(mq, "aembed_queries", _aembed_fails):
+            with self.assertRaisesRegex(RuntimeError, "embedding failed"):
+                await mq.asearch_multiquery("q", queries=QUERIES, verbose=False)
+
+        self.assertEqual(log, ["cancelled"])
+        self.assertEqual(loop_errors, [])
+
+
+if __name__ == "__main__":
+    unittest.main()
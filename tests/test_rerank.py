@@ -0,0 +1,63 @@
+"""
+Tests for the src.rerank score cache.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import unittest
+from unittest import mock
+
+from src import rerank
+from src.vector_store import Hit
+
+
+class _Scorer:
+    """Scores a passage by its length and records every passage it scored."""
+
+    def __init__(self):
+        self.scored = []
+
+    def score(self, query, passages):
+        self.scored.extend(passages)
+        return [float(len(p)) for p in passages]
+
+
+def _hit(id, chunker, text):
+    return Hit(id=id, score=0.1, fields={"chunker": chunker, "text": text})
+
+
+class ScoreCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.scorer = _Scorer()
+        for patcher in (
+            mock.patch.object(rerank, "_get_scorer", return_value=self.scorer),
+            mock.patch.object(rerank, "RERANK_CACHE_SIZE", 2),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        rerank.clear_cache()
+        self.addCleanup(rerank.clear_cache)
+
+    def test_same_id_in_two_collections_is_scored_separately(self):
+        token, section = _hit("7", "token", "short"), _hit("7", "section", "a longer passage")
+        rerank.rerank("q", [token])
+        out = rerank.rerank("q", [token, section])
+
+        self.assertEqual(self.scorer.scored, ["short", "a longer passage"])
+        self.assertEqual([h.fields["chunker"] for h in out], ["section", "token"])
+        self.assertEqual([h.rerank_score for h in out], [16.0, 5.0])
+
+    def test_eviction_is_least_recently_used(self):
+        a, b, c = _hit("a", "token", "aa"), _hit("b", "token", "bb"), _hit("c", "token", "cc")
+        rerank.rerank("q", [a, b])
+        rerank.rerank("q", [a])      # a is now more recent than b
+        rerank.rerank("q", [c])      # evicts b, not a
+        self.scorer.scored.clear()
+
+        rerank.rerank("q", [a, b])
+        self.assertEqual(self.scorer.scored, ["bb"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,283 @@
+"""
+Tests for src.singleflight.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import asyncio
+import contextlib
+import threading
+import unittest
+from unittest import mock
+
+from src import singleflight
+
+
+def _tokens(text, log, fail_at=None):
+    """Source iterator over *text*; records 'closed' in *log* when closed."""
+    try:
+        for i, token in enumerate(text):
+            if i == fail_at:
+                raise ValueError("source failed")
+            yield token
+    finally:
+        log.append("closed")
+
+
+async def _atokens(text, log, fail_at=None, gate=None):
+    try:
+        for i, token in enumerate(text):
+            if gate is not None:
+                await gate.wait()
+            if i == fail_at:
+                raise ValueError("source failed")
+            yield token
+            await asyncio.sleep(0)
+    finally:
+        log.append("closed")
+
+
+class SingleFlightTest(unittest.TestCase):
+    def test_fan_out(self):
+        flight = singleflight.SingleFlight()
+        started, release, calls, results = threading.Event(), threading.Event(), [], []
+        waiting = threading.Semaphore(0)
+
+        def fn():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return "answer"
+
+        def call():
+            results.append(flight.do("q", fn))
+
+        @contextlib.contextmanager
+        def wait_span(name):
+            waiting.release()   # a follower has joined the call in flight
+            yield
+
+        threads = [threading.Thread(target=call) for _ in range(8)]
+        with mock.patch.object(singleflight.tracing, "span", wait_span):
+            threads[0].start()
+            started.wait(5)
+            for t in threads[1:]:
+                t.start()
+            for _ in threads[1:]:
+                waiting.acquire(timeout=5)
+            release.set()
+            for t in threads:
+                t.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual({r for r, _ in results}, {"answer"})
+        self.assertEqual(sorted(shared for _, shared in results), [False] + [True] * 7)
+        self.assertEqual(flight._calls, {})
+
+    def test_leader_error_reaches_followers(self):
+        flight = singleflight.SingleFlight()
+        started, release, errors = threading.Event(), threading.Event(), []
+
+        def fn():
+            started.set()
+            release.wait(5)
+            raise ValueError("boom")
+
+        def call():
+            try:
+                flight.do("q", fn)
+            except ValueError as e:
+                errors.append(e)
+
+        @contextlib.contextmanager
+        def wait_span(name):
+            joined.set()
+            yield
+
+        joined = threading.Event()
+        leader, follower = threading.Thread(target=call), threading.Thread(target=call)
+        with mock.patch.object(singleflight.tracing, "span", wait_span):
+            leader.start()
+            started.wait(5)
+            follower.start()
+            joined.wait(5)
+            release.set()
+            leader.join(5)
+            follower.join(5)
+
+        self.assertEqual(len(errors), 2)
+        self.assertIs(errors[0], errors[1])
+        self.assertEqual(flight._calls, {})
+        self.assertEqual(flight.do("q", lambda: "fresh"), ("fresh", False))
+
+
+class StreamGroupTest(unittest.TestCase):
+    def test_fan_out(self):
+        group, log, sources = singleflight.StreamGroup(), [], []
+
+        def make_source(members):
+            sources.append(members)
+            return _tokens("abcd", log)
+
+        first, shared_first = group.subscribe("q", make_source, "t1")
+        self.assertEqual(next(first), "a")
+        second, shared_second = group.subscribe("q", make_source, "t2")
+
+        self.assertEqual("".join(second), "abcd")
+        self.assertEqual("a" + "".join(first), "abcd")
+        self.assertEqual((shared_first, shared_second), (False, True))
+        self.assertEqual(sources, [["t1", "t2"]])
+        self.assertEqual(group._streams, {})
+
+    def test_last_subscriber_abandoning_closes_source(self):
+        group, log = singleflight.StreamGroup(), []
+        first, _ = group.subscribe("q", lambda m: _tokens("abcd", log))
+        second, _ = group.subscribe("q", lambda m: _tokens("abcd", log))
+        next(first)
+        next(second)
+
+        first.close()
+        self.assertEqual(log, [])   # second is still reading
+        self.assertEqual(next(second), "b")
+        second.close()
+        self.assertEqual(log, ["closed"])
+        self.assertEqual(group._streams, {})
+
+        third, shared = group.subscribe("q", lambda m: _tokens("xy", log))
+        self.assertFalse(shared)
+        self.assertEqual("".join(third), "xy")
+
+    def test_source_error_reaches_every_subscriber(self):
+        group, log = singleflight.StreamGroup(), []
+        first, _ = group.subscribe("q", lambda m: _tokens("abcd", log, fail_at=2))
+        second, _ = group.subscribe("q", lambda m: _tokens("abcd", log, fail_at=2))
+
+        for stream in (first, second):
+            with self.assertRaisesRegex(ValueError, "source failed"):
+                list(stream)
+        self.assertEqual(group._streams, {})
+
+
+class AsyncSingleFlightTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fan_out(self):
+        flight, calls = singleflight.AsyncSingleFlight(), []
+        release = asyncio.Event()
+
+        async def fn():
+            calls.append(1)
+            await release.wait()
+            return "answer"
+
+        tasks = [asyncio.create_task(flight.do("q", fn)) for _ in range(5)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(results, [("answer", False)] + [("answer", True)] * 4)
+        self.assertEqual(flight._tasks, {})
+
+    async def test_leader_error_reaches_followers(self):
+        flight, release = singleflight.AsyncSingleFlight(), asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            raise ValueError("boom")
+
+        tasks = [asyncio.create_task(flight.do("q", fn)) for _ in range(3)]
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(*tasks, return_exceptions=True)
+
+        self.assertTrue(all(isinstance(r, ValueError) for r in results))
+        self.assertEqual(flight._tasks, {})
+
+    async def test_cancelled_follower_does_not_cancel_the_call(self):
+        flight, release = singleflight.AsyncSingleFlight(), asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "answer"
+
+        leader = asyncio.create_task(flight.do("q", fn))
+        follower = asyncio.create_task(flight.do("q", fn))
+        await asyncio.sleep(0)
+        follower.cancel()
+        await asyncio.sleep(0)
+        release.set()
+
+        self.assertEqual(await leader, ("answer", False))
+        with self.assertRaises(asyncio.CancelledError):
+            await follower
+
+
+class AsyncStreamGroupTest(unittest.IsolatedAsyncioTestCase):
+    async def test_fan_out(self):
+        group, log = singleflight.AsyncStreamGroup(), []
+        gate = asyncio.Event()
+
+        async def read(stream):
+            return "".join([token async for token in stream])
+
+        streams = [group.subscribe("q", lambda m: _atokens("abcd", log, gate=gate)) for _ in range(3)]
+        readers = [asyncio.create_task(read(s)) for s, _ in streams]
+        gate.set()
+
+        self.assertEqual(await asyncio.gather(*readers), ["abcd"] * 3)
+        self.assertEqual([shared for _, shared in streams], [False, True, True])
+        self.assertEqual(log, ["closed"])
+        self.assertEqual(group._streams, {})
+
+    async def test_last_subscriber_abandoning_closes_source(self):
+        group, log = singleflight.AsyncStreamGroup(), []
+        gate = asyncio.Event()
+        stream, _ = group.subscribe("q", lambda m: _atokens("abcd", log, gate=gate))
+
+        async def first_token():
+            async for token in stream:
+                return token
+
+        reader = asyncio.create_task(first_token())
+        gate.set()
+        self.assertEqual(await reader, "a")
+        await stream.aclose()
+        await asyncio.sleep(0)
+
+        self.assertEqual(log, ["closed"])
+        self.assertEqual(group._streams, {})
+
+    async def test_source_error_reaches_every_subscriber(self):
+        group, log = singleflight.AsyncStreamGroup(), []
+        streams = [group.subscribe("q", lambda m: _atokens("abcd", log, fail_at=2)) for _ in range(2)]
+
+        for stream, _ in streams:
+            with self.assertRaisesRegex(ValueError, "source failed"):
+                async for _token in stream:
+                    pass
+        self.assertEqual(group._streams, {})
+
+    async def test_cancelled_follower_does_not_stop_the_stream(self):
+        group, log = singleflight.AsyncStreamGroup(), []
+        gate = asyncio.Event()
+
+        async def read(stream):
+            return "".join([token async for token in stream])
+
+        leader, _ = group.subscribe("q", lambda m: _atokens("abcd", log, gate=gate))
+        follower, shared = group.subscribe("q", lambda m: _atokens("abcd", log, gate=gate))
+        leading = asyncio.create_task(read(leader))
+        following = asyncio.create_task(read(follower))
+        await asyncio.sleep(0)
+        following.cancel()
+        gate.set()
+
+        self.assertTrue(shared)
+        self.assertEqual(await leading, "abcd")
+        with self.assertRaises(asyncio.CancelledError):
+            await following
+        self.assertEqual(log, ["closed"])
+
+
+if __name__ == "__main__":
+    unittest.main()
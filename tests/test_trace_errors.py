@@ -0,0 +1,81 @@
+"""
+Traces are finished, with an error attribute, when retrieval raises before
+an answer stream is handed back.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import os
+import unittest
+from unittest import mock
+
+os.environ.setdefault("OPENAI_API_KEY", "test")   # clients are built at import; never called here
+
+from src.tracing import Trace
+
+
+def _fail(*args, **kwargs):
+    raise RuntimeError("qdrant down")
+
+
+async def _afail(*args, **kwargs):
+    raise RuntimeError("qdrant down")
+
+
+class _RagTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        try:
+            from src import rag
+        except Exception as e:   # rag loads the cl100k tokenizer at import
+            raise unittest.SkipTest(f"src.rag unavailable: {type(e).__name__}")
+        cls.rag = rag
+
+    def setUp(self):
+        self.logged = []
+        for patcher in (
+            mock.patch.object(self.rag, "_answer_cache", None),
+            mock.patch.object(self.rag, "_retrieve", _fail),
+            mock.patch.object(self.rag, "_aretrieve", _afail),
+            mock.patch.object(self.rag.request_log, "append", self.logged.append),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def assertFinishedWithError(self, trace):
+        self.assertTrue(trace.finished)
+        self.assertEqual(trace.attrs["error"], "RuntimeError")
+        self.assertEqual([r["trace_id"] for r in self.logged], [trace.id])
+
+
+class SyncRetrievalErrorTest(_RagTest):
+    def test_stream_answer(self):
+        trace = Trace()
+        with self.assertRaisesRegex(RuntimeError, "qdrant down"):
+            self.rag.stream_answer("q", trace=trace)
+        self.assertFinishedWithError(trace)
+
+    def test_retrieve_context(self):
+        trace = Trace()
+        with self.assertRaisesRegex(RuntimeError, "qdrant down"):
+            self.rag.retrieve_context("q", trace=trace)
+        self.assertFinishedWithError(trace)
+
+
+class AsyncRetrievalErrorTest(_RagTest, unittest.IsolatedAsyncioTestCase):
+    async def test_astream_answer(self):
+        trace = Trace()
+        with self.assertRaisesRegex(RuntimeError, "qdrant down"):
+            await self.rag.astream_answer("q", trace=trace)
+        self.assertFinishedWithError(trace)
+
+    async def test_aretrieve_context(self):
+        trace = Trace()
+        with self.assertRaisesRegex(RuntimeError, "qdrant down"):
+            await self.rag.aretrieve_context("q", trace=trace)
+        self.assertFinishedWithError(trace)
+
+
+if __name__ == "__main__":
+    unittest.main()
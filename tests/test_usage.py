@@ -0,0 +1,50 @@
+"""
+Tests for deferred embedding-token counting in src.usage.
+
+Run from the repo root:
+    python -m unittest discover tests
+"""
+
+import unittest
+from unittest import mock
+
+from src import usage
+from src.tracing import Trace
+
+
+def _count_words(texts):
+    return sum(len(t.split()) for t in texts)
+
+
+class EmbeddingCountTest(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(usage, "count_tokens", _count_words)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_counted_immediately_outside_a_trace(self):
+        u = usage.record("embed.query", "test-model", texts=["one two three"])
+        self.assertEqual(u.prompt_tokens, 3)
+        self.assertNotIn(id(u), usage._uncounted)
+
+    def test_counted_immediately_against_a_finished_trace(self):
+        trace = Trace()
+        trace.finish()
+        u = usage.record("embed.query", "test-model", texts=["one two"], trace=trace)
+        self.assertEqual(u.prompt_tokens, 2)
+        self.assertNotIn(id(u), usage._uncounted)
+        self.assertEqual(trace.usage, [])
+
+    def test_deferred_inside_an_open_trace(self):
+        trace = Trace()
+        u = usage.record("embed.query", "test-model", texts=["one two"], trace=trace)
+        self.assertEqual(u.prompt_tokens, 0)
+        self.assertIn(id(u), usage._uncounted)
+
+        spend = usage.summarise(trace.usage)
+        self.assertEqual(spend["total"]["prompt_tokens"], 2)
+        self.assertNotIn(id(u), usage._uncounted)
+
+
+if __name__ == "__main__":
+    unittest.main()